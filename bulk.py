@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-16
+@author: Wade Lieurance
+
+Shared bulk loading functions for the camera trap database. On PostgreSQL rows are streamed into an unlogged staging
+table with COPY and merged into their target table with a single INSERT ... SELECT ... ON CONFLICT statement. On SQLite
+rows are inserted with executemany in a single transaction.
+"""
+
+import sqlite3 as sqlite
+import time
+import pandas as pd
+import psycopg
+from typing import Union, Iterable
+
+
+def iter_rows(rows: Union[pd.DataFrame, Iterable], cols: tuple = None):
+    """yields plain tuples from a DataFrame (restricted to cols and with NaN converted to None) or passes through an
+    existing row iterator"""
+    if isinstance(rows, pd.DataFrame):
+        df = rows if cols is None else rows.loc[:, list(cols)]
+        df = df.astype(object).where(df.notna(), None)
+        yield from df.itertuples(index=False, name=None)
+    else:
+        yield from rows
+
+
+def read_frame(con: Union[sqlite.Connection, psycopg.Connection], sql: str, params=None) -> pd.DataFrame:
+    """reads a query into a DataFrame regardless of the row factory set on the connection (pandas cannot read
+    psycopg dict rows directly)"""
+    c = con.cursor()
+    c.execute(sql, params or ())
+    cols = [d[0] for d in c.description]
+    rows = c.fetchall()
+    if rows and isinstance(rows[0], dict):
+        rows = [tuple(r.values()) for r in rows]
+    return pd.DataFrame.from_records([tuple(r) for r in rows], columns=cols)
+
+
+def report_rate(label: str, n: int, start: float):
+    """prints the number of rows loaded and the load rate for a stage"""
+    secs = max(time.perf_counter() - start, 1e-6)
+    print(f"\t{label}: {n} rows in {secs:.1f}s ({n / secs:,.0f} rows/s)")
+
+
+def create_stage(con: Union[sqlite.Connection, psycopg.Connection], stage: str, col_defs: dict = None,
+                 like: str = None, cols: tuple = None):
+    """(re)creates a staging table. The columns are either given as {column: type} in col_defs or copied (names and
+    types) from cols of an existing table given in like. PostgreSQL staging tables are UNLOGGED, SQLite ones
+    TEMPORARY."""
+    c = con.cursor()
+    if isinstance(con, sqlite.Connection):
+        kind = 'TEMPORARY'
+    elif isinstance(con, psycopg.Connection):
+        kind = 'UNLOGGED'
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    c.execute(f"DROP TABLE IF EXISTS {stage};")
+    if col_defs is not None:
+        defs = ', '.join([f'{k} {v}' for k, v in col_defs.items()])
+        c.execute(f"CREATE {kind} TABLE {stage} ({defs});")
+    else:
+        c.execute(f"CREATE {kind} TABLE {stage} AS SELECT {', '.join(cols)} FROM {like} WHERE 1 = 0;")
+
+
+def load_rows(con: Union[sqlite.Connection, psycopg.Connection], table: str, cols: tuple,
+              rows: Union[pd.DataFrame, Iterable]) -> int:
+    """appends rows to table, using COPY on PostgreSQL and executemany on SQLite. Returns the number of rows loaded."""
+    c = con.cursor()
+    col_str = ', '.join(cols)
+    n = 0
+    if isinstance(con, sqlite.Connection):
+        ph_str = ', '.join(['?'] * len(cols))
+        c.executemany(f"INSERT INTO {table} ({col_str}) VALUES ({ph_str});", iter_rows(rows, cols))
+        n = c.rowcount
+    elif isinstance(con, psycopg.Connection):
+        with c.copy(f"COPY {table} ({col_str}) FROM STDIN") as copy:
+            for row in iter_rows(rows, cols):
+                copy.write_row(row)
+                n += 1
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    return n
+
+
+def stage_temp_table(con: Union[sqlite.Connection, psycopg.Connection], table: str, col_defs: dict, rows) -> int:
+    """(re)creates a temporary table with the given {column: type} definitions and fills it with rows (a DataFrame or
+    an iterable of tuples in col_defs order). Uses COPY for PostgreSQL connections."""
+    c = con.cursor()
+    defs = ', '.join([f'{k} {v}' for k, v in col_defs.items()])
+    c.execute(f"DROP TABLE IF EXISTS {table};")
+    c.execute(f"CREATE TEMPORARY TABLE {table} ({defs});")
+    return load_rows(con=con, table=table, cols=tuple(col_defs.keys()), rows=rows)
+
+
+def conflict_clause(keys: tuple = None, constraint: str = None, update_cols: tuple = None) -> str:
+    """builds a PostgreSQL ON CONFLICT clause which updates update_cols from the excluded row, or does nothing if
+    there are no columns to update"""
+    if constraint is not None:
+        target = f"ON CONSTRAINT {constraint}"
+    elif keys:
+        target = f"({', '.join(keys)})"
+    else:
+        target = ''
+    if update_cols:
+        excluded = ', '.join(['{} = EXCLUDED.{}'.format(x, x) for x in update_cols])
+        return f"ON CONFLICT {target} DO UPDATE SET {excluded}"
+    return "ON CONFLICT DO NOTHING"
+
+
+def merge_stage(con: psycopg.Connection, stage: str, table: str, cols: tuple, keys: tuple,
+                constraint: str = None, update_cols: tuple = None, select_sql: str = None) -> int:
+    """merges a PostgreSQL staging table into table with one INSERT ... SELECT ... ON CONFLICT. Duplicate keys in the
+    staging table are reduced to the last loaded row so that the merge matches row-by-row upsert behavior. A custom
+    select_sql (which must return cols, keys and a stage_ord ordering column) can be given instead of the staging
+    table."""
+    col_str = ', '.join(cols)
+    key_str = ', '.join(keys)
+    source = select_sql if select_sql is not None else f"SELECT *, ctid AS stage_ord FROM {stage}"
+    sql = '\n'.join((
+        f"INSERT INTO {table} ({col_str})",
+        f"SELECT DISTINCT ON ({key_str}) {col_str}",
+        f"  FROM ({source}) AS s",
+        f" ORDER BY {key_str}, stage_ord DESC",
+        conflict_clause(keys=keys, constraint=constraint, update_cols=update_cols) + ';'
+    ))
+    c = con.cursor()
+    c.execute(sql)
+    return c.rowcount
+
+
+def bulk_upsert(con: Union[sqlite.Connection, psycopg.Connection], table: str, rows: Union[pd.DataFrame, Iterable],
+                cols: tuple = None, keys: tuple = None, constraint: str = None, update_cols: tuple = None,
+                label: str = None) -> int:
+    """inserts rows into table, updating update_cols of existing rows which conflict on keys (or on constraint). If
+    update_cols is empty conflicting rows are left as they are. On SQLite this is an INSERT ... ON CONFLICT
+    executemany (INSERT OR REPLACE/IGNORE without keys); on PostgreSQL rows are COPY'd into an unlogged staging table
+    and merged in one statement. Returns the number of rows inserted or updated and prints the load rate."""
+    start = time.perf_counter()
+    if cols is None:
+        cols = tuple(rows.columns)
+    if update_cols is None:
+        update_cols = tuple([x for x in cols if x not in (keys or ())])
+    if isinstance(con, sqlite.Connection):
+        c = con.cursor()
+        ph_str = ', '.join(['?'] * len(cols))
+        if keys:
+            # an upsert rather than INSERT OR REPLACE, which deletes the existing row (firing ON DELETE actions of
+            # foreign keys referencing it) and resets any columns not given in cols
+            conflict = conflict_clause(keys=keys, update_cols=update_cols)
+            sql = f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({ph_str}) {conflict};"
+        else:
+            ignore = 'OR REPLACE' if update_cols else 'OR IGNORE'
+            sql = f"INSERT {ignore} INTO {table} ({', '.join(cols)}) VALUES ({ph_str});"
+        c.executemany(sql, iter_rows(rows, cols))
+        n = c.rowcount
+    elif isinstance(con, psycopg.Connection):
+        stage = f"{table}_stage"
+        create_stage(con=con, stage=stage, like=table, cols=cols)
+        load_rows(con=con, table=stage, cols=cols, rows=rows)
+        n = merge_stage(con=con, stage=stage, table=table, cols=cols, keys=keys, constraint=constraint,
+                        update_cols=update_cols)
+        con.cursor().execute(f"DROP TABLE IF EXISTS {stage};")
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    report_rate(label or table, n, start)
+    return n
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-17
+@author: Wade Lieurance
+
+Path classification for site and camera assignment. Regexes of the site csv (and, per site, of the camera csv) that
+are plain literals are found with a trie scanning each directory of the photo paths once. The others are indexed by a
+literal each one requires, so every path is scanned once for the keys it contains and only the rules behind those keys
+are searched. Rules are checked from the last csv row to the first, as later rows take precedence. Large path sets are
+classified in parallel worker processes. Run as a script to write the path to site and camera mapping of a database
+with its no match and ambiguity diagnostics.
+"""
+
+import os
+import re
+import argparse
+import functools
+import multiprocessing
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from photo_mgmt import create_db as cdb
+from bulk import read_frame
+from connection import pg_con
+from getpass import getpass
+
+
+# path sets smaller than this are classified in process, as starting workers would cost more than it saves
+PARALLEL_MIN_PATHS = 200000
+# the number of leading characters of a rule's required literal used to index it
+KEY_LEN = 8
+# escapes, character sets, counted quantifiers and single characters of a regex
+REGEX_TOKEN = re.compile(r'\\.|\[\^?\]?(?:\\.|[^\]\\])*\]|\{\d*,?\d*\}|.', re.S)
+
+
+def token_literal(tok: str):
+    """returns the character a regex token matches literally (e.g. '(' for the token '\\('), or None"""
+    if tok.startswith('\\'):
+        return tok[1:] if not tok[1:].isalnum() else None
+    return tok if len(tok) == 1 and tok not in '()|.^$*+?{[' else None
+
+
+def required_literal(regex: str) -> str:
+    """returns the longest run of literal characters that every match of regex contains ('' if none is found). Only
+    characters outside of groups count and a regex with top level alternation has none."""
+    tokens = REGEX_TOKEN.findall(regex)
+    runs = ['']
+    depth = 0
+    for tok, nxt in zip(tokens, tokens[1:] + ['']):
+        if tok == '(':
+            depth += 1
+        elif tok == ')':
+            depth -= 1
+        elif tok == '|' and depth == 0:
+            return ''
+        lit = token_literal(tok)
+        if depth > 0 or lit is None or nxt[:1] in ('*', '?', '{'):
+            runs.append('')
+        elif nxt == '+':
+            runs[-1] += lit
+            runs.append('')
+        else:
+            runs[-1] += lit
+    return max(runs, key=len)
+
+
+def literal_rule(regex: str):
+    """returns the text a regex matches if it is a plain literal once unescaped (e.g. 'Site A (2018)' for
+    'Site A \\(2018\\)'), or None if it is a real pattern"""
+    chars = [token_literal(tok) for tok in REGEX_TOKEN.findall(regex)]
+    if not chars or None in chars:
+        return None
+    return ''.join(chars)
+
+
+class LiteralTrie:
+    """finds the literal rules contained in paths. Literals are stored in a character trie and each directory of a
+    path is scanned once: the rules found in a directory prefix (ending in '/') are kept and a longer prefix or a whole
+    path only scans its last component, plus enough of the prefix before it for literals spanning the '/'. Paths
+    sharing directories therefore cost little more than their file names."""
+    def __init__(self, literals: dict):
+        self.root = {}
+        for i, lit in literals.items():
+            node = self.root
+            for ch in lit:
+                node = node.setdefault(ch, {})
+            node.setdefault(None, []).append(i)
+        self.overlap = max([len(x) for x in literals.values()], default=1) - 1
+        self.prefixes = {'': frozenset()}
+
+    def scan(self, text: str) -> set:
+        """returns the rules whose literal occurs in text"""
+        found = set()
+        root = self.root
+        for start in range(len(text)):
+            node = root.get(text[start])
+            i = start + 1
+            while node is not None:
+                if None in node:
+                    found.update(node[None])
+                if i == len(text):
+                    break
+                node = node.get(text[i])
+                i += 1
+        return found
+
+    def tail(self, head: str, name: str) -> set:
+        """returns the rules occurring in head + name, where head is '' or a directory prefix ending in '/'"""
+        found = self.prefix(head)
+        new = self.scan(head[max(len(head) - self.overlap, 0):] + name if self.overlap else name)
+        return found | new if new else found
+
+    def prefix(self, head: str) -> frozenset:
+        """returns the rules occurring in the directory prefix head, scanning each directory of it once"""
+        found = self.prefixes.get(head)
+        if found is None:
+            parent, sep, name = head[:-1].rpartition('/')
+            found = frozenset(self.tail(head=parent + sep, name=name + '/'))
+            self.prefixes[head] = found
+        return found
+
+    def match(self, path: str) -> set:
+        """returns the rules whose literal occurs in path"""
+        head, sep, name = path.rpartition('/')
+        return self.tail(head=head + sep, name=name)
+
+
+class PathRules:
+    """the rules (regexes) of a site or camera csv, numbered by row. Rules that are plain literals are found through a
+    LiteralTrie. The others are indexed by the first KEY_LEN characters of a literal each requires, so a path is only
+    searched with the few rules whose key it contains. Rules without a usable literal (e.g. case insensitive ones) are
+    searched for in every path and None rules never match."""
+    def __init__(self, regexes: tuple):
+        self.compiled = {}
+        self.keys = {}
+        self.always = []
+        literals = {}
+        for i, r in enumerate(regexes):
+            if r is None:
+                continue
+            lit = literal_rule(r)
+            if lit is not None:
+                literals[i] = lit
+                continue
+            self.compiled[i] = re.compile(r)
+            lit = '' if self.compiled[i].flags & (re.IGNORECASE | re.VERBOSE) else required_literal(r)
+            if lit:
+                self.keys.setdefault(lit[:KEY_LEN], []).append(i)
+            else:
+                self.always.append(i)
+        self.lengths = sorted({len(k) for k in self.keys})
+        self.trie = LiteralTrie(literals=literals) if literals else None
+
+    def match(self, path: str) -> tuple:
+        """returns the numbers of the last and second to last rules matching path (-1 if none)"""
+        found = self.trie.match(path) if self.trie is not None else set()
+        if self.compiled:
+            cand = set(self.always)
+            for n in self.lengths:
+                for k in self.keys.keys() & {path[i:i + n] for i in range(len(path) - n + 1)}:
+                    cand.update(self.keys[k])
+            hits = []
+            for i in sorted(found | cand, reverse=True):
+                if i in found or self.compiled[i].search(path):
+                    hits.append(i)
+                    if len(hits) == 2:
+                        return tuple(hits)
+        else:
+            hits = sorted(found, reverse=True)[:2]
+        return (hits + [-1, -1])[0], (hits + [-1, -1])[1]
+
+
+@functools.lru_cache(maxsize=None)
+def path_rules(regexes: tuple) -> PathRules:
+    """returns the PathRules of regexes, built once per process"""
+    return PathRules(regexes=regexes)
+
+
+def classify_paths(paths: list, regexes: tuple) -> tuple:
+    """returns, for each path, the number of the last rule in regexes that it matches and of the last other rule it
+    matches (-1 if none), as two lists"""
+    rules = path_rules(regexes=regexes)
+    first = []
+    second = []
+    for p in paths:
+        i, j = rules.match(p)
+        first.append(i)
+        second.append(j)
+    return first, second
+
+
+def classify_groups(groups: list, jobs: int = 1) -> list:
+    """classifies a list of (paths, regexes) groups, returning a (first, second) pair per group (see classify_paths).
+    If jobs > 1 and there are at least PARALLEL_MIN_PATHS paths in total, the groups are split into chunks classified
+    by a pool of jobs worker processes (at most one per CPU)."""
+    n = sum([len(p) for p, r in groups])
+    jobs = min(jobs, os.cpu_count() or 1)
+    if jobs <= 1 or n < PARALLEL_MIN_PATHS:
+        return [classify_paths(paths=p, regexes=r) for p, r in groups]
+    size = max(-(-n // (jobs * 4)), 1)
+    tasks = [(g, p[i:i + size], r) for g, (p, r) in enumerate(groups) for i in range(0, len(p), size)]
+    results = [([], []) for i in range(len(groups))]
+    # spawned rather than forked, so that no worker inherits an open database connection
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for (g, p, r), (first, second) in zip(tasks, pool.map(classify_paths, [t[1] for t in tasks],
+                                                               [t[2] for t in tasks])):
+            results[g][0].extend(first)
+            results[g][1].extend(second)
+    return results
+
+
+def classify_sites(photo: pd.DataFrame, sites: pd.DataFrame, jobs: int = 1) -> pd.DataFrame:
+    """matches every photo path against the site regexes. Returns path, site_name, the number of site regexes matched
+    (n_match: 0, 1 or 2 for two or more) and the site of the last other matching regex (other_site). Later rows in the
+    site csv take precedence when more than one regex matches; rows without a regex match nothing."""
+    regexes = tuple([None if pd.isna(x) else str(x) for x in sites['regex']])
+    names = sites['site_name'].astype(str).tolist()
+    for name, r in zip(names, regexes):
+        if r is None:
+            print("Site regex field cannot be found for", name)
+    paths = photo['path'].tolist()
+    first, second = classify_groups(groups=[(paths, regexes)], jobs=jobs)[0]
+    return pd.DataFrame({
+        'path': paths,
+        'site_name': [None if i < 0 else names[i] for i in first],
+        'n_match': [0 if i < 0 else 1 if j < 0 else 2 for i, j in zip(first, second)],
+        'other_site': [None if j < 0 else names[j] for j in second]
+    }, index=photo.index)
+
+
+def classify_cameras(photo: pd.DataFrame, cameras: pd.DataFrame, jobs: int = 1) -> pd.DataFrame:
+    """matches photo paths (which must already have a site_name) against the camera regexes of their own site only.
+    Returns path, camera_id, the number of camera rows matched (n_match: 0, 1 or 2 for two or more) and the camera of
+    the last other matching row (other_camera). A camera row without a regex matches every photo of its site and later
+    rows in the camera csv take precedence. Sites are matched by name as text (a csv of numeric site names reads them
+    as numbers)."""
+    site_rules = {}
+    for row in cameras.to_dict('records'):
+        site_rules.setdefault(str(row['site_name']), []).append(
+            ('' if pd.isna(row['regex']) else str(row['regex']), str(row['camera_id'])))
+    groups = []
+    keys = []
+    for site, idx in photo.groupby('site_name').groups.items():
+        rules = site_rules.get(str(site))
+        if rules is None:
+            continue
+        keys.append((idx, [x[1] for x in rules]))
+        groups.append((photo['path'].loc[idx].tolist(), tuple([x[0] for x in rules])))
+    camera_id = pd.Series(None, index=photo.index, dtype=object)
+    n_match = pd.Series(0, index=photo.index, dtype='int64')
+    other = pd.Series(None, index=photo.index, dtype=object)
+    for (idx, ids), (first, second) in zip(keys, classify_groups(groups=groups, jobs=jobs)):
+        camera_id.loc[idx] = [None if i < 0 else ids[i] for i in first]
+        n_match.loc[idx] = [0 if i < 0 else 1 if j < 0 else 2 for i, j in zip(first, second)]
+        other.loc[idx] = [None if j < 0 else ids[j] for j in second]
+    return pd.DataFrame({'path': photo['path'], 'camera_id': camera_id, 'n_match': n_match, 'other_camera': other})
+
+
+def report_matches(assigned: pd.DataFrame, column: str, other: str, label: str, top: int = 10) -> pd.DataFrame:
+    """prints the number of paths matching no rule and more than one rule, and the most common ambiguous pairs (the
+    rule used and the other rule matched) with an example path. Returns the ambiguous pairs."""
+    no_match = int((assigned['n_match'] == 0).sum())
+    multi = assigned[assigned['n_match'] > 1]
+    print(f"\t{no_match} photos matched no {label} regex.")
+    if len(multi) == 0:
+        return pd.DataFrame(columns=[column, other, 'n', 'example'])
+    pairs = multi.groupby([column, other]).agg(n=('path', 'size'), example=('path', 'first')).reset_index()\
+        .sort_values('n', ascending=False)
+    print(f"\t{len(multi)} photos matched more than one {label} regex (last matching {label} in csv used):")
+    for row in pairs.head(top).to_dict('records'):
+        print(f"\t\t{row[column]} used over {row[other]}: {row['n']} photos (e.g. {row['example']})")
+    return pairs
+
+
+if __name__ == "__main__":
+    # parses script arguments
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='This script will match the photo paths of a camera trap database to sites and cameras and write '
+                    'the mapping to a csv.')
+    # positional arguments
+    parser.add_argument('out_path', help='the path of the csv to write.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--dbpath', help='the path of the spatialite database to read photo paths from.')
+    group.add_argument('--db', help='the PostgreSQL database to which to connect.')
+    args_pg = parser.add_argument_group('PostgreSQL')
+    args_pg.add_argument('--host', default='localhost')
+    args_pg.add_argument('--user', default='postgres')
+    args_pg.add_argument('--port', default=5432, type=int)
+    args_pg.add_argument('--passwd', help="Password for user.")
+    args_pg.add_argument('--noask', action='store_true',
+                         help="User will not be prompted for password if none given.")
+    parser.add_argument('-s', '--site', required=True, help='path to a csv file containing site data.')
+    parser.add_argument('-c', '--camera', help='path to a csv file containing camera data.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='the number of processes to classify paths with.')
+    args = parser.parse_args()
+
+    if args.dbpath:
+        conn = cdb.get_sqlite_con(dbpath=args.dbpath, geo=True)
+    else:
+        if args.passwd is None and not args.noask:
+            args.passwd = getpass()
+        conn = pg_con(user=args.user, database=args.db, password=args.passwd, host=args.host, port=args.port)
+    photos = read_frame(conn, "SELECT path FROM photo;")
+    conn.close()
+    print("Matching sites...")
+    mapping = classify_sites(photo=photos, sites=pd.read_csv(args.site, sep=','), jobs=args.jobs)
+    report_matches(assigned=mapping, column='site_name', other='other_site', label='site')
+    mapping = mapping.rename(columns={'n_match': 'n_site'})
+    if args.camera:
+        print("Matching cameras...")
+        cams = classify_cameras(photo=mapping.loc[mapping['site_name'].notna(), ['path', 'site_name']],
+                                cameras=pd.read_csv(args.camera, sep=','), jobs=args.jobs)
+        report_matches(assigned=cams, column='camera_id', other='other_camera', label='camera')
+        mapping = mapping.merge(cams.rename(columns={'n_match': 'n_camera'}), how='left', on='path')
+    mapping.to_csv(args.out_path, index=False)
+    print("Script complete.")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-17
+@author: Wade Lieurance
+
+Shared database connections for the camera trap scripts. Rather than opening (and configuring, and loading
+mod_spatialite into) a new connection for every query, functions ask for the connection to a database with sqlite_con
+or pg_con and get back the same long-lived connection each time. SQLite connections are opened once per database and
+thread with the row factory and pragmas set and a larger prepared statement cache, and mod_spatialite is loaded the
+first time a caller needs it. PostgreSQL connections are kept one per database and user and prepare statements they
+run repeatedly on the server. Connections are closed when the script exits.
+"""
+
+import os
+import atexit
+import threading
+import sqlite3 as sqlite
+import psycopg
+import psycopg.pq
+from photo_mgmt import create_db as cdb
+
+# open connections by (dbpath, thread) for SQLite and (host, port, database, user) for PostgreSQL
+CONNECTIONS = {}
+# SQLite connections mod_spatialite has been loaded into
+SPATIAL = set()
+SQLITE_PRAGMAS = ("PRAGMA temp_store = MEMORY;", "PRAGMA cache_size = -65536;")
+# prepared statements kept per SQLite connection (the sqlite3 default is 128)
+STATEMENT_CACHE = 512
+# executions of a query after which PostgreSQL connections prepare it (the psycopg default is 5)
+PREPARE_THRESHOLD = 2
+
+
+def is_open(con: sqlite.Connection) -> bool:
+    try:
+        con.total_changes
+        return True
+    except sqlite.ProgrammingError:
+        return False
+
+
+def sqlite_con(dbpath: str, spatial: bool = False) -> sqlite.Connection:
+    """returns the shared connection to a SQLite database for the calling thread, opening it on first use. Rows are
+    returned as sqlite.Row. spatial loads mod_spatialite into the connection if it is not loaded already."""
+    key = (dbpath if dbpath == ':memory:' else os.path.abspath(dbpath), threading.get_ident())
+    con = CONNECTIONS.get(key)
+    if con is None or not is_open(con):
+        # check_same_thread is off only so that close_all can close every thread's connection at exit
+        con = sqlite.connect(dbpath, cached_statements=STATEMENT_CACHE, check_same_thread=False)
+        con.row_factory = sqlite.Row
+        for pragma in SQLITE_PRAGMAS:
+            con.execute(pragma)
+        CONNECTIONS[key] = con
+        SPATIAL.discard(key)
+    if spatial and key not in SPATIAL:
+        con.enable_load_extension(True)
+        con.execute("SELECT load_extension('mod_spatialite');")
+        con.enable_load_extension(False)
+        SPATIAL.add(key)
+    return con
+
+
+def pg_con(user: str, database: str, password: str = None, host: str = 'localhost',
+           port: int = 5432) -> psycopg.Connection:
+    """returns the shared connection to a PostgreSQL database, opening it on first use or if it was closed or broken.
+    A transaction left failed by an earlier caller is rolled back."""
+    key = (host, port, database, user)
+    con = CONNECTIONS.get(key)
+    if con is None or con.closed or con.broken:
+        con = cdb.get_pg_con(user=user, database=database, password=password, host=host, port=port)
+        con.prepare_threshold = PREPARE_THRESHOLD
+        CONNECTIONS[key] = con
+    elif con.info.transaction_status == psycopg.pq.TransactionStatus.INERROR:
+        con.rollback()
+    return con
+
+
+def close_all():
+    """closes every shared connection. Uncommitted changes are rolled back."""
+    for key, con in list(CONNECTIONS.items()):
+        try:
+            con.close()
+        except (sqlite.Error, psycopg.Error):
+            pass
+        del CONNECTIONS[key]
+    SPATIAL.clear()
+
+
+atexit.register(close_all)
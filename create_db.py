@@ -9,14 +9,28 @@ This script will create and fill a camera trap database.
 
 import os
 import argparse
+import time
+import shutil
+import tempfile
+import contextlib
+import multiprocessing
 import sqlite3 as sqlite
 import pandas as pd
 import numpy as np
 import psycopg
 import psycopg.rows
 from photo_mgmt import create_db as cdb
+from indexes import create_stage_indexes, analyze_stage, finalize_indexes, STAGE_INDEXES
+from ledger import StageLedger, file_hash, table_state
+from export_animal import export_animal_select, create_export_table, refresh_export_animal
+from classify import classify_sites, classify_cameras, report_matches
+from profiler import start_profile, profile_stage
+from connection import pg_con
+from bulk import bulk_upsert, stage_temp_table, report_rate, read_frame, create_stage, load_rows, merge_stage, \
+    conflict_clause
 from typing import Union
 from getpass import getpass
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 def db_is_spatial(con):
@@ -66,10 +80,11 @@ def create_animal_tables(con: Union[sqlite.Connection, psycopg.Connection], verb
 
     create_list = [
         '\n'.join((
-            "CREATE TABLE IF NOT EXISTS area("
-            "    area_name VARCHAR PRIMARY KEY,",
+            "CREATE TABLE IF NOT EXISTS area(",
+            "    area_name VARCHAR,",
             "    area_type VARCHAR,",
-            f"    {site_geom}));")),
+            f"    {site_geom}",
+            "    PRIMARY KEY(area_name));")),
         '\n'.join((
             "CREATE TABLE IF NOT EXISTS site(",
             "    site_name VARCHAR,",
@@ -103,6 +118,25 @@ def create_animal_tables(con: Union[sqlite.Connection, psycopg.Connection], verb
             "    FOREIGN KEY(site_name, camera_id) REFERENCES camera(site_name, camera_id)",
             "            ON DELETE CASCADE ON UPDATE CASCADE,",
             "    PRIMARY KEY(seq_id));")),
+        '\n'.join((
+            "CREATE TABLE IF NOT EXISTS season (",
+            "    site_name VARCHAR,",
+            "    camera_id VARCHAR,",
+            "    year_orig INTEGER,",
+            f"    start_dt {timestamp_tz},",
+            f"    end_dt {timestamp_tz},",
+            "    season_no INTEGER,",
+            "    PRIMARY KEY(site_name, camera_id, season_no));")),
+        '\n'.join((
+            "-- per camera photo summary as of the last season computation, used to find cameras needing an update",
+            "CREATE TABLE IF NOT EXISTS season_watermark (",
+            "    site_name VARCHAR,",
+            "    camera_id VARCHAR,",
+            "    n_photo INTEGER,",
+            f"    min_dt {timestamp_tz},",
+            f"    max_dt {timestamp_tz},",
+            "    season_break INTEGER,",
+            "    PRIMARY KEY(site_name, camera_id));")),
         '\n'.join((
             "CREATE TABLE IF NOT EXISTS generation (",
             "    gen_id VARCHAR,",
@@ -140,7 +174,7 @@ def create_animal_tables(con: Union[sqlite.Connection, psycopg.Connection], verb
             "    FOREIGN KEY(md5hash) REFERENCES hash(md5hash) ON DELETE CASCADE,",
             "    FOREIGN KEY(seq_id) REFERENCES sequence(seq_id) ON DELETE SET NULL ON UPDATE CASCADE);")),
         '\n'.join((
-            "CREATE TABLE animal_loc (",
+            "CREATE TABLE IF NOT EXISTS animal_loc (",
             "    md5hash VARCHAR(32) NOT NULL,",
             "    id VARCHAR NOT NULL,",
             "    classifier VARCHAR,",
@@ -151,6 +185,13 @@ def create_animal_tables(con: Union[sqlite.Connection, psycopg.Connection], verb
             "    CONSTRAINT loc_unique UNIQUE (md5hash, id, classifier, x1, y1, x2, y2),",
             "    FOREIGN KEY (md5hash, id) REFERENCES animal(md5hash, id) ON UPDATE CASCADE ON DELETE CASCADE)"
         )),
+        '\n'.join((
+            "CREATE TABLE IF NOT EXISTS condition_seqs (",
+            "    seq_id VARCHAR,",
+            "    scorer_name VARCHAR,",
+            "    scores BOOLEAN,",
+            "    PRIMARY KEY(seq_id, scorer_name),",
+            "    FOREIGN KEY(seq_id) REFERENCES sequence(seq_id) ON DELETE RESTRICT ON UPDATE CASCADE);")),
         '\n'.join((
             "CREATE TABLE IF NOT EXISTS condition (",
             "    md5hash VARCHAR(32),",
@@ -165,14 +206,7 @@ def create_animal_tables(con: Union[sqlite.Connection, psycopg.Connection], verb
             "    PRIMARY KEY(md5hash, seq_id, scorer_name, bbox_x1, bbox_y1, bbox_x2, bbox_y2),",
             "    FOREIGN KEY(seq_id, scorer_name) REFERENCES condition_seqs(seq_id, scorer_name)",
             "            ON DELETE RESTRICT ON UPDATE CASCADE,",
-            "    FOREIGN KEY(md5hash) REFERENCES hash(md5hash) ON DELETE CASCADE);")),
-        '\n'.join((
-            "CREATE TABLE IF NOT EXISTS condition_seqs (",
-            "    seq_id VARCHAR,",
-            "    scorer_name VARCHAR,",
-            "    scores BOOLEAN,",
-            "    PRIMARY KEY(seq_id, scorer_name),",
-            "    FOREIGN KEY(seq_id) REFERENCES sequence(seq_id) ON DELETE RESTRICT ON UPDATE CASCADE);"))
+            "    FOREIGN KEY(md5hash) REFERENCES hash(md5hash) ON DELETE CASCADE);"))
     ]
     for sql in create_list:
         if verbose:
@@ -256,17 +290,107 @@ def create_animal_tables(con: Union[sqlite.Connection, psycopg.Connection], verb
                 print('-----------------------------------------------------')
             c.execute(sql)
     con.commit()
+    create_epoch_columns(con=con)
+
+
+def epoch_expressions(con: Union[sqlite.Connection, psycopg.Connection], prefix: str = '') -> dict:
+    """returns the SQL expressions deriving the numeric date columns from the text/timestamp date columns of photo
+    (dt_epoch, date_orig, mmdd_orig), condition (score_epoch) and sequence (min_epoch, max_epoch). Epochs are UTC
+    seconds; date_orig (YYYYMMDD) and mmdd_orig (MMDD) are the local calendar date of dt_orig. prefix qualifies the
+    source columns (e.g. 'NEW.')."""
+    p = prefix
+    if isinstance(con, sqlite.Connection):
+        return {
+            'dt_epoch': f"CAST(strftime('%s', coalesce({p}dt_orig, {p}dt_mod)) AS INTEGER)",
+            'date_orig': f"CAST(strftime('%Y%m%d', substr({p}dt_orig, 1, 19)) AS INTEGER)",
+            'mmdd_orig': f"CAST(strftime('%m%d', substr({p}dt_orig, 1, 19)) AS INTEGER)",
+            'score_epoch': f"CAST(strftime('%s', {p}score_dt) AS INTEGER)",
+            'min_epoch': f"CAST(strftime('%s', {p}min_dt) AS INTEGER)",
+            'max_epoch': f"CAST(strftime('%s', {p}max_dt) AS INTEGER)"
+        }
+    elif isinstance(con, psycopg.Connection):
+        return {
+            'dt_epoch': f"floor(extract(epoch FROM coalesce({p}dt_orig, {p}dt_mod)))::bigint",
+            'date_orig': f"to_char({p}dt_orig, 'YYYYMMDD')::integer",
+            'mmdd_orig': f"to_char({p}dt_orig, 'MMDD')::integer",
+            'score_epoch': f"floor(extract(epoch FROM {p}score_dt))::bigint",
+            'min_epoch': f"floor(extract(epoch FROM {p}min_dt))::bigint",
+            'max_epoch': f"floor(extract(epoch FROM {p}max_dt))::bigint"
+        }
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+
+
+def add_columns(con: Union[sqlite.Connection, psycopg.Connection], table: str, col_defs: dict):
+    """adds any of the {column: type} columns missing from an existing table"""
+    c = con.cursor()
+    if isinstance(con, sqlite.Connection):
+        cols = read_frame(con, f"PRAGMA table_info({table});")['name'].tolist()
+        for k, v in col_defs.items():
+            if k not in cols:
+                c.execute(f"ALTER TABLE {table} ADD COLUMN {k} {v};")
+    elif isinstance(con, psycopg.Connection):
+        adds = ',\n'.join([f"  ADD COLUMN IF NOT EXISTS {k} {v}" for k, v in col_defs.items()])
+        c.execute(f"ALTER TABLE {table}\n{adds};")
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+
+
+def create_epoch_columns(con: Union[sqlite.Connection, psycopg.Connection]):
+    """adds numeric date columns to photo, sequence and condition so that date arithmetic, ordering and filtering need
+    not parse the text dates of each row. photo and condition values are filled here where missing and, on SQLite, kept
+    current for newly imported rows by triggers. sequence values are filled here where missing and otherwise set by
+    populate_sequences."""
+    add_columns(con=con, table='photo', col_defs={'dt_epoch': 'BIGINT', 'date_orig': 'INTEGER', 'mmdd_orig': 'INTEGER'})
+    add_columns(con=con, table='sequence', col_defs={'min_epoch': 'BIGINT', 'max_epoch': 'BIGINT'})
+    add_columns(con=con, table='condition', col_defs={'score_epoch': 'BIGINT'})
+    c = con.cursor()
+    exprs = epoch_expressions(con=con)
+    photo_set = ', '.join([f"{k} = {exprs[k]}" for k in ['dt_epoch', 'date_orig', 'mmdd_orig']])
+    c.execute(f"UPDATE photo SET {photo_set} WHERE dt_epoch IS NULL AND coalesce(dt_orig, dt_mod) IS NOT NULL;")
+    c.execute(f"UPDATE condition SET score_epoch = {exprs['score_epoch']} "
+              "WHERE score_epoch IS NULL AND score_dt IS NOT NULL;")
+    c.execute(f'UPDATE "sequence" SET min_epoch = {exprs["min_epoch"]}, max_epoch = {exprs["max_epoch"]} '
+              "WHERE min_epoch IS NULL AND min_dt IS NOT NULL;")
+    if isinstance(con, sqlite.Connection):
+        new = epoch_expressions(con=con, prefix='NEW.')
+        new_set = ', '.join([f"{k} = {new[k]}" for k in ['dt_epoch', 'date_orig', 'mmdd_orig']])
+        trigger_list = [
+            ('photo_epoch_insert', 'AFTER INSERT ON photo',
+             f"UPDATE photo SET {new_set} WHERE path = NEW.path;"),
+            ('photo_epoch_update', 'AFTER UPDATE OF dt_orig, dt_mod ON photo',
+             f"UPDATE photo SET {new_set} WHERE path = NEW.path;"),
+            ('condition_epoch_insert', 'AFTER INSERT ON condition',
+             f"UPDATE condition SET score_epoch = {new['score_epoch']} WHERE rowid = NEW.rowid;"),
+        ]
+        for name, event, body in trigger_list:
+            c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event}\nBEGIN\n    {body}\nEND;")
+    con.commit()
+
+
+def upgrade_epoch_columns(con: Union[sqlite.Connection, psycopg.Connection]) -> bool:
+    """adds and fills the numeric date columns (see create_epoch_columns) of a database built before create_db.py
+    created them. Returns True if any were missing."""
+    expected = {'photo': ('dt_epoch', 'date_orig', 'mmdd_orig'), 'sequence': ('min_epoch', 'max_epoch'),
+                'condition': ('score_epoch',)}
+    for table, cols in expected.items():
+        if isinstance(con, sqlite.Connection):
+            found = read_frame(con, f'PRAGMA table_info("{table}");')['name'].tolist()
+        else:
+            found = read_frame(con, "SELECT column_name AS name FROM information_schema.columns "
+                                    f"WHERE table_name = '{table}';")['name'].tolist()
+        if not all(x in found for x in cols):
+            print("Adding numeric date columns (the database predates them)...")
+            create_epoch_columns(con=con)
+            return True
+    return False
 
 
 def create_animal_views(con: Union[sqlite.Connection, psycopg.Connection], verbose: bool = False):
     if isinstance(con, sqlite.Connection):
-        group_concat = 'group_concat'
-        concat = "{} || ',' || {} || ',' || {} || ',' || {}"
         exists = "IF NOT EXISTS"
         replace = ""
     elif isinstance(con, psycopg.Connection):
-        group_concat = 'string_agg'
-        concat = "concat_ws(',', {}, {}, {}, {})"
         exists = ""
         replace = "OR REPLACE"
     else:
@@ -286,22 +410,10 @@ def create_animal_views(con: Union[sqlite.Connection, psycopg.Connection], verbo
             '  LEFT JOIN gen_count b ON a.gen_id = b.gen_id;')),
         '\n'.join((
             f"CREATE {replace} VIEW {exists} export_animal AS",
-            "WITH coords_long AS (",
-            "SELECT CASE WHEN a.local = True THEN a.base_path || '/' || b.path",
-            '            ELSE b.path END "path",',
-            f"       c.id, c.cnt, c.classifier, {concat} coords".format('d.x1', 'd.y1', 'd.x2', 'd.y2'),
-            "  FROM import a",
-            " INNER JOIN photo b ON a.import_date = b.dt_import",
-            " INNER JOIN animal c ON b.md5hash = c.md5hash",
-            "  LEFT JOIN animal_loc d ON c.md5hash = d.md5hash AND c.id = d.id",
-            "",
-            "), coords_wide AS (",
-            f"""SELECT "path", id, cnt, classifier, {group_concat}(coords, '|') coords""",
-            "  FROM coords_long",
-            ' GROUP BY "path", id, cnt, classifier',
-            ")",
-            "",
-            "SELECT * FROM coords_wide;"
+            'SELECT "path", id, cnt, classifier, coords',
+            "  FROM (",
+            export_animal_select(con=con),
+            ") AS e;"
         ))
     ]
 
@@ -356,7 +468,25 @@ def copy_data_sqlite(dbpath, photo_db, remove_thumbnail, tags):
     c.execute("UPDATE photo SET year_orig = CAST(strftime('%Y', dt_orig) AS INTEGER);")
 
 
-def populate_sites(con: Union[sqlite.Connection, psycopg.Connection], site_csv: str):
+def assign_photo_column(con: Union[sqlite.Connection, psycopg.Connection], column: str, assign: pd.DataFrame):
+    """sets photo.<column> from a DataFrame of (path, value) pairs by staging the pairs in a temporary table and
+    applying them with a single joined UPDATE. Returns the number of photo rows updated."""
+    start = time.perf_counter()
+    stage_temp_table(con=con, table='photo_assign', col_defs={'path': 'VARCHAR PRIMARY KEY', 'value': 'VARCHAR'},
+                     rows=assign.itertuples(index=False, name=None))
+    c = con.cursor()
+    c.execute('\n'.join((
+        f"UPDATE photo SET {column} = s.value",
+        "  FROM photo_assign AS s",
+        " WHERE photo.path = s.path;"
+    )))
+    updated = c.rowcount
+    c.execute("DROP TABLE IF EXISTS photo_assign;")
+    report_rate(f"photo.{column}", updated, start)
+    return updated
+
+
+def populate_sites(con: Union[sqlite.Connection, psycopg.Connection], site_csv: str, jobs: int = 1):
     sites = pd.read_csv(site_csv, sep=',')
     allowed_cols = ['site_name', 'state_code', 'desc']
     # restricts columns to just valid cols that exist in the csv
@@ -365,48 +495,22 @@ def populate_sites(con: Union[sqlite.Connection, psycopg.Connection], site_csv:
     if 'site_name' not in cols:
         print(site_csv, "must have at least the 'site_name' field. Aborting site imports...")
         return
-    update_cols = [x for x in cols if x != 'site_name']
-    u = con.cursor()
-
-    if isinstance(con, sqlite.Connection):
-        ph = '?'
-        ignore = 'OR REPLACE'
-        conflict = ''
-        ph_str = ', '.join([':{}'.format(x) for x in cols])
-    elif isinstance(con, psycopg.Connection):
-        ph = '%s'
-        ignore = ''
-        excluded = ', '.join(['{} = EXCLUDED.{}'.format(x, x) for x in update_cols])
-        ph_str = ', '.join(['%({})s'.format(x) for x in cols])
-        if excluded:
-            conflict = f'ON CONFLICT (site_name) DO UPDATE SET {excluded}'
-        else:
-            conflict = 'ON CONFLICT DO NOTHING'
-    else:
-        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
-    col_str = ', '.join(cols)
-
-    ins_sql = f"INSERT {ignore} INTO site ({col_str}) VALUES ({ph_str}) {conflict};"
-
-    u.executemany(ins_sql, site_ins.to_dict('records'))
+    bulk_upsert(con=con, table='site', rows=site_ins, keys=('site_name',))
     con.commit()
-    # site_ins.to_sql('site', con=con, if_exists='append', index=False)
 
     # populate site_names in photo table
-    photo = pd.read_sql_query("SELECT * from photo", con)
-    for row in sites.to_dict('records'):
-        r = row['regex']
-        if r is None:
-            print("Site regex field cannot be found for", row['site_name'])
-            continue
-        site_name = row['site_name']
-        subset = photo[photo.path.str.contains(r, regex=True, na=False)]
-        for row2 in subset.to_dict('records'):
-            u.execute(f"UPDATE photo SET site_name = {ph} WHERE md5hash = {ph};", (site_name, row2['md5hash']))
+    if 'regex' not in sites.columns:
+        print("No regex field found in site csv. Skipping site assignment in photo table.")
+        return
+    photo = read_frame(con, "SELECT path FROM photo;")
+    assigned = classify_sites(photo=photo, sites=sites, jobs=jobs)
+    report_matches(assigned=assigned, column='site_name', other='other_site', label='site')
+    matched = assigned.loc[assigned['n_match'] > 0, ['path', 'site_name']]
+    assign_photo_column(con=con, column='site_name', assign=matched)
     con.commit()
 
 
-def populate_cameras(con: Union[sqlite.Connection, psycopg.Connection], camera_csv: str):
+def populate_cameras(con: Union[sqlite.Connection, psycopg.Connection], camera_csv: str, jobs: int = 1):
     spatial, spatver = db_is_spatial(con=con)
     cameras = pd.read_csv(camera_csv, sep=',')
     allowed_cols = ['site_name', 'camera_id', 'fov_length_m', 'fov_area_sqm', 'lat', 'long', 'elev_m', 'desc']
@@ -416,31 +520,14 @@ def populate_cameras(con: Union[sqlite.Connection, psycopg.Connection], camera_c
     if not all(x in cols for x in ['site_name', 'camera_id']):
         print(camera_csv, "must have at least the 'site_name' and 'camera_id' fields. Aborting camera imports...")
         return
-    update_cols = [x for x in cols if x not in ['site_name', 'camera_id']]
     u = con.cursor()
     if isinstance(con, sqlite.Connection):
         mp = 'MakePointZ(long, lat, elev_m, 4326)'
-        ph = '?'
-        ignore = 'OR REPLACE'
-        conflict = ''
-        ph_str = ', '.join([':{}'.format(x) for x in cols])
     elif isinstance(con, psycopg.Connection):
         mp = 'ST_SetSRID(ST_MakePoint(long, lat, elev_m), 4326)'
-        ph = '%s'
-        ignore = ''
-        excluded = ', '.join(['{} = EXCLUDED.{}'.format(x, x) for x in update_cols])
-        ph_str = ', '.join(['%({})s'.format(x) for x in cols])
-        if excluded:
-            conflict = f'ON CONFLICT (site_name) DO UPDATE SET {excluded}'
-        else:
-            conflict = 'ON CONFLICT DO NOTHING'
     else:
         raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
-
-    col_str = ', '.join(cols)
-    ins_sql = f"INSERT {ignore} INTO camera ({col_str}) VALUES ({ph_str}) {conflict};"
-    u.executemany(ins_sql, camera_ins.to_dict('records'))
-    # camera_ins.to_sql('camera', con=con, if_exists='append', index=False)
+    bulk_upsert(con=con, table='camera', rows=camera_ins, keys=('site_name', 'camera_id'))
 
     # populate geometry from columns
 
@@ -464,361 +551,824 @@ def populate_cameras(con: Union[sqlite.Connection, psycopg.Connection], camera_c
         print("No regex field found in camera csv. Setting all camera_id values to '1' in photo table.")
         u.execute("UPDATE photo SET camera_id = '1' WHERE camera_id IS NULL;")
     else:
-        for index, row in cameras.iterrows():
-            r = row['regex']
-            camera_id = str(row['camera_id'])
-            site_name = row['site_name']
-            photo = pd.read_sql_query(f"SELECT * from photo WHERE site_name = {ph};", con=con, params=(site_name,))
-            if r is not np.nan:
-                subset = photo[photo.path.str.contains(r, regex=True, na=False)]
-            else:
-                subset = photo
-            for index2, row2 in subset.iterrows():
-                u.execute(f"UPDATE photo SET camera_id = {ph} WHERE md5hash = {ph};", (camera_id, row2['md5hash']))
-    con.commit()
+        photo = read_frame(con, "SELECT path, site_name FROM photo WHERE site_name IS NOT NULL;")
+        assigned = classify_cameras(photo=photo, cameras=cameras, jobs=jobs)
+        report_matches(assigned=assigned, column='camera_id', other='other_camera', label='camera')
+        matched = assigned.loc[assigned['n_match'] > 0, ['path', 'camera_id']]
+        assign_photo_column(con=con, column='camera_id', assign=matched)
+        con.commit()
 
 
-def populate_seasons(con: Union[sqlite.Connection, psycopg.Connection], season_break: int):
-    if isinstance(con, sqlite.Connection):
-        julian_func = "julianday({})"
-    elif isinstance(con, psycopg.Connection):
-        julian_func = "extract(julian from {})"
-    else:
+def populate_seasons(con: Union[sqlite.Connection, psycopg.Connection], season_break: int, overwrite: bool = False):
+    """assigns photos a season_no and season_order within their site/camera and stores each season's date range in
+    the season table. A season starts after a gap of more than season_break days between photos. Only cameras whose
+    photos changed since the last run (per season_watermark), or all cameras if overwrite is True, are recomputed."""
+    if not isinstance(con, (sqlite.Connection, psycopg.Connection)):
         raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
-    c = con.cursor()
+    cam_join = ' AND '.join([f"coalesce(p.{x}, 'none') = d.{x}" for x in ['site_name', 'camera_id']])
+    dirty_sql = '\n'.join((
+        "CREATE TEMPORARY TABLE season_dirty AS",
+        "-- summarizes photos per camera and compares them to the watermark of the last season computation",
+        "WITH cams AS (",
+        "SELECT coalesce(site_name, 'none') site_name, coalesce(camera_id, 'none') camera_id,",
+        "       count(*) AS n_photo, min(coalesce(dt_orig, dt_mod)) AS min_dt,",
+        "       max(coalesce(dt_orig, dt_mod)) AS max_dt,",
+        "       sum(CASE WHEN season_no IS NULL THEN 1 ELSE 0 END) AS n_unseasoned",
+        "  FROM photo",
+        " GROUP BY coalesce(site_name, 'none'), coalesce(camera_id, 'none')",
+        ")",
+        "",
+        f"SELECT a.site_name, a.camera_id, a.n_photo, a.min_dt, a.max_dt, {season_break} AS season_break",
+        "  FROM cams AS a",
+        "  LEFT JOIN season_watermark AS b ON a.site_name = b.site_name AND a.camera_id = b.camera_id",
+        "" if overwrite else " WHERE b.site_name IS NULL OR a.n_unseasoned > 0 OR a.n_photo <> b.n_photo",
+        "" if overwrite else f"    OR a.min_dt <> b.min_dt OR a.max_dt <> b.max_dt OR b.season_break <> {season_break}",
+        ";"
+    ))
     season_sql = '\n'.join((
-        "CREATE TABLE season AS",
+        "CREATE TEMPORARY TABLE photo_season AS",
         f"WITH lims (max_days) AS (VALUES ({season_break})",
         "",
-        "-- Creates a table comparing a photo date and the previous/next photo date",
+        "-- Compares each photo date of a camera needing an update with the previous photo date",
         "-- Uses dt_orig (EXIF metadata) primarily but also dt_mod (file modified date) as a fallback",
         "), lag_dts AS (",
-        "SELECT coalesce(site_name, 'none') site_name, coalesce(camera_id,'none') camera_id,",
-        "       year_orig, coalesce(dt_orig, dt_mod) dt_orig,",
-        "       lag(coalesce(dt_orig, dt_mod), 1)",
-        "           over(partition by site_name, camera_id order by dt_orig, dt_mod) as prev_dt,",
-        "       lead(coalesce(dt_orig, dt_mod), 1)",
-        "           over(partition by site_name, camera_id order by dt_orig, dt_mod) as next_dt",
-        "  FROM photo",
+        "SELECT p.path, d.site_name, d.camera_id, p.year_orig, p.dt_orig AS dt_raw, p.dt_mod,",
+        "       coalesce(p.dt_orig, p.dt_mod) dt_orig, p.dt_epoch,",
+        "       lag(p.dt_epoch, 1)",
+        "           over(partition by d.site_name, d.camera_id order by p.dt_orig, p.dt_mod, p.path) as prev_epoch",
+        "  FROM photo AS p",
+        f" INNER JOIN season_dirty AS d ON {cam_join}",
         "",
-        "-- Counts the number of days between prev/next photo dates",
-        "), day_cnt AS (",
-        "SELECT site_name, camera_id, year_orig, prev_dt, dt_orig, next_dt,",
-        f"   {julian_func} - {julian_func} AS prev_days,".format('dt_orig', 'prev_dt'),
-        f"   {julian_func} - {julian_func} AS next_days".format('next_dt', 'dt_orig'),
+        "-- Flags photos more than the break limit in days after the previous photo as season starts",
+        "), starts AS (",
+        "SELECT *,",
+        "       CASE WHEN dt_epoch - prev_epoch <= (SELECT max_days FROM lims) * 86400",
+        "            THEN 0 ELSE 1 END AS is_start",
         "  FROM lag_dts",
         "",
-        "-- Filters down records to just those that have a prev or next photo > break limit in days",
-        "), day_filt AS (",
-        "SELECT site_name, camera_id, year_orig, prev_dt, dt_orig, next_dt, prev_days, next_days",
-        "  FROM day_cnt",
-        " WHERE prev_days IS NULL OR prev_days > (SELECT max_days FROM lims)",
-        "    OR next_days IS NULL OR next_days > (SELECT max_days FROM lims)",
-        "",
-        "-- assigns a type to the record depending on if the previous data or next date > break limit",
-        "), starts_ends AS (",
-        "SELECT site_name, camera_id, year_orig, dt_orig,",
-        "       CASE WHEN prev_days IS NULL OR prev_days > (SELECT max_days FROM lims) THEN 'start'",
-        "                 WHEN next_days IS NULL OR next_days > (SELECT max_days FROM lims) THEN 'end'",
-        "                 ELSE NULL END AS date_type",
-        "  FROM day_filt",
-        "",
-        "-- creates a wide version of the long data given in start_ends with a start and end date for",
-        "-- each row",
-        "), breaks AS (",
-        "SELECT site_name, camera_id, year_orig, date_type, dt_orig AS start_dt,",
-        "       lead(dt_orig, 1) over(partition by site_name, camera_id order by dt_orig) as end_dt",
-        "  FROM starts_ends",
-        "",
-        "-- selects just start date_types as those are the ones that contain photos and also assigns",
-        "-- a season number",
-        "), season AS (",
-        "SELECT site_name, camera_id, year_orig, start_dt,",
-        "	   CASE WHEN end_dt IS NULL THEN start_dt ELSE end_dt END end_dt,",
-        "       row_number() over(partition by site_name, camera_id order by start_dt) AS season_no",
-        "  FROM breaks",
-        " WHERE date_type = 'start'",
+        "-- numbers seasons by counting the season starts up to each photo",
+        "), numbered AS (",
+        "SELECT *,",
+        "       sum(is_start) over(partition by site_name, camera_id order by dt_raw, dt_mod, path",
+        "                          ROWS UNBOUNDED PRECEDING) AS season_no",
+        "  FROM starts",
         ")",
         "",
-        "SELECT * FROM season ORDER BY site_name, camera_id, season_no;"
+        "-- assigns a season order based on dt_orig or dt_mod (fallback)",
+        "SELECT path, site_name, camera_id, year_orig, dt_orig, season_no,",
+        "       row_number() over(partition by site_name, camera_id, season_no order by dt_raw, dt_mod, path)",
+        "           AS season_order",
+        "  FROM numbered;"
+    ))
+    insert_sql = '\n'.join((
+        "INSERT INTO season (site_name, camera_id, year_orig, start_dt, end_dt, season_no)",
+        "SELECT site_name, camera_id, max(CASE WHEN season_order = 1 THEN year_orig END) AS year_orig,",
+        "       min(dt_orig) AS start_dt, max(dt_orig) AS end_dt, season_no",
+        "  FROM photo_season",
+        " GROUP BY site_name, camera_id, season_no",
+        " ORDER BY site_name, camera_id, season_no;"
     ))
     update_sql = '\n'.join((
-        "-- joins seasons back to original photos",
-        "WITH joined AS (",
-        "SELECT a.md5hash, a.path, a.fname, a.ftype,",
-        "       coalesce(a.site_name, 'none') site_name, coalesce(a.camera_id, 'none') camera_id,",
-        "	   a.dt_orig, a.year_orig, b.season_no",
-        "  FROM photo AS a",
-        "  LEFT JOIN season AS b ON coalesce(a.site_name, 'none') = b.site_name",
-        "                                AND coalesce(a.camera_id, 'none') = b.camera_id",
-        "                                AND coalesce(a.dt_orig, a.dt_mod) BETWEEN b.start_dt AND b.end_dt",
-        "",
-        "-- assigns a season order based on dt_orig or dt_mod (fallback)",
-        "), season_ord AS (",
-        "SELECT md5hash, path, fname, ftype, site_name, camera_id, dt_orig, year_orig, season_no,",
-        "       row_number() over(partition by site_name, camera_id, season_no order by dt_orig) AS season_order",
-        "  FROM joined",
-        ")",
-        "",
-        "UPDATE photo a",
+        "UPDATE photo",
         "   SET season_no = b.season_no,",
         "       season_order = b.season_order",
-        "  FROM season_ord b",
-        " WHERE a.md5hash = b.md5hash;"
+        "  FROM photo_season AS b",
+        " WHERE photo.path = b.path;"
     ))
-    c.execute("DROP TABLE IF EXISTS season;")
-    c.execute(season_sql)
-    c.execute(update_sql)
+    c = con.cursor()
+    for tbl in ['season_dirty', 'photo_season']:
+        c.execute(f"DROP TABLE IF EXISTS {tbl};")
+    c.execute(dirty_sql)
+    n_dirty = int(read_frame(con, "SELECT count(*) AS n FROM season_dirty;").iloc[0, 0])
+    print(f"\t{n_dirty} cameras to update.")
+    if n_dirty > 0:
+        c.execute(season_sql)
+        c.execute("CREATE INDEX photo_season_path ON photo_season (path);")
+        for tbl in ['season', 'season_watermark']:
+            c.execute('\n'.join((
+                f"DELETE FROM {tbl}",
+                " WHERE EXISTS (SELECT 1 FROM season_dirty AS d",
+                f"                WHERE d.site_name = {tbl}.site_name AND d.camera_id = {tbl}.camera_id);"
+            )))
+        c.execute(insert_sql)
+        n_season = c.rowcount
+        c.execute(update_sql)
+        print(f"\t{n_season} seasons stored and {c.rowcount} photos updated.")
+        c.execute("INSERT INTO season_watermark (site_name, camera_id, n_photo, min_dt, max_dt, season_break) "
+                  "SELECT site_name, camera_id, n_photo, min_dt, max_dt, season_break FROM season_dirty;")
+    for tbl in ['season_dirty', 'photo_season']:
+        c.execute(f"DROP TABLE IF EXISTS {tbl};")
     con.commit()
 
 
-def populate_animals(con: Union[sqlite.Connection, psycopg.Connection], animal_csv: str):
-    if not isinstance(con, sqlite.Connection) and not isinstance(con, psycopg.Connection):
-        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
-    animals = pd.read_csv(animal_csv, sep=',')
-    allowed_cols = ['path', 'id', 'cnt', 'classifier', 'coords']
-    allowed_new_cols = ['md5hash', 'id', 'cnt', 'classifier']
-    # restricts columns to just valid cols that exist in the csv
-    animal_ins = animals.loc[:, animals.columns.isin(allowed_cols)]
-    animal_ins.assign(path=lambda x: x.path.str.replace('\\', '/', regex=False))
-    cols = tuple(animal_ins.columns)
-    if not all(x in cols for x in ['path', 'id']):
-        print(animal_csv, "must have at least the 'path' and 'id' fields. Aborting animal imports...")
-        return
-    photo = pd.read_sql_query("SELECT path, md5hash from photo", con)
-    animal_joined = animal_ins.merge(photo, how='inner', on='path')
-    animal_hash = animal_joined.loc[:, animal_joined.columns.isin(allowed_new_cols)]
-    new_cols = tuple(animal_hash.columns)
-    update_cols = [x for x in new_cols if x not in ['md5hash', 'id']]
-    u = con.cursor()
-    if isinstance(con, sqlite.Connection):
-        ph = '?'
-        ignore = 'OR REPLACE'
-        conflict = ''
-        ph_str = ', '.join([':{}'.format(x) for x in new_cols])
-    elif isinstance(con, psycopg.Connection):
-        ph = '%s'
-        ignore = ''
-        excluded = ', '.join(['{} = EXCLUDED.{}'.format(x, x) for x in update_cols])
-        ph_str = ', '.join(['%({})s'.format(x) for x in new_cols])
-        if excluded:
-            conflict = f'ON CONFLICT (site_name) DO UPDATE SET {excluded}'
-        else:
-            conflict = 'ON CONFLICT DO NOTHING'
-    else:
-        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
-
-    col_str = ', '.join(new_cols)
-    ins_sql = f"INSERT {ignore} INTO animal ({col_str}) VALUES ({ph_str}) {conflict};"
-    u.executemany(ins_sql, animal_hash.to_dict('records'))
-    # animal_hash.to_sql('animal', con=con, if_exists='append', index=False)
-    con.commit()
-
-    # coordinates
+def split_coords(animals: pd.DataFrame) -> pd.DataFrame:
+    """converts the pipe delimited coords field of animal csv rows into one row per coordinate set with x1, y1, x2 and
+    y2 columns. Rows without coordinates are dropped."""
+    loc_cols = [x for x in ['path', 'id', 'classifier'] if x in animals.columns]
+    animals = animals[animals['coords'].notna() & (animals['coords'].astype(str).str.strip() != '')]
+    if len(animals) == 0:
+        return pd.DataFrame(columns=loc_cols + ['x1', 'y1', 'x2', 'y2'])
     # using reindex here to force the split to take 4 columns (2d) for even though the split may only produce 2 in the
     # case of 1d
-    animal_long = animal_joined\
+    animal_long = animals.loc[:, loc_cols + ['coords']]\
         .assign(coord_list=lambda x: x.coords.str.split(pat=r'\s*\|\s*', expand=False, regex=True))\
         .explode('coord_list')
     animal_long[['x1', 'y1', 'x2', 'y2']] = animal_long['coord_list']\
-        .str.split(pat=r'\s*,\s*', expand=True, regex=True, n=2).reindex(labels=range(4), axis='columns')
+        .str.split(pat=r'\s*,\s*', expand=True, regex=True, n=3).reindex(labels=range(4), axis='columns')\
+        .replace('', None)
     animal_filt = animal_long.query('~(x1.isnull() & y1.isnull() & x2.isnull() & y2.isnull())', engine='python')
+    return animal_filt.loc[:, loc_cols + ['x1', 'y1', 'x2', 'y2']]
 
-    allowed_coord_cols = ['md5hash', 'id', 'classifier', 'x1', 'y1', 'x2', 'y2']
-    animal_coord = animal_filt.loc[:, animal_filt.columns.isin(allowed_coord_cols)]\
-        .drop_duplicates(keep='last')
-    coord_cols = tuple(animal_coord.columns)
-    coord_str = ', '.join(coord_cols)
+
+def merge_animal_stage(con: Union[sqlite.Connection, psycopg.Connection], stage: str, table: str, cols: tuple,
+                       keys: tuple, constraint: str = None, update_cols: tuple = None) -> int:
+    """joins a staging table of animal csv rows to photo on path and upserts the result into table keyed by md5hash
+    instead of path. Later csv rows take precedence over earlier ones. If update_cols is empty rows are only inserted
+    and rows already present are skipped, treating NULL key values (e.g. a missing x2/y2) as equal."""
+    stage_cols = [x for x in cols if x != 'md5hash']
+    sel_cols = ', '.join(['b.md5hash'] + ['a.' + x for x in stage_cols])
     if isinstance(con, sqlite.Connection):
-        coord_conflict = ''
-        coord_ph_str = ', '.join([':{}'.format(x) for x in coord_cols])
+        is_op = 'IS'
     elif isinstance(con, psycopg.Connection):
-        coord_excluded = ', '.join(['{} = EXCLUDED.{}'.format(x, x) for x in coord_cols])
-        coord_ph_str = ', '.join(['%({})s'.format(x) for x in coord_cols])
-        coord_conflict = f'ON CONFLICT ON CONSTRAINT loc_unique DO UPDATE SET {coord_excluded}'
+        is_op = 'IS NOT DISTINCT FROM'
     else:
         raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    where = ''
+    if update_cols is not None and len(update_cols) == 0:
+        match = ' AND '.join([f"t.{k} {is_op} {'b' if k == 'md5hash' else 'a'}.{k}" for k in keys])
+        where = f" WHERE NOT EXISTS (SELECT 1 FROM {table} AS t WHERE {match})"
+    if isinstance(con, sqlite.Connection):
+        # an upsert rather than INSERT OR REPLACE, which would delete the existing row and lose its seq_id
+        sql = '\n'.join((
+            f"INSERT INTO {table} ({', '.join(cols)})",
+            f"SELECT {'DISTINCT ' if where else ''}{sel_cols}",
+            f"  FROM {stage} AS a",
+            " INNER JOIN photo AS b ON a.path = b.path",
+            where if where else " ORDER BY a.rowid",
+            conflict_clause(keys=keys, update_cols=update_cols) + ';'
+        ))
+        c = con.cursor()
+        c.execute(sql)
+        return c.rowcount
+    else:
+        select_sql = '\n'.join((
+            f"SELECT {sel_cols}, a.ctid AS stage_ord",
+            f"  FROM {stage} AS a",
+            " INNER JOIN photo AS b ON a.path = b.path",
+            where
+        ))
+        return merge_stage(con=con, stage=stage, table=table, cols=cols, keys=keys, constraint=constraint,
+                           update_cols=update_cols, select_sql=select_sql)
+
+
+def populate_animals(con: Union[sqlite.Connection, psycopg.Connection], animal_csv: str, chunksize: int = 100000):
+    """reads the animal csv in chunks of chunksize rows into staging tables, then joins the staged rows to photo on
+    path and upserts animal and animal_loc within the database, so memory use is bound by chunksize rather than the
+    size of the csv."""
+    if not isinstance(con, sqlite.Connection) and not isinstance(con, psycopg.Connection):
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    header = pd.read_csv(animal_csv, sep=',', nrows=0)
+    allowed_cols = ['path', 'id', 'cnt', 'classifier', 'coords']
+    # restricts columns to just valid cols that exist in the csv
+    csv_cols = [x for x in header.columns if x in allowed_cols]
+    if not all(x in csv_cols for x in ['path', 'id']):
+        print(animal_csv, "must have at least the 'path' and 'id' fields. Aborting animal imports...")
+        return
+    animal_cols = tuple([x for x in ['path', 'id', 'cnt', 'classifier'] if x in csv_cols])
+    loc_cols = tuple([x for x in ['path', 'id', 'classifier'] if x in csv_cols]) + ('x1', 'y1', 'x2', 'y2')
+    has_coords = 'coords' in csv_cols
+    types = {'path': 'VARCHAR', 'id': 'VARCHAR', 'cnt': 'INTEGER', 'classifier': 'VARCHAR', 'x1': 'INTEGER',
+             'y1': 'INTEGER', 'x2': 'INTEGER', 'y2': 'INTEGER'}
+    create_stage(con=con, stage='animal_stage', col_defs={x: types[x] for x in animal_cols})
+    if has_coords:
+        create_stage(con=con, stage='animal_loc_stage', col_defs={x: types[x] for x in loc_cols})
 
-    ins_sql_loc = f"INSERT {ignore} INTO animal_loc ({coord_str}) VALUES ({coord_ph_str}) {coord_conflict};"
-    u.executemany(ins_sql_loc, animal_coord.to_dict('records'))
+    start = time.perf_counter()
+    n_rows = 0
+    n_locs = 0
+    reader = pd.read_csv(animal_csv, sep=',', usecols=csv_cols, chunksize=chunksize,
+                         dtype={'path': str, 'id': str, 'classifier': str, 'coords': str})
+    for chunk in reader:
+        chunk = chunk.assign(path=lambda x: x.path.str.replace('\\', '/', regex=False))
+        n_rows += load_rows(con=con, table='animal_stage', cols=animal_cols, rows=chunk)
+        if has_coords:
+            n_locs += load_rows(con=con, table='animal_loc_stage', cols=loc_cols, rows=split_coords(chunk))
+    report_rate('animal csv staged', n_rows, start)
+
+    start = time.perf_counter()
+    new_cols = ('md5hash',) + animal_cols[1:]
+    n = merge_animal_stage(con=con, stage='animal_stage', table='animal', cols=new_cols, keys=('md5hash', 'id'),
+                           update_cols=tuple([x for x in new_cols if x not in ['md5hash', 'id']]))
+    report_rate('animal', n, start)
+    con.cursor().execute("DROP TABLE IF EXISTS animal_stage;")
     con.commit()
 
+    # coordinates
+    if has_coords:
+        start = time.perf_counter()
+        coord_cols = ('md5hash',) + loc_cols[1:]
+        n = merge_animal_stage(con=con, stage='animal_loc_stage', table='animal_loc', cols=coord_cols,
+                               keys=coord_cols, constraint='loc_unique', update_cols=())
+        report_rate('animal_loc', n, start)
+        con.cursor().execute("DROP TABLE IF EXISTS animal_loc_stage;")
+        con.commit()
 
-def populate_sequences(con: Union[sqlite.Connection, psycopg.Connection], sequence_break: int = 60,
-                       max_photo: int = 30, overwrite: bool = False):
-    if isinstance(con, sqlite.Connection):
-        julian_func = "julianday({})"
-        hex_func = "lower(hex(randomblob(8)))"
-    elif isinstance(con, psycopg.Connection):
-        julian_func = "extract(julian from {})"
-        hex_func = "encode(gen_random_bytes(8), 'hex')"
+
+def mark_dirty_partitions(con: Union[sqlite.Connection, psycopg.Connection], overwrite: bool = False) -> int:
+    """creates the temporary seq_dirty table holding the site/camera/animal id partitions whose sequences need to be
+    recomputed: those with animals that have no seq_id yet, or every partition if overwrite is True. Returns the number
+    of dirty partitions."""
+    if overwrite:
+        where = " WHERE b.site_name IS NOT NULL AND b.camera_id IS NOT NULL"
     else:
+        where = " WHERE a.seq_id IS NULL AND b.site_name IS NOT NULL AND b.camera_id IS NOT NULL"
+    c = con.cursor()
+    c.execute("DROP TABLE IF EXISTS seq_dirty;")
+    c.execute('\n'.join((
+        "CREATE TEMPORARY TABLE seq_dirty AS",
+        "SELECT b.site_name, b.camera_id, a.id",
+        "  FROM animal AS a",
+        " INNER JOIN photo AS b ON a.md5hash = b.md5hash",
+        where,
+        " GROUP BY b.site_name, b.camera_id, a.id;"
+    )))
+    c.execute("CREATE INDEX seq_dirty_idx ON seq_dirty (site_name, camera_id, id);")
+    return int(read_frame(con, "SELECT count(*) AS n FROM seq_dirty;").iloc[0, 0])
+
+
+def compute_sequence_rows(con: Union[sqlite.Connection, psycopg.Connection], sequence_break: int = 60,
+                          max_photo: int = 30):
+    """creates the temporary seq_rows_temp table assigning every animal record within the dirty partitions a sequence
+    number (seq) and sub-part (seq_part) based off of sequence_break and max_photo, along with its current seq_id
+    (old_seq_id)."""
+    if not isinstance(con, (sqlite.Connection, psycopg.Connection)):
         raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
 
-    # creates new unique sequences for animals based off of sequence_break and max_photo inputs
     seq_sql = '\n'.join((
-        "CREATE TEMPORARY TABLE seqs_temp AS",
+        "CREATE TEMPORARY TABLE seq_rows_temp AS",
         "-- sets our sequence time break limit in minutes",
         f"WITH break_limit (minutes) AS (VALUES ({sequence_break})",
         "-- sets maximum number of photos allowed in a sequence",
         f"), max_photo (max_n) AS (VALUES ({max_photo})",
         "",
         "), prev_date AS (",
-        "-- attaches previous photo date in same site/camera/animal group",
-        "SELECT a.md5hash, a.id, a.cnt, b.site_name, b.camera_id, coalesce(b.dt_orig, b.dt_mod) dt_orig,",
-        "       lag(coalesce(b.dt_orig, b.dt_mod))",
-        "	       over(PARTITION BY site_name, camera_id, id ORDER BY dt_orig, dt_mod) AS prev_dt",
+        "-- attaches previous photo date in same site/camera/animal group for partitions needing an update",
+        "SELECT a.md5hash, a.id, a.seq_id AS old_seq_id, b.site_name, b.camera_id,",
+        "       coalesce(b.dt_orig, b.dt_mod) dt_orig, b.dt_epoch,",
+        "       lag(b.dt_epoch)",
+        "	       over(PARTITION BY b.site_name, b.camera_id, a.id ORDER BY b.dt_epoch, a.md5hash) AS prev_epoch",
         "  FROM animal AS a",
         " INNER JOIN photo AS b ON a.md5hash = b.md5hash",
+        " INNER JOIN seq_dirty AS d ON b.site_name = d.site_name AND b.camera_id = d.camera_id AND a.id = d.id",
         "",
         "), time_dif AS (",
-        "-- calculates the difference between current time and previous photo time",
+        "-- calculates the difference between current time and previous photo time in tenths of a minute (rounded)",
         "SELECT *,",
-        f"       round(({julian_func} - {julian_func}) * 24 * 60, 1) AS minutedif".format('dt_orig', 'prev_dt'),
+        "       (dt_epoch - prev_epoch + 3) / 6 AS minutedif",
         "  FROM prev_date",
         "",
         "), ranking AS (",
         "-- attaches a rank to each new break within site, camera, animal",
-        "SELECT md5hash, id, cnt, site_name, camera_id, dt_orig, prev_dt, minutedif,",
-        "       CASE WHEN minutedif > (SELECT minutes FROM break_limit) OR minutedif IS NULL THEN",
+        "SELECT md5hash, id, old_seq_id, site_name, camera_id, dt_orig, dt_epoch, minutedif,",
+        "       CASE WHEN minutedif > (SELECT minutes * 10 FROM break_limit) OR minutedif IS NULL THEN",
         "       dense_rank() over(PARTITION BY site_name, camera_id, id,",
-        "				       CASE WHEN minutedif > (SELECT minutes FROM break_limit) OR minutedif IS NULL",
+        "				       CASE WHEN minutedif > (SELECT minutes * 10 FROM break_limit) OR minutedif IS NULL",
         "				            THEN 1",
         "				            ELSE 0 END",
-        "		          ORDER BY dt_orig) END AS rk",
+        "		          ORDER BY dt_epoch, md5hash) END AS rk",
         "  FROM time_dif",
         "",
         "), partitioning AS (",
         "-- creates a unique partition id such that we can apply the rank from 'ranking'",
         "-- to all other values in that rank block",
-        "SELECT md5hash, id, cnt, site_name, camera_id, dt_orig, rk,",
-        "       count(rk) OVER (ORDER BY site_name, camera_id, id, dt_orig) AS part_id",
+        "SELECT md5hash, id, old_seq_id, site_name, camera_id, dt_orig, dt_epoch, rk,",
+        "       count(rk) OVER (ORDER BY site_name, camera_id, id, dt_epoch, md5hash) AS part_id",
         "  FROM ranking",
         "",
         "), final AS (",
         "-- attaches our rank id to the null values produced from 'ranking'",
-        "SELECT md5hash, id, cnt, site_name, camera_id, dt_orig,",
+        "SELECT md5hash, id, old_seq_id, site_name, camera_id, dt_orig, dt_epoch,",
         "       coalesce(first_value(rk) ",
-        "           over(PARTITION BY part_id ORDER BY site_name, camera_id, id, dt_orig, rk DESC),0) AS seq",
+        "           over(PARTITION BY part_id",
+        "                ORDER BY site_name, camera_id, id, dt_epoch, md5hash, rk DESC NULLS LAST), 0) AS seq",
         "  FROM partitioning",
         "",
         "), seq_rn AS (",
         "-- assigns a row number for calculating sub-divisisions for sequences that are above our max photo limit",
-        "SELECT *, row_number() over(partition by site_name, camera_id, id, seq order by dt_orig) rn",
+        "SELECT *, row_number() over(partition by site_name, camera_id, id, seq order by dt_epoch, md5hash) rn",
         "  FROM final",
         "",
-        "), part_calc AS (",
+        ")",
         "-- calculates sub-parts for sequences that are above our max photo limit",
-        "SELECT *, ceiling(cast(rn AS float)/(SELECT max_n FROM max_photo)) seq_part",
-        "  FROM seq_rn",
-        "",
-        "), minmax AS (",
+        "SELECT md5hash, id, old_seq_id, site_name, camera_id, dt_orig, dt_epoch, seq,",
+        "       ceiling(cast(rn AS float)/(SELECT max_n FROM max_photo)) seq_part",
+        "  FROM seq_rn;"
+    ))
+    c = con.cursor()
+    c.execute("DROP TABLE IF EXISTS seq_rows_temp;")
+    c.execute(seq_sql)
+
+
+def sequence_numbers(group: np.ndarray, dt_epoch: np.ndarray, sequence_break: int = 60,
+                     max_photo: int = 30) -> tuple:
+    """vectorized equivalent of the sequence window query for rows already sorted by site/camera/animal id and time.
+    group holds an integer partition code per row and dt_epoch the photo time in epoch seconds (NaN if unknown).
+    Returns (seq, seq_part) arrays."""
+    n = len(group)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = group[1:] != group[:-1]
+    # gaps in tenths of a minute, rounded as the SQL query does
+    gap = np.full(n, np.nan)
+    gap[1:] = np.floor((dt_epoch[1:] - dt_epoch[:-1] + 3) / 6)
+    is_break = new_group | np.isnan(gap) | (gap > sequence_break * 10)
+    # running count of breaks, restarted within each site/camera/animal partition
+    breaks = np.cumsum(is_break)
+    seq = breaks - np.maximum.accumulate(np.where(new_group, breaks - 1, 0))
+    # position within each sequence gives its sub-part
+    starts = np.flatnonzero(is_break)
+    pos = np.arange(n) - np.repeat(starts, np.diff(np.append(starts, n)))
+    seq_part = pos // max_photo + 1
+    return seq, seq_part
+
+
+def compute_sequence_rows_numpy(con: Union[sqlite.Connection, psycopg.Connection], sequence_break: int = 60,
+                                max_photo: int = 30):
+    """fills the temporary seq_rows_temp table for the dirty partitions as compute_sequence_rows does, but reads the
+    rows sorted once and numbers the sequences in numpy rather than with the SQL window function chain."""
+    if isinstance(con, sqlite.Connection):
+        timestamp_tz = "TEXT"
+    elif isinstance(con, psycopg.Connection):
+        timestamp_tz = "TIMESTAMP WITH TIME ZONE"
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    sql = '\n'.join((
+        "SELECT a.md5hash, a.id, a.seq_id AS old_seq_id, b.site_name, b.camera_id,",
+        "       coalesce(b.dt_orig, b.dt_mod) AS dt_orig, b.dt_epoch",
+        "  FROM animal AS a",
+        " INNER JOIN photo AS b ON a.md5hash = b.md5hash",
+        " INNER JOIN seq_dirty AS d ON b.site_name = d.site_name AND b.camera_id = d.camera_id AND a.id = d.id",
+        " ORDER BY b.site_name, b.camera_id, a.id, b.dt_epoch, a.md5hash;"
+    ))
+    rows = read_frame(con, sql)
+    group = rows.groupby(['site_name', 'camera_id', 'id'], sort=False).ngroup().to_numpy()
+    dt_epoch = pd.to_numeric(rows['dt_epoch']).to_numpy(dtype='float64', na_value=np.nan)
+    rows['seq'], rows['seq_part'] = sequence_numbers(group=group, dt_epoch=dt_epoch, sequence_break=sequence_break,
+                                                     max_photo=max_photo)
+    col_defs = {'md5hash': 'TEXT', 'id': 'TEXT', 'old_seq_id': 'TEXT', 'site_name': 'TEXT', 'camera_id': 'TEXT',
+                'dt_orig': timestamp_tz, 'dt_epoch': 'BIGINT', 'seq': 'INTEGER', 'seq_part': 'INTEGER'}
+    stage_temp_table(con=con, table='seq_rows_temp', col_defs=col_defs, rows=rows)
+
+
+def apply_sequences(con: Union[sqlite.Connection, psycopg.Connection]) -> dict:
+    """merges the sequences computed in seq_rows_temp into the sequence and animal tables. A recomputed sequence keeps
+    the seq_id of the earliest existing sequence it contains (so sequences joined by a new photo bridging a gap are
+    merged into their earlier neighbor) and otherwise gets a new random seq_id. Sequences in the dirty partitions left
+    without animals are removed unless they are referenced by ratings or generations."""
+    if isinstance(con, sqlite.Connection):
+        hex_func = "lower(hex(randomblob(8)))"
+    elif isinstance(con, psycopg.Connection):
+        hex_func = "encode(gen_random_bytes(8), 'hex')"
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    grp = "site_name, camera_id, id, seq, seq_part"
+    grp_join = ' AND '.join([f'a.{x} = b.{x}' for x in grp.split(', ')])
+
+    seqs_sql = '\n'.join((
+        "CREATE TEMPORARY TABLE seqs_temp AS",
+        "WITH grp AS (",
         "-- compiles time ranges for each sequence",
-        "SELECT site_name, camera_id, id, seq, seq_part, min(dt_orig) AS min_dt, max(dt_orig) AS max_dt,",
-        "       count(md5hash) n",
-        "  FROM part_calc",
-        " GROUP BY site_name, camera_id, id, seq, seq_part",
+        f"SELECT {grp}, min(dt_orig) AS min_dt, max(dt_orig) AS max_dt, min(dt_epoch) AS min_epoch,",
+        "       max(dt_epoch) AS max_epoch, count(md5hash) n",
+        "  FROM seq_rows_temp",
+        f" GROUP BY {grp}",
         "",
-        "), sequence_id AS (",
-        "-- adds a random uuid for each sequence",
-        "SELECT site_name, camera_id, id, seq, seq_part, min_dt, max_dt,",
-        f"       {hex_func} AS seq_id",
-        "  FROM minmax",
+        "), old_ids AS (",
+        "-- existing sequence ids found within each recomputed sequence",
+        f"SELECT {grp}, old_seq_id, min(dt_orig) AS first_dt",
+        "  FROM seq_rows_temp",
+        " WHERE old_seq_id IS NOT NULL",
+        f" GROUP BY {grp}, old_seq_id",
+        "",
+        "), claimed AS (",
+        "-- an existing seq_id can only be kept by the first recomputed sequence it appears in",
+        "SELECT *, row_number() over(PARTITION BY old_seq_id ORDER BY first_dt) AS claim_rn",
+        "  FROM old_ids",
+        "",
+        "), kept AS (",
+        "-- sequences containing more than one existing seq_id (a bridged gap) keep the earliest one",
+        f"SELECT {grp}, old_seq_id,",
+        f"       row_number() over(PARTITION BY {grp} ORDER BY first_dt) AS keep_rn",
+        "  FROM claimed",
+        " WHERE claim_rn = 1",
         ")",
         "",
-        "SELECT site_name, camera_id, id, seq, seq_part, min_dt, max_dt, seq_id",
-        "  FROM sequence_id",
-        " ORDER BY site_name, camera_id, id, seq;"
+        "SELECT a.site_name, a.camera_id, a.id, a.seq, a.seq_part, a.min_dt, a.max_dt, a.min_epoch, a.max_epoch,",
+        "       b.old_seq_id,",
+        f"       coalesce(b.old_seq_id, {hex_func}) AS seq_id",
+        "  FROM grp a",
+        f"  LEFT JOIN kept b ON {grp_join} AND b.keep_rn = 1;"
+    ))
+
+    update_seq_sql = '\n'.join((
+        'UPDATE "sequence"',
+        "   SET seq = b.seq, seq_part = b.seq_part, min_dt = b.min_dt, max_dt = b.max_dt,",
+        "       min_epoch = b.min_epoch, max_epoch = b.max_epoch",
+        "  FROM seqs_temp AS b",
+        ' WHERE "sequence".seq_id = b.old_seq_id;'
     ))
 
-    # inserts new records into sequence for animals that are missing a seq_id
     insert_sql = '\n'.join((
-        'INSERT INTO "sequence" (seq_id, site_name, camera_id, id, seq, seq_part, min_dt, max_dt)',
-        "WITH animal_join AS (",
-        "-- joins photo to animal so we can access camera and site info",
-        "SELECT a.*, b.id",
-        "  FROM photo AS a",
-        " INNER JOIN animal AS b ON a.md5hash = b.md5hash",
-        " WHERE b.seq_id IS NULL",
-        "",
-        "-- selects just seq_id in the temp seq table which can be joined to null seq_id values in the animal table",
-        "-- and creates a unique list",
-        "), join_seq_grp AS (",
-        "SELECT b.seq_id",
-        "  FROM animal_join AS a",
-        " INNER JOIN seqs_temp AS b ON (coalesce(a.dt_orig, a.dt_mod) BETWEEN b.min_dt AND b.max_dt)",
-        "                            AND a.id = b.id",
-        "                            AND a.site_name = b.site_name",
-        "                            AND a.camera_id = b.camera_id",
-        " GROUP BY b.seq_id",
-        ")",
-        "",
-        "-- returns records in the temp sequence table identified by join_seq_grp in a format",
-        "-- ready for inserting",
-        "SELECT a.seq_id, a.site_name, a.camera_id, a.id, a.seq, a.seq_part, a.min_dt, a.max_dt",
-        "  FROM seqs_temp a",
-        " INNER JOIN join_seq_grp b on a.seq_id = b.seq_id",
+        'INSERT INTO "sequence" (seq_id, site_name, camera_id, id, seq, seq_part, min_dt, max_dt, min_epoch,',
+        '                        max_epoch)',
+        "SELECT seq_id, site_name, camera_id, id, seq, seq_part, min_dt, max_dt, min_epoch, max_epoch",
+        "  FROM seqs_temp",
+        " WHERE old_seq_id IS NULL",
         " ORDER BY site_name, camera_id, id, min_dt;"
     ))
 
-    # updates animal table with newly generated sequences. Will also populate older sequences that are missing for
-    # some reason but already exist in the sequence table.
+    # updates animal table with the new or kept sequence of each record
     update_sql = '\n'.join((
-        "WITH animal_join AS (",
-        "-- joins photo to animal so we can access camera and site info",
-        "SELECT a.*, b.id",
-        "  FROM photo AS a",
-        " INNER JOIN animal AS b ON a.md5hash = b.md5hash",
-        " WHERE b.seq_id IS NULL",
-        "-- joins animals back to sequence table",
-        "), seq_join AS (",
-        "SELECT a.*, b.seq, b.min_dt, b.max_dt, b.seq_id",
-        "  FROM animal_join AS a",
-        " INNER JOIN sequence AS b ON (coalesce(a.dt_orig, a.dt_mod) BETWEEN b.min_dt AND b.max_dt)",
-        "                         AND a.id = b.id",
-        "                         AND a.site_name = b.site_name",
-        "                         AND a.camera_id = b.camera_id)",
-        "",
-        "UPDATE animal a",
-        "SET seq_id = b.seq_id",
-        "FROM seq_join b",
-        "WHERE a.md5hash = b.md5hash AND a.id = b.id",
-        "AND a.seq_id IS NULL;"
+        "UPDATE animal",
+        "   SET seq_id = b.seq_id",
+        "  FROM seq_rows_temp AS a",
+        f" INNER JOIN seqs_temp AS b ON {grp_join}",
+        " WHERE animal.md5hash = a.md5hash AND animal.id = a.id",
+        "   AND (animal.seq_id IS NULL OR animal.seq_id <> b.seq_id);"
+    ))
+
+    delete_sql = '\n'.join((
+        'DELETE FROM "sequence"',
+        " WHERE EXISTS (SELECT 1 FROM seq_dirty AS d",
+        '                WHERE d.site_name = "sequence".site_name',
+        '                  AND d.camera_id = "sequence".camera_id',
+        '                  AND d.id = "sequence".id)',
+        '   AND NOT EXISTS (SELECT 1 FROM animal AS a WHERE a.seq_id = "sequence".seq_id)',
+        '   AND NOT EXISTS (SELECT 1 FROM condition_seqs AS c WHERE c.seq_id = "sequence".seq_id)',
+        '   AND NOT EXISTS (SELECT 1 FROM sequence_gen AS g WHERE g.seq_id = "sequence".seq_id);'
     ))
 
     c = con.cursor()
+    c.execute(f"CREATE INDEX seq_rows_temp_grp ON seq_rows_temp ({grp});")
     c.execute("DROP TABLE IF EXISTS seqs_temp;")
-    c.execute(seq_sql)
+    c.execute(seqs_sql)
+    c.execute(f"CREATE INDEX seqs_temp_grp ON seqs_temp ({grp});")
+    stats = {}
+    c.execute(update_seq_sql)
+    stats['updated'] = c.rowcount
     c.execute(insert_sql)
+    stats['inserted'] = c.rowcount
     c.execute(update_sql)
+    stats['assigned'] = c.rowcount
+    c.execute(delete_sql)
+    stats['removed'] = c.rowcount
+    return stats
+
+
+def populate_sequences(con: Union[sqlite.Connection, psycopg.Connection], sequence_break: int = 60,
+                       max_photo: int = 30, overwrite: bool = False, engine: str = 'sql'):
+    """creates new unique sequences for animals based off of sequence_break and max_photo inputs. Only the
+    site/camera/animal id partitions containing animals without a seq_id are recomputed unless overwrite is True, in
+    which case every partition is. engine selects whether sequences are numbered by the SQL window query ('sql') or
+    in numpy ('numpy'); both give the same sequences."""
+    if engine not in ('sql', 'numpy'):
+        raise ValueError("engine must be either 'sql' or 'numpy'.")
+    n_dirty = mark_dirty_partitions(con=con, overwrite=overwrite)
+    print(f"\t{n_dirty} site/camera/animal partitions to sequence.")
+    if n_dirty == 0:
+        return
+    start = time.perf_counter()
+    if engine == 'numpy':
+        compute_sequence_rows_numpy(con=con, sequence_break=sequence_break, max_photo=max_photo)
+    else:
+        compute_sequence_rows(con=con, sequence_break=sequence_break, max_photo=max_photo)
+    print(f"\tsequences numbered ({engine}) in {time.perf_counter() - start:.1f}s.")
+    stats = apply_sequences(con=con)
+    print(f"\t{stats['inserted']} sequences created, {stats['updated']} updated and {stats['removed']} removed. "
+          f"{stats['assigned']} animal records assigned a sequence.")
+    c = con.cursor()
+    for tbl in ['seqs_temp', 'seq_rows_temp', 'seq_dirty']:
+        c.execute(f"DROP TABLE IF EXISTS {tbl};")
+    con.commit()
+
+
+# connection settings used while bulk loading a SQLite database with --fast-load
+FAST_LOAD_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'OFF',
+    'cache_size': -1048576,  # negative values are in KiB, so 1 GiB
+    'mmap_size': 1073741824,
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'OFF',
+}
+# settings restored once a --fast-load build finishes
+SAFE_PRAGMAS = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+    'cache_size': -2000,
+    'mmap_size': 0,
+    'temp_store': 'DEFAULT',
+    'foreign_keys': 'ON',
+}
+
+
+def set_pragmas(con: sqlite.Connection, pragmas: dict):
+    """applies a set of PRAGMA settings to a SQLite connection outside of any open transaction"""
+    con.commit()
+    c = con.cursor()
+    for k, v in pragmas.items():
+        c.execute(f"PRAGMA {k} = {v};")
+
+
+def start_fast_load(con: sqlite.Connection):
+    """switches a SQLite connection to the bulk load profile and records that a fast load build is in progress so
+    that a build interrupted before finish_fast_load can be detected on the next run"""
+    c = con.cursor()
+    c.execute("CREATE TABLE IF NOT EXISTS fast_load (started TEXT);")
+    c.execute("INSERT INTO fast_load (started) VALUES (datetime('now'));")
+    con.commit()
+    set_pragmas(con=con, pragmas=FAST_LOAD_PRAGMAS)
+
+
+def finish_fast_load(con: sqlite.Connection) -> bool:
+    """restores the safe connection settings after a fast load build and checks foreign key integrity, which was not
+    enforced while loading. The in-progress marker is cleared only if no violations are found. Returns True if the
+    build passed the check."""
+    set_pragmas(con=con, pragmas=SAFE_PRAGMAS)
+    violations = read_frame(con, "PRAGMA foreign_key_check;")
+    if len(violations) > 0:
+        print("\tforeign key violations found after fast load:")
+        for k, v in violations.groupby(['table', 'parent']).size().items():
+            print(f"\t\t{k[0]} -> {k[1]}: {v} rows")
+        return False
+    c = con.cursor()
+    c.execute("DROP TABLE IF EXISTS fast_load;")
     con.commit()
+    return True
+
+
+def check_interrupted_load(con: sqlite.Connection) -> bool:
+    """checks whether a previous fast load build of this database never finished. If so the database is checked with
+    PRAGMA quick_check. Returns True if the database can be used."""
+    c = con.cursor()
+    c.execute("SELECT name FROM sqlite_schema WHERE type = 'table' AND name = 'fast_load';")
+    if c.fetchone() is None:
+        return True
+    started = read_frame(con, "SELECT max(started) AS started FROM fast_load;").iloc[0, 0]
+    print(f"A --fast-load build started {started} (UTC) did not finish. Checking database integrity...")
+    result = read_frame(con, "PRAGMA quick_check;").iloc[:, 0].tolist()
+    if result != ['ok']:
+        print('\n'.join([f"\t{x}" for x in result[:10]]))
+        return False
+    print("\tintegrity ok. Unfinished stages will be reloaded.")
+    return True
+
+
+def build_stage(con: Union[sqlite.Connection, psycopg.Connection], stage: str, func, **kwargs):
+    """creates the indexes a stage uses, runs the stage's populate function and refreshes the statistics of the tables
+    it wrote"""
+    create_stage_indexes(con=con, stage=stage)
+    func(con=con, **kwargs)
+    analyze_stage(con=con, stage=stage)
 
 
 def create_indices(con: Union[sqlite.Connection, psycopg.Connection]):
+    """creates every index used by the database (see indexes.STAGE_INDEXES), drops redundant ones and refreshes
+    planner statistics"""
+    finalize_indexes(con=con)
+
+
+# tables copied from a shard into the destination database, in foreign key order, with their conflict keys. animal
+# rows (keyed by md5hash) are only inserted so that an image found in more than one shard keeps the first shard's
+# sequence; animal_loc rows are inserted unless an identical row is already present.
+SHARD_TABLES = (
+    ('site', ('site_name',), True),
+    ('camera', ('site_name', 'camera_id'), True),
+    ('season', ('site_name', 'camera_id', 'season_no'), True),
+    ('season_watermark', ('site_name', 'camera_id'), True),
+    ('sequence', ('seq_id',), True),
+    ('animal', ('md5hash', 'id'), False),
+    ('animal_loc', None, False),
+)
+# photo columns set by the shard stages
+SHARD_PHOTO_COLS = ('site_name', 'camera_id', 'season_no', 'season_order')
+
+
+def plan_shards(con: sqlite.Connection, site_csv: str, jobs: int) -> list:
+    """splits the sites of site_csv into at most jobs shards of roughly equal photo counts, classifying every photo
+    path against the site regexes once. Photos matching no site go to the smallest shard, so every photo is built by
+    exactly one shard. The path of each photo and its shard are stored in the shard_photo table. Returns a list of
+    site name lists, one per shard."""
+    sites = pd.read_csv(site_csv, sep=',')
+    photo = read_frame(con, "SELECT path FROM photo;")
+    assigned = classify_sites(photo=photo, sites=sites, jobs=jobs)
+    counts = assigned['site_name'].value_counts()
+    site_names = sorted(sites['site_name'].astype(str).unique(), key=lambda x: counts.get(x, 0), reverse=True)
+    n_shard = max(min(jobs, int((counts > 0).sum())), 1)
+    shards = [[] for i in range(n_shard)]
+    sizes = [0] * n_shard
+    # largest sites first, each to the shard with the fewest photos so far
+    for site in site_names:
+        i = sizes.index(min(sizes))
+        shards[i].append(site)
+        sizes[i] += int(counts.get(site, 0))
+    site_shard = {site: i for i, shard in enumerate(shards) for site in shard}
+    shard_no = assigned['site_name'].map(site_shard).fillna(sizes.index(min(sizes))).astype(int)
+    stage_temp_table(con=con, table='shard_photo_temp', col_defs={'path': 'TEXT', 'shard': 'INTEGER'},
+                     rows=zip(assigned['path'], shard_no))
     c = con.cursor()
-    stmts = [
-        "CREATE INDEX IF NOT EXISTS animal_seq_id ON animal (seq_id);",
-        "CREATE INDEX IF NOT EXISTS animal_id ON animal (id);",
-        "CREATE INDEX IF NOT EXISTS camera_site_name ON camera (site_name);",
-        "CREATE INDEX IF NOT EXISTS condition_scorer_name ON condition (scorer_name);",
-        "CREATE INDEX IF NOT EXISTS condition_rating ON condition (rating);",
-        "CREATE INDEX IF NOT EXISTS condition_md5hash ON condition (md5hash);",
-        "CREATE INDEX IF NOT EXISTS condition_seqs_seq_id ON condition_seqs (seq_id);",
-        "CREATE INDEX IF NOT EXISTS photo_md5hash ON photo (md5hash);",
-        "CREATE INDEX IF NOT EXISTS photo_dt_orig ON photo (dt_orig);",
-        "CREATE INDEX IF NOT EXISTS photo_site_name_camera_id ON photo (site_name, camera_id);",
-        "CREATE INDEX IF NOT EXISTS photo_site_name ON photo (site_name);",
-        "CREATE INDEX IF NOT EXISTS photo_camera_id ON photo (camera_id);",
-        "CREATE INDEX IF NOT EXISTS photo_site_name_camera_id ON photo (site_name, camera_id);",
-        "CREATE INDEX IF NOT EXISTS photo_md5hash ON photo (md5hash);",
-        "CREATE INDEX IF NOT EXISTS sequence_id ON sequence (id);",
-        "CREATE INDEX IF NOT EXISTS sequence_site_name_camera_id ON sequence (site_name, camera_id);",
-        "CREATE INDEX IF NOT EXISTS sequence_site_name ON sequence (site_name);",
-        "CREATE INDEX IF NOT EXISTS sequence_camera_id ON sequence (camera_id);",
-        "CREATE INDEX IF NOT EXISTS sequence_gen_id ON sequence_gen (gen_id);"
-    ]
-    for stmt in stmts:
-        c.execute(stmt)
+    c.execute("DROP TABLE IF EXISTS shard_photo;")
+    # a regular table, as the shard processes read it through their own connections
+    c.execute("CREATE TABLE shard_photo AS SELECT path, shard FROM shard_photo_temp;")
+    c.execute("CREATE INDEX shard_photo_shard ON shard_photo (shard);")
+    c.execute("DROP TABLE shard_photo_temp;")
+    con.commit()
+    return shards
+
+
+def split_animal_csv(con: sqlite.Connection, animal_csv: str, out_paths: list, chunksize: int = 100000) -> list:
+    """writes the rows of animal_csv to one csv per shard (out_paths) by the shard of their photo (see plan_shards)
+    in a single chunked pass. Rows whose path is not in photo are dropped, as populate_animals would do. Returns the
+    number of rows written per shard."""
+    shard_of = read_frame(con, "SELECT path, shard FROM shard_photo;").set_index('path')['shard']
+    header = pd.read_csv(animal_csv, sep=',', nrows=0)
+    for out_path in out_paths:
+        header.to_csv(out_path, index=False)
+    n_rows = [0] * len(out_paths)
+    for chunk in pd.read_csv(animal_csv, sep=',', chunksize=chunksize, dtype=str):
+        shard = chunk['path'].str.replace('\\', '/', regex=False).map(shard_of)
+        for j, out_path in enumerate(out_paths):
+            part = chunk[shard == j]
+            part.to_csv(out_path, mode='a', header=False, index=False)
+            n_rows[j] += len(part)
+    return n_rows
+
+
+def build_shard(shard: int, shard_dir: str, dest: str, sites: list, site_csv: str, camera_csv: str = None,
+                animal_csv: str = None, season_break: int = None, sequence_break: int = 60, engine: str = 'sql',
+                chunksize: int = 100000) -> dict:
+    """builds one shard in its own process: copies the shard's photos out of the destination database into a new
+    SQLite database in shard_dir and runs the site, camera, season, animal and sequence stages on it. Stage output is
+    written to shard.log in shard_dir. Returns the shard's photo count, stage timings and CPU time."""
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    shard_path = os.path.join(shard_dir, 'shard.sqlite')
+    timings = {}
+    with open(os.path.join(shard_dir, 'shard.log'), 'w') as log, contextlib.redirect_stdout(log):
+        cdb.init_db_sqlite(dbpath=shard_path, overwrite=True)
+        con = cdb.get_sqlite_con(dbpath=shard_path, geo=True)
+        create_animal_tables(con=con)
+        # a shard is a throwaway file, so it is always built with the bulk load profile
+        set_pragmas(con=con, pragmas=FAST_LOAD_PRAGMAS)
+        c = con.cursor()
+        c.execute("ATTACH DATABASE ? AS src;", (dest,))
+        cols = {}
+        for t in ['import', 'hash', 'photo']:
+            main_cols = read_frame(con, f"PRAGMA main.table_info({t});")['name']
+            src_cols = read_frame(con, f"PRAGMA src.table_info({t});")['name']
+            cols[t] = ', '.join([x for x in main_cols if x in set(src_cols)])
+        c.execute(f"INSERT INTO main.import ({cols['import']}) SELECT {cols['import']} FROM src.import;")
+        c.execute('\n'.join((
+            f"INSERT INTO main.photo ({cols['photo']})",
+            f"SELECT {', '.join(['p.' + x for x in cols['photo'].split(', ')])}",
+            "  FROM src.photo AS p",
+            " INNER JOIN src.shard_photo AS s ON p.path = s.path",
+            " WHERE s.shard = ?;"
+        )), (shard,))
+        n_photo = c.rowcount
+        c.execute(f"INSERT INTO main.hash ({cols['hash']}) SELECT {cols['hash']} FROM src.hash "
+                  "WHERE md5hash IN (SELECT md5hash FROM main.photo);")
+        con.commit()
+        c.execute("DETACH DATABASE src;")
+        timings['copy'] = time.perf_counter() - start
+
+        stage_list = []
+        sites_df = pd.read_csv(site_csv, sep=',')
+        shard_site_csv = os.path.join(shard_dir, 'site.csv')
+        sites_df[sites_df['site_name'].astype(str).isin(sites)].to_csv(shard_site_csv, index=False)
+        stage_list.append(('sites', populate_sites, {'site_csv': shard_site_csv}))
+        if camera_csv is not None:
+            cameras = pd.read_csv(camera_csv, sep=',')
+            site_names = sites_df['site_name'].astype(str)
+            # cameras of sites missing from the site csv go to the first shard
+            keep = cameras['site_name'].astype(str).isin(sites)
+            if shard == 0:
+                keep = keep | ~cameras['site_name'].astype(str).isin(site_names)
+            shard_camera_csv = os.path.join(shard_dir, 'camera.csv')
+            cameras[keep].to_csv(shard_camera_csv, index=False)
+            stage_list.append(('cameras', populate_cameras, {'camera_csv': shard_camera_csv}))
+        if season_break:
+            stage_list.append(('seasons', populate_seasons, {'season_break': season_break}))
+        if animal_csv is not None:
+            stage_list.append(('animals', populate_animals, {'animal_csv': animal_csv, 'chunksize': chunksize}))
+            stage_list.append(('sequences', populate_sequences, {'sequence_break': sequence_break,
+                                                                 'engine': engine}))
+        for stage, func, kwargs in stage_list:
+            print(f"Running {stage} stage...")
+            stage_start = time.perf_counter()
+            build_stage(con=con, stage=stage, func=func, **kwargs)
+            timings[stage] = time.perf_counter() - stage_start
+        con.close()
+    return {'shard': shard, 'path': shard_path, 'n_site': len(sites), 'n_photo': n_photo, 'stages': timings,
+            'seconds': time.perf_counter() - start, 'cpu': time.process_time() - cpu_start}
+
+
+def merge_shard(con: sqlite.Connection, shard_path: str) -> int:
+    """copies a built shard into the destination database with ATTACH based inserts (as merge.merge_db does) and sets
+    the site, camera and season columns of its photos. Returns the number of rows written."""
+    c = con.cursor()
+    c.execute("ATTACH DATABASE ? AS shard;", (shard_path,))
+    n = 0
+    for table, keys, update in SHARD_TABLES:
+        main_cols = read_frame(con, f'PRAGMA main.table_info("{table}");')['name']
+        shard_cols = set(read_frame(con, f'PRAGMA shard.table_info("{table}");')['name'])
+        cols = tuple([x for x in main_cols if x in shard_cols])
+        col_str = ', '.join(cols)
+        if keys is None:
+            match = ' AND '.join([f"t.{x} IS s.{x}" for x in cols])
+            sql = '\n'.join((
+                f'INSERT INTO main."{table}" ({col_str})',
+                f"SELECT DISTINCT {', '.join(['s.' + x for x in cols])}",
+                f'  FROM shard."{table}" AS s',
+                f' WHERE NOT EXISTS (SELECT 1 FROM main."{table}" AS t WHERE {match});'
+            ))
+        else:
+            update_cols = tuple([x for x in cols if x not in keys]) if update else ()
+            sql = '\n'.join((
+                f'INSERT INTO main."{table}" ({col_str})',
+                f'SELECT {col_str} FROM shard."{table}" WHERE true',
+                conflict_clause(keys=keys, update_cols=update_cols) + ';'
+            ))
+        c.execute(sql)
+        n += c.rowcount
+        if table == 'camera':
+            # photo references camera, so photos are updated once their cameras exist
+            c.execute('\n'.join((
+                "UPDATE photo",
+                f"   SET {', '.join([f'{x} = s.{x}' for x in SHARD_PHOTO_COLS])}",
+                "  FROM shard.photo AS s",
+                " WHERE photo.path = s.path;"
+            )))
+            n += c.rowcount
+    con.commit()
+    c.execute("DETACH DATABASE shard;")
+    return n
+
+
+def parallel_build(con: sqlite.Connection, dbpath: str, jobs: int, site_csv: str, camera_csv: str = None,
+                   animal_csv: str = None, season_break: int = None, sequence_break: int = 60, engine: str = 'sql',
+                   chunksize: int = 100000):
+    """builds a new database's site, camera, season, animal and sequence stages in up to jobs processes, one per
+    shard of sites, each writing its own temporary SQLite database next to dbpath. The shards are then merged into
+    the destination. Prints the timings of each shard and the speedup over the serial path, estimated as the CPU time
+    the shards used (which, unlike their elapsed times, does not grow when shards compete for cores) over the elapsed
+    time of the whole build."""
+    start = time.perf_counter()
+    shards = plan_shards(con=con, site_csv=site_csv, jobs=jobs)
+    work_dir = tempfile.mkdtemp(prefix='shards_', dir=os.path.dirname(os.path.abspath(dbpath)))
+    shard_dirs = [os.path.join(work_dir, str(i)) for i in range(len(shards))]
+    for d in shard_dirs:
+        os.mkdir(d)
+    shard_animals = [None] * len(shards)
+    if animal_csv is not None:
+        shard_animals = [os.path.join(d, 'animal.csv') for d in shard_dirs]
+        n_rows = split_animal_csv(con=con, animal_csv=animal_csv, out_paths=shard_animals, chunksize=chunksize)
+        print(f"\tanimal csv split into {len(shards)} shards ({sum(n_rows)} rows).")
+    print(f"\tbuilding {len(shards)} shards in {work_dir} ({time.perf_counter() - start:.1f}s to plan)...")
+    results = []
+    # spawned rather than forked, so that no process inherits the open destination connection
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(build_shard, shard=i, shard_dir=shard_dirs[i], dest=os.path.abspath(dbpath),
+                               sites=shards[i], site_csv=site_csv, camera_csv=camera_csv,
+                               animal_csv=shard_animals[i], season_break=season_break,
+                               sequence_break=sequence_break, engine=engine, chunksize=chunksize): i
+                   for i in range(len(shards))}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                r = future.result()
+            except Exception:
+                print(f"\tshard {i} failed. See {os.path.join(shard_dirs[i], 'shard.log')}")
+                raise
+            stages = ', '.join([f"{k} {v:.1f}s" for k, v in r['stages'].items()])
+            print(f"\tshard {i}: {r['n_site']} sites, {r['n_photo']} photos in {r['seconds']:.1f}s "
+                  f"({r['cpu']:.1f}s CPU; {stages})")
+            results.append(r)
+    build_secs = time.perf_counter() - start
+    merge_start = time.perf_counter()
+    for r in sorted(results, key=lambda x: x['shard']):
+        n = merge_shard(con=con, shard_path=r['path'])
+        print(f"\tshard {r['shard']} merged ({n} rows).")
+    c = con.cursor()
+    c.execute("DROP TABLE IF EXISTS shard_photo;")
+    con.commit()
+    shutil.rmtree(work_dir)
+    merge_secs = time.perf_counter() - merge_start
+    elapsed = time.perf_counter() - start
+    serial = sum([r['cpu'] for r in results])
+    print(f"\tbuilt in {build_secs:.1f}s and merged in {merge_secs:.1f}s. The shards used {serial:.1f}s of CPU time, "
+          f"an estimated {serial / elapsed:.1f}x speedup over the serial path.")
 
 
 if __name__ == "__main__":
@@ -840,6 +1390,12 @@ if __name__ == "__main__":
                          help="User will not be prompted for password if none given.")
     parser.add_argument('-o', '--overwrite', action='store_true',
                         help='overwrite an existing database given with --dbpath')
+    parser.add_argument('--rerun', action='store_true',
+                        help='run every requested stage even if its inputs are unchanged since it last completed.')
+    parser.add_argument('--fast-load', action='store_true',
+                        help='build a --dbpath database with a bulk load profile (WAL journal, synchronous off, '
+                             'large cache, foreign keys checked at the end rather than enforced while loading). Safe '
+                             'settings are restored when the build finishes.')
     args_camera = parser.add_argument_group('camera')
     args_camera.add_argument('-s', '--site', help='path to a csv file containing site data. See README for required '
                                                   'table specifications.')
@@ -848,20 +1404,40 @@ if __name__ == "__main__":
     args_camera.add_argument('-b', '--season', type=int, default=30,
                              help='the number of days without photos to use as a defining break point for a camera '
                                   'season.')
+    args_camera.add_argument('--overwrite_season', action='store_true',
+                             help='recompute seasons for every camera rather than only those with new or changed '
+                                  'photos.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='build a new --dbpath database with this many processes, splitting its photos into '
+                             'shards of sites that are built in separate temporary databases and then merged.')
     args_animal = parser.add_argument_group('animal')
     args_animal.add_argument('-a', '--animal', help='path to a csv file containing animal detection data. See README '
                                                     'for required table specifications.')
     args_animal.add_argument('-B', '--sequence', type=int, default=60,
                              help='the number of minutes without an animal id to use as a defining break point for a '
                              'sequence.')
+    args_animal.add_argument('--seq_engine', choices=['sql', 'numpy'], default='sql',
+                             help='number sequences with the SQL window function query or with numpy, which reads '
+                                  'the animal records once and is usually faster on large SQLite databases.')
+    args_animal.add_argument('--chunksize', type=int, default=100000,
+                             help='the number of animal csv rows to read and stage at a time. Bounds the memory used '
+                                  'when importing large detection files.')
     args_animal.add_argument('--overwrite_sequence', action='store_true',
                              help='Overwrite existing sequence info in the sequences and animal table if already '
                                   'present.')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help="Print misc. info for use in debugging.")
+    parser.add_argument('--profile', nargs='?', const='create_db_profile.json',
+                        help='time each stage and SQL statement, capture query plans and peak memory, and write a json '
+                             'report to this path (default create_db_profile.json).')
+    parser.add_argument('--profile_top', type=int, default=20,
+                        help='the number of slowest statements to print with --profile.')
 
     args = parser.parse_args()
 
+    if args.profile:
+        start_profile(script='create_db', out_path=args.profile, top=args.profile_top)
+
     # argument checking
     if args.site:
         if not os.path.isfile(args.site):
@@ -884,30 +1460,103 @@ if __name__ == "__main__":
     if args.dbpath:
         cdb.init_db_sqlite(dbpath=args.dbpath, overwrite=args.overwrite)
         conn = cdb.get_sqlite_con(dbpath=args.dbpath, geo=True)
+        if not check_interrupted_load(con=conn):
+            print("database failed its integrity check. Rebuild it with --overwrite. quitting...")
+            quit()
     else:
+        if args.fast_load:
+            print("--fast-load only applies to SQLite databases and will be ignored.")
+            args.fast_load = False
         if args.passwd is None and not args.noask:
             args.passwd = getpass()
         cdb.init_db_pg(user=args.user, database=args.db, password=args.passwd, host=args.host, port=args.port, geo=True)
-        conn = cdb.get_pg_con(user=args.user, database=args.db, password=args.passwd, host=args.host, port=args.port)
+        conn = pg_con(user=args.user, database=args.db, password=args.passwd, host=args.host, port=args.port)
     print("Creating tables...")
-    create_animal_tables(con=conn, verbose=args.verbose)
-    create_animal_views(con=conn, verbose=args.verbose)
+    with profile_stage('tables'):
+        create_animal_tables(con=conn, verbose=args.verbose)
+        create_animal_views(con=conn, verbose=args.verbose)
+        create_export_table(con=conn)
+        if args.fast_load:
+            start_fast_load(con=conn)
+    ledger = StageLedger(con=conn, rerun=args.rerun)
+    # (stage, message, function returning the stage's ledger inputs, force, kwargs) or (stage, None) if not requested
+    stages = []
     if args.site:
-        print("Populating site table...")
-        populate_sites(con=conn, site_csv=args.site)
+        stages.append(('sites', "Populating site table...",
+                       lambda: {'site_csv': file_hash(args.site), 'photo': table_state(conn, 'photo')}, False,
+                       {'func': populate_sites, 'site_csv': args.site, 'jobs': args.jobs}))
+    else:
+        stages.append(('sites', None))
     if args.camera:
-        print("Populating camera table...")
-        populate_cameras(con=conn, camera_csv=args.camera)
+        stages.append(('cameras', "Populating camera table...",
+                       lambda: {'camera_csv': file_hash(args.camera), 'photo': table_state(conn, 'photo')}, False,
+                       {'func': populate_cameras, 'camera_csv': args.camera, 'jobs': args.jobs}))
+    else:
+        stages.append(('cameras', None))
     if args.season:
-        print("Updating season info in photo table...")
-        populate_seasons(con=conn, season_break=args.season)
+        stages.append(('seasons', "Updating season info in photo table...",
+                       lambda: {'season_break': args.season, 'photo': table_state(conn, 'photo')},
+                       args.overwrite_season,
+                       {'func': populate_seasons, 'season_break': args.season, 'overwrite': args.overwrite_season}))
+    else:
+        stages.append(('seasons', None))
     if args.animal:
-        print("Populating animal table...")
-        populate_animals(con=conn, animal_csv=args.animal)
-        print("Populating sequence table and updating animal table with sequence info...")
-        populate_sequences(con=conn, sequence_break=args.sequence, overwrite=args.overwrite_sequence)
+        stages.append(('animals', "Populating animal table...",
+                       lambda: {'animal_csv': file_hash(args.animal), 'photo': table_state(conn, 'photo')}, False,
+                       {'func': populate_animals, 'animal_csv': args.animal, 'chunksize': args.chunksize}))
+        stages.append(('sequences', "Populating sequence table and updating animal table with sequence info...",
+                       lambda: {'sequence_break': args.sequence, 'animal': table_state(conn, 'animal')},
+                       args.overwrite_sequence,
+                       {'func': populate_sequences, 'sequence_break': args.sequence,
+                        'overwrite': args.overwrite_sequence, 'engine': args.seq_engine}))
+    else:
+        stages.append(('animals', None))
+        stages.append(('sequences', None))
+
+    parallel = args.jobs > 1 and args.dbpath is not None and args.site is not None
+    if args.jobs > 1 and not parallel:
+        print("--jobs needs a --dbpath database and a site csv to shard by. Building serially...")
+    if parallel and args.jobs > (os.cpu_count() or 1):
+        print(f"only {os.cpu_count()} CPUs available. Using {os.cpu_count()} processes.")
+        args.jobs = os.cpu_count() or 1
+        parallel = args.jobs > 1
+    if parallel and table_state(conn, 'sequence') > 0:
+        print("--jobs only builds new databases and sequences already exist. Building serially...")
+        parallel = False
+    if parallel:
+        print(f"Building sites, cameras, seasons, animals and sequences in up to {args.jobs} processes...")
+        with profile_stage('parallel_build'):
+            parallel_build(con=conn, dbpath=args.dbpath, jobs=args.jobs, site_csv=args.site, camera_csv=args.camera,
+                           animal_csv=args.animal, season_break=args.season, sequence_break=args.sequence,
+                           engine=args.seq_engine, chunksize=args.chunksize)
+        # records the stages as completed so that a rerun skips them as it would after a serial build
+        for stage in stages:
+            if stage[1] is None:
+                ledger.skip(stage=stage[0])
+            else:
+                ledger.record(stage=stage[0], inputs=stage[2]())
+    else:
+        for stage in stages:
+            if stage[1] is None:
+                ledger.skip(stage=stage[0])
+                continue
+            name, message, inputs, force, kwargs = stage
+            print(message)
+            with profile_stage(name):
+                ledger.run(stage=name, inputs=inputs(), func=build_stage, force=force,
+                           kwargs={'con': conn, 'stage': name, **kwargs})
+    print("Refreshing export_animal_mat for changed detections...")
+    with profile_stage('export_refresh'):
+        refresh_export_animal(con=conn)
     print("Creating indices...")
-    create_indices(con=conn)
+    with profile_stage('indices'):
+        ledger.run(stage='indices', inputs={'indexes': STAGE_INDEXES}, func=create_indices, kwargs={'con': conn})
+    if args.fast_load:
+        print("Restoring safe database settings and checking foreign keys...")
+        with profile_stage('finish_fast_load'):
+            fk_ok = finish_fast_load(con=conn)
+        if not fk_ok:
+            print("fast load build failed its foreign key check.")
     if conn is not None:
         conn.close()
     print('Script finished.')
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-16
+@author: Wade Lieurance
+
+This script will export animal detections from a camera trap database to a csv in the format used to import them
+(path, id, cnt, classifier and pipe delimited coords). Rows are read from export_animal_mat, a materialized copy of the
+export_animal view which triggers keep track of: the md5hashes whose animal, animal_loc or photo rows change, or
+whose import row changes, are recorded in export_animal_dirty and only those are rebuilt on refresh. Rows are streamed
+to the csv in fixed size batches, so memory use does not grow with the number of detections.
+"""
+
+import csv
+import time
+import argparse
+import sqlite3 as sqlite
+import psycopg
+import psycopg.rows
+from photo_mgmt import create_db as cdb
+from bulk import report_rate
+from connection import pg_con
+from typing import Union
+from getpass import getpass
+
+
+# columns of each table whose changes alter export rows
+TRACKED_COLS = {
+    'animal': ('md5hash', 'id', 'cnt', 'classifier'),
+    'animal_loc': ('md5hash', 'id', 'classifier', 'x1', 'y1', 'x2', 'y2'),
+    'photo': ('md5hash', 'path', 'dt_import'),
+}
+# columns of import whose changes alter the export rows of every photo of the import (the path is built from them)
+IMPORT_COLS = ('import_date', 'base_path', 'local')
+EXPORT_COLS = ('path', 'id', 'cnt', 'classifier', 'coords')
+
+
+def export_animal_select(con: Union[sqlite.Connection, psycopg.Connection], where: str = '') -> str:
+    """returns the query behind export_animal: one row per photo path and animal id with the coordinate sets of the
+    animal joined by '|', along with the photo's md5hash. where is an optional clause filtering the animal rows (c)."""
+    if isinstance(con, sqlite.Connection):
+        group_concat = 'group_concat'
+        concat = "{} || ',' || {} || ',' || {} || ',' || {}"
+    elif isinstance(con, psycopg.Connection):
+        group_concat = 'string_agg'
+        concat = "concat_ws(',', {}, {}, {}, {})"
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    return '\n'.join((
+        "WITH coords_long AS (",
+        "SELECT b.md5hash, CASE WHEN a.local = True THEN a.base_path || '/' || b.path",
+        '            ELSE b.path END "path",',
+        f"       c.id, c.cnt, c.classifier, {concat} coords".format('d.x1', 'd.y1', 'd.x2', 'd.y2'),
+        "  FROM import a",
+        " INNER JOIN photo b ON a.import_date = b.dt_import",
+        " INNER JOIN animal c ON b.md5hash = c.md5hash",
+        "  LEFT JOIN animal_loc d ON c.md5hash = d.md5hash AND c.id = d.id",
+        where,
+        ")",
+        "",
+        f"""SELECT md5hash, "path", id, cnt, classifier, {group_concat}(coords, '|') coords""",
+        "  FROM coords_long",
+        ' GROUP BY md5hash, "path", id, cnt, classifier'
+    ))
+
+
+def create_export_table(con: Union[sqlite.Connection, psycopg.Connection]) -> bool:
+    """creates export_animal_mat, the export_animal_dirty change log and the triggers filling it, if missing. A newly
+    created export_animal_mat is filled in full. Returns True if the table was created."""
+    c = con.cursor()
+    if isinstance(con, sqlite.Connection):
+        c.execute("SELECT name FROM sqlite_schema WHERE type = 'table' AND name = 'export_animal_mat';")
+    elif isinstance(con, psycopg.Connection):
+        c.execute("SELECT tablename AS name FROM pg_tables WHERE tablename = 'export_animal_mat';")
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    created = c.fetchone() is None
+    sql_list = [
+        '\n'.join((
+            "CREATE TABLE IF NOT EXISTS export_animal_mat (",
+            "    md5hash VARCHAR(32),",
+            '    "path" VARCHAR,',
+            "    id VARCHAR,",
+            "    cnt INTEGER,",
+            "    classifier VARCHAR,",
+            "    coords VARCHAR,",
+            '    PRIMARY KEY("path", id));')),
+        "CREATE INDEX IF NOT EXISTS export_animal_mat_md5hash ON export_animal_mat (md5hash);",
+        '\n'.join((
+            "-- md5hashes whose export rows are out of date",
+            "CREATE TABLE IF NOT EXISTS export_animal_dirty (",
+            "    md5hash VARCHAR(32) NOT NULL,",
+            "    PRIMARY KEY(md5hash));"))
+    ]
+    if isinstance(con, sqlite.Connection):
+        for table, cols in TRACKED_COLS.items():
+            changed = ' OR '.join([f"OLD.{x} IS NOT NEW.{x}" for x in cols])
+            mark = "INSERT OR IGNORE INTO export_animal_dirty (md5hash) SELECT x FROM (SELECT {}) WHERE x IS NOT NULL;"
+            trigger_list = [
+                (f'{table}_export_insert', f'AFTER INSERT ON {table}', mark.format('NEW.md5hash AS x')),
+                (f'{table}_export_update', f"AFTER UPDATE OF {', '.join(cols)} ON {table} WHEN {changed}",
+                 mark.format('OLD.md5hash AS x UNION SELECT NEW.md5hash')),
+                (f'{table}_export_delete', f'AFTER DELETE ON {table}', mark.format('OLD.md5hash AS x')),
+            ]
+            for name, event, body in trigger_list:
+                sql_list.append(f"CREATE TRIGGER IF NOT EXISTS {name} {event}\nBEGIN\n    {body}\nEND;")
+        changed = ' OR '.join([f"OLD.{x} IS NOT NEW.{x}" for x in IMPORT_COLS])
+        mark = '\n    '.join((
+            "INSERT OR IGNORE INTO export_animal_dirty (md5hash)",
+            "SELECT md5hash FROM photo WHERE dt_import IN ({}) AND md5hash IS NOT NULL;"))
+        trigger_list = [
+            ('import_export_insert', 'AFTER INSERT ON import', mark.format('NEW.import_date')),
+            ('import_export_update', f"AFTER UPDATE OF {', '.join(IMPORT_COLS)} ON import WHEN {changed}",
+             mark.format('OLD.import_date, NEW.import_date')),
+            ('import_export_delete', 'AFTER DELETE ON import', mark.format('OLD.import_date')),
+        ]
+        for name, event, body in trigger_list:
+            sql_list.append(f"CREATE TRIGGER IF NOT EXISTS {name} {event}\nBEGIN\n    {body}\nEND;")
+    else:
+        sql_list.append('\n'.join((
+            "CREATE OR REPLACE FUNCTION export_animal_mark() RETURNS trigger AS $$",
+            "BEGIN",
+            "    IF TG_OP <> 'INSERT' AND OLD.md5hash IS NOT NULL THEN",
+            "        INSERT INTO export_animal_dirty (md5hash) VALUES (OLD.md5hash) ON CONFLICT DO NOTHING;",
+            "    END IF;",
+            "    IF TG_OP <> 'DELETE' AND NEW.md5hash IS NOT NULL THEN",
+            "        INSERT INTO export_animal_dirty (md5hash) VALUES (NEW.md5hash) ON CONFLICT DO NOTHING;",
+            "    END IF;",
+            "    RETURN NULL;",
+            "END;",
+            "$$ LANGUAGE plpgsql;")))
+        for table, cols in TRACKED_COLS.items():
+            old = ', '.join([f"OLD.{x}" for x in cols])
+            new = ', '.join([f"NEW.{x}" for x in cols])
+            trigger_list = [
+                (f'{table}_export_insert_delete', f'AFTER INSERT OR DELETE ON {table} FOR EACH ROW'),
+                (f'{table}_export_update', f"AFTER UPDATE OF {', '.join(cols)} ON {table} FOR EACH ROW "
+                                           f"WHEN (({old}) IS DISTINCT FROM ({new}))"),
+            ]
+            for name, event in trigger_list:
+                sql_list.append(f"DROP TRIGGER IF EXISTS {name} ON {table};")
+                sql_list.append(f"CREATE TRIGGER {name} {event} EXECUTE FUNCTION export_animal_mark();")
+        sql_list.append('\n'.join((
+            "CREATE OR REPLACE FUNCTION export_animal_mark_import() RETURNS trigger AS $$",
+            "BEGIN",
+            "    IF TG_OP <> 'INSERT' THEN",
+            "        INSERT INTO export_animal_dirty (md5hash)",
+            "        SELECT md5hash FROM photo WHERE dt_import = OLD.import_date AND md5hash IS NOT NULL",
+            "            ON CONFLICT DO NOTHING;",
+            "    END IF;",
+            "    IF TG_OP <> 'DELETE' THEN",
+            "        INSERT INTO export_animal_dirty (md5hash)",
+            "        SELECT md5hash FROM photo WHERE dt_import = NEW.import_date AND md5hash IS NOT NULL",
+            "            ON CONFLICT DO NOTHING;",
+            "    END IF;",
+            "    RETURN NULL;",
+            "END;",
+            "$$ LANGUAGE plpgsql;")))
+        old = ', '.join([f"OLD.{x}" for x in IMPORT_COLS])
+        new = ', '.join([f"NEW.{x}" for x in IMPORT_COLS])
+        trigger_list = [
+            ('import_export_insert_delete', 'AFTER INSERT OR DELETE ON import FOR EACH ROW'),
+            ('import_export_update', f"AFTER UPDATE OF {', '.join(IMPORT_COLS)} ON import FOR EACH ROW "
+                                     f"WHEN (({old}) IS DISTINCT FROM ({new}))"),
+        ]
+        for name, event in trigger_list:
+            sql_list.append(f"DROP TRIGGER IF EXISTS {name} ON import;")
+            sql_list.append(f"CREATE TRIGGER {name} {event} EXECUTE FUNCTION export_animal_mark_import();")
+    for sql in sql_list:
+        c.execute(sql)
+    con.commit()
+    if created:
+        refresh_export_animal(con=con, full=True)
+    return created
+
+
+def refresh_export_animal(con: Union[sqlite.Connection, psycopg.Connection], full: bool = False) -> int:
+    """rebuilds the export_animal_mat rows of the md5hashes logged in export_animal_dirty, or every row if full is
+    True, and clears the log. Returns the number of rows written."""
+    start = time.perf_counter()
+    c = con.cursor()
+    cols = ', '.join(['md5hash'] + [f'"{x}"' if x == 'path' else x for x in EXPORT_COLS])
+    if full:
+        c.execute("DELETE FROM export_animal_mat;")
+        where = ''
+    else:
+        c.execute("DELETE FROM export_animal_mat WHERE md5hash IN (SELECT md5hash FROM export_animal_dirty);")
+        where = " WHERE c.md5hash IN (SELECT md5hash FROM export_animal_dirty)"
+    c.execute(f"INSERT INTO export_animal_mat ({cols})\n{export_animal_select(con=con, where=where)};")
+    n = c.rowcount
+    c.execute("DELETE FROM export_animal_dirty;")
+    con.commit()
+    report_rate('export_animal_mat', n, start)
+    return n
+
+
+def export_csv(con: Union[sqlite.Connection, psycopg.Connection], out_path: str, batch: int = 10000) -> int:
+    """writes export_animal_mat to out_path ordered by path and id, fetching batch rows at a time (through a server
+    side cursor on PostgreSQL). Returns the number of rows written."""
+    start = time.perf_counter()
+    if isinstance(con, sqlite.Connection):
+        c = con.cursor()
+    elif isinstance(con, psycopg.Connection):
+        c = con.cursor(name='export_animal', row_factory=psycopg.rows.tuple_row)
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    cols = ', '.join([f'"{x}"' if x == 'path' else x for x in EXPORT_COLS])
+    c.execute(f'SELECT {cols} FROM export_animal_mat ORDER BY "path", id;')
+    n = 0
+    with open(out_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLS)
+        while True:
+            rows = c.fetchmany(batch)
+            if not rows:
+                break
+            writer.writerows(rows)
+            n += len(rows)
+    c.close()
+    report_rate(out_path, n, start)
+    return n
+
+
+if __name__ == "__main__":
+    # parses script arguments
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='This script will export the animal detections of a camera trap database to a csv.')
+    # positional arguments
+    parser.add_argument('out_path', help='the path of the csv to write.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--dbpath', help='the path of the spatialite database to export from.')
+    group.add_argument('--db', help='the PostgreSQL database to which to connect.')
+    args_pg = parser.add_argument_group('PostgreSQL')
+    args_pg.add_argument('--host', default='localhost')
+    args_pg.add_argument('--user', default='postgres')
+    args_pg.add_argument('--port', default=5432, type=int)
+    args_pg.add_argument('--passwd', help="Password for user.")
+    args_pg.add_argument('--noask', action='store_true',
+                         help="User will not be prompted for password if none given.")
+    parser.add_argument('-b', '--batch', type=int, default=10000,
+                        help='the number of rows to fetch and write at a time.')
+    parser.add_argument('--full', action='store_true',
+                        help='rebuild every exported row rather than only those of changed detections.')
+    args = parser.parse_args()
+
+    if args.dbpath:
+        conn = cdb.get_sqlite_con(dbpath=args.dbpath, geo=True)
+    else:
+        if args.passwd is None and not args.noask:
+            args.passwd = getpass()
+        conn = pg_con(user=args.user, database=args.db, password=args.passwd, host=args.host, port=args.port)
+    print("Refreshing export_animal_mat...")
+    if not create_export_table(con=conn):
+        refresh_export_animal(con=conn, full=args.full)
+    print("Writing csv...")
+    export_csv(con=conn, out_path=args.out_path, batch=args.batch)
+    conn.close()
+    print("Script complete.")
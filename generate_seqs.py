@@ -7,7 +7,6 @@
 This script will generate a sample of animal sequences given script filtering parameters and store them in a csv file.
 """
 
-import sqlite3 as sqlite
 import argparse
 import csv
 import pandas as pd
@@ -21,6 +20,8 @@ from collections.abc import Iterable
 
 # local
 from sample import get_photos
+from profiler import start_profile, profile_stage
+from connection import sqlite_con
 
 
 def enclose_with_sql(sql):
@@ -84,10 +85,8 @@ def get_seqs(dbpath, sql, params, seq_no, by_id=False, by_year=False, by_site=Fa
              verbose=False):
     """returns a list of seqs based on the given criteria"""
     print("getting sequences...")
-    con = sqlite.connect(dbpath)
-    con.row_factory = sqlite.Row
-    if verbose:
-        con.set_trace_callback(print)
+    con = sqlite_con(dbpath)
+    con.set_trace_callback(print if verbose else None)
     c = con.cursor()
     seq_list = []
     if seq_no is not None:
@@ -128,7 +127,6 @@ def get_seqs(dbpath, sql, params, seq_no, by_id=False, by_year=False, by_site=Fa
         rows = c.execute(new_sql, params)
         for row in rows:
             seq_list.append(row['seq_id'])
-    con.close()
     return new_sql, params, seq_list
 
 
@@ -214,7 +212,7 @@ def pop_generation(dbpath, script_vars, seqs):
         formatted_vars['partition'] = part_str
     else:
         formatted_vars['partition'] = None
-    conn = sqlite.connect(dbpath)
+    conn = sqlite_con(dbpath)
     c = conn.cursor()
     c.execute(gen_sql, formatted_vars)
     conn.commit()
@@ -223,7 +221,6 @@ def pop_generation(dbpath, script_vars, seqs):
     seq_sql = "INSERT INTO sequence_gen (seq_id, gen_id) VALUES (:seq_id, :gen_id);"
     c.executemany(seq_sql, seq_list)
     conn.commit()
-    conn.close()
 
 
 if __name__ == "__main__":
@@ -271,8 +268,16 @@ if __name__ == "__main__":
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Print out extra information such as queries used to generate sequences.')
 
+    parser.add_argument('--profile', nargs='?', const='generate_seqs_profile.json',
+                        help='time each stage and SQL statement, capture query plans and peak memory, and write a json '
+                             'report to this path (default generate_seqs_profile.json).')
+    parser.add_argument('--profile_top', type=int, default=20,
+                        help='the number of slowest statements to print with --profile.')
     args = parser.parse_args()
 
+    if args.profile:
+        start_profile(script='generate_seqs', out_path=args.profile, top=args.profile_top)
+
     if args.date_range:
         if len(args.date_range) % 2 != 0:
             print("date_range argument must by a multiple of two. Quitting...")
@@ -282,22 +287,26 @@ if __name__ == "__main__":
             print(os.path.dirname(args.seq_file), "does not exist. Quitting...")
             quit()
 
-    my_sql, my_params, my_photos = get_photos(dbpath=args.dbpath, animal=args.animal, animal_not=args.animal_not,
-                                              animal_like=args.animal_like, animal_not_like=args.animal_not_like,
-                                              date_range=args.date_range, site_name=args.site_name, camera=args.camera,
-                                              classifier=args.classifier, df=False)
+    with profile_stage('get_photos'):
+        my_sql, my_params, my_photos = get_photos(dbpath=args.dbpath, animal=args.animal, animal_not=args.animal_not,
+                                                  animal_like=args.animal_like, animal_not_like=args.animal_not_like,
+                                                  date_range=args.date_range, site_name=args.site_name,
+                                                  camera=args.camera, classifier=args.classifier, df=False)
     with_sql = enclose_with_sql(sql=my_sql)
     filt_sql = limit_by_condition(sql=with_sql, filter_condition=args.filter_condition)
     gen_sql = limit_by_generated(sql=filt_sql, filter_generated=args.filter_generated)
-    final_sql, final_params, seqs = get_seqs(dbpath=args.dbpath, sql=gen_sql, params=my_params,
-                                             seq_no=args.seq_no, verbose=args.verbose, by_id=args.by_id,
-                                             by_year=args.by_year, by_site=args.by_site, by_camera=args.by_camera)
+    with profile_stage('get_seqs'):
+        final_sql, final_params, seqs = get_seqs(dbpath=args.dbpath, sql=gen_sql, params=my_params,
+                                                 seq_no=args.seq_no, verbose=args.verbose, by_id=args.by_id,
+                                                 by_year=args.by_year, by_site=args.by_site, by_camera=args.by_camera)
     print(len(seqs), "sequences found.")
-    write_csv(outfile=args.seq_file, seqs=seqs, params=final_params, comment=True, overwrite=args.overwrite,
-              subsample=args.subsample)
+    with profile_stage('write_csv'):
+        write_csv(outfile=args.seq_file, seqs=seqs, params=final_params, comment=True, overwrite=args.overwrite,
+                  subsample=args.subsample)
     if args.save:
         print('Saving generated sequences...')
-        pop_generation(dbpath=args.dbpath, script_vars=vars(args), seqs=seqs)
+        with profile_stage('pop_generation'):
+            pop_generation(dbpath=args.dbpath, script_vars=vars(args), seqs=seqs)
     else:
         print('Not saving generated sequences...')
 
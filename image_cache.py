@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-17
+@author: Wade Lieurance
+
+A least recently used cache of decoded photos for the photo viewers (sample.py and view_ratings.py). Photos are keyed
+by md5hash, so a photo is decoded once however many times (or under however many paths) it is viewed, and the cache
+is bounded by the memory the decoded photos take rather than their number. Hits, misses and evictions are counted so
+that a session can report how well the cache served it. It needs no image library itself; reduced resolution proxies
+of the photos (which need OpenCV) are read by proxies.py.
+"""
+
+import threading
+from collections import OrderedDict
+
+# the default memory budget of a cache in MB
+CACHE_MB = 512
+
+
+def image_bytes(img) -> int:
+    """returns the memory used by a decoded photo, either a numpy array (OpenCV) or a PIL image"""
+    if hasattr(img, 'nbytes'):
+        return int(img.nbytes)
+    if hasattr(img, 'getbands'):
+        return img.width * img.height * len(img.getbands())
+    raise TypeError(f"can't size an image of type {type(img).__name__}.")
+
+
+class ImageCache:
+    """decoded photos keyed by md5hash, the least recently used being evicted once they take more than max_bytes.
+    Safe to fill from worker threads."""
+    def __init__(self, max_bytes: int = CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.images = OrderedDict()  # md5hash: (image, size)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key) -> bool:
+        with self.lock:
+            return key in self.images
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def get(self, key):
+        """returns a cached photo, marking it most recently used, or None if it is not cached"""
+        with self.lock:
+            entry = self.images.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.images.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, img):
+        """caches a photo, evicting the least recently used until it fits. Photos larger than the whole budget and
+        None (a photo that could not be read) are not cached."""
+        if img is None:
+            return img
+        size = image_bytes(img)
+        if size > self.max_bytes:
+            return img
+        with self.lock:
+            old = self.images.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            while self.images and self.bytes + size > self.max_bytes:
+                self.bytes -= self.images.popitem(last=False)[1][1]
+                self.evictions += 1
+            self.images[key] = (img, size)
+            self.bytes += size
+        return img
+
+    def load(self, key, read, *args):
+        """returns the cached photo for key, or reads it with read(*args) and caches it"""
+        img = self.get(key)
+        if img is None:
+            img = self.put(key, read(*args))
+        return img
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'images': len(self.images), 'mb': round(self.bytes / (1024 * 1024), 1),
+                    'max_mb': round(self.max_bytes / (1024 * 1024), 1)}
+
+    def report(self) -> str:
+        s = self.stats()
+        lookups = s['hits'] + s['misses']
+        rate = f"{s['hits'] / lookups:.0%}" if lookups else 'n/a'
+        return (f"image cache: {s['hits']} hits, {s['misses']} misses ({rate} hit rate), {s['evictions']} evictions, "
+                f"{s['images']} photos in {s['mb']}/{s['max_mb']} MB.")
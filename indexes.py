@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-16
+@author: Wade Lieurance
+
+Index and planner statistics management for the camera trap database. Each create_db stage declares the indexes its
+queries rely on so they can be built before the stage runs, and the tables a stage writes are analyzed once it
+finishes. Run as a script to report table sizes and index usage for a SQLite or PostgreSQL camera trap database.
+"""
+
+import argparse
+import sqlite3 as sqlite
+import pandas as pd
+import psycopg
+from photo_mgmt import create_db as cdb
+from bulk import read_frame
+from connection import pg_con
+from typing import Union
+from getpass import getpass
+
+
+# indexes as (name, table, columns), keyed by the create_db stage whose queries use them
+STAGE_INDEXES = {
+    'cameras': [
+        ('photo_site_camera_dt', 'photo', ('site_name', 'camera_id', 'dt_orig', 'dt_mod')),
+    ],
+    'seasons': [
+        ('photo_site_camera_dt', 'photo', ('site_name', 'camera_id', 'dt_orig', 'dt_mod')),
+    ],
+    'animals': [
+        ('photo_md5hash', 'photo', ('md5hash',)),
+    ],
+    'sequences': [
+        ('photo_md5hash', 'photo', ('md5hash',)),
+        ('animal_id', 'animal', ('id',)),
+        ('animal_seq_id', 'animal', ('seq_id',)),
+        ('sequence_site_camera_id_dt', 'sequence', ('site_name', 'camera_id', 'id', 'min_dt', 'max_dt')),
+        ('condition_seqs_seq_id', 'condition_seqs', ('seq_id',)),
+    ],
+    'final': [
+        ('photo_date_orig', 'photo', ('date_orig',)),
+        ('photo_mmdd_orig', 'photo', ('mmdd_orig',)),
+        ('photo_camera_id', 'photo', ('camera_id',)),
+        ('sequence_id', 'sequence', ('id',)),
+        ('sequence_camera_id', 'sequence', ('camera_id',)),
+        ('sequence_gen_id', 'sequence_gen', ('gen_id',)),
+        ('condition_scorer_name', 'condition', ('scorer_name',)),
+        ('condition_rating', 'condition', ('rating',)),
+        ('condition_md5hash', 'condition', ('md5hash',)),
+    ]
+}
+
+# tables written by each stage, analyzed once the stage finishes
+STAGE_TABLES = {
+    'sites': ['site', 'photo'],
+    'cameras': ['camera', 'photo'],
+    'seasons': ['season', 'season_watermark', 'photo'],
+    'animals': ['animal', 'animal_loc'],
+    'sequences': ['sequence', 'animal'],
+}
+
+# indexes made redundant by a primary key or a composite index sharing their leading columns, or superseded by an
+# index on a derived numeric column
+REDUNDANT_INDEXES = ['photo_site_name', 'photo_site_name_camera_id', 'camera_site_name', 'sequence_site_name',
+                     'sequence_site_name_camera_id', 'photo_dt_orig']
+
+
+def create_stage_indexes(con: Union[sqlite.Connection, psycopg.Connection], stage: str):
+    """creates (if missing) the indexes used by the queries of a create_db stage"""
+    c = con.cursor()
+    for name, table, cols in STAGE_INDEXES.get(stage, []):
+        c.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(cols)});")
+    con.commit()
+
+
+def analyze_stage(con: Union[sqlite.Connection, psycopg.Connection], stage: str):
+    """refreshes the planner statistics of the tables written by a create_db stage"""
+    if not isinstance(con, (sqlite.Connection, psycopg.Connection)):
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    c = con.cursor()
+    for table in STAGE_TABLES.get(stage, []):
+        c.execute(f"ANALYZE {table};")
+    con.commit()
+
+
+def finalize_indexes(con: Union[sqlite.Connection, psycopg.Connection]):
+    """creates all stage indexes, drops redundant ones and lets the database refresh any stale statistics"""
+    c = con.cursor()
+    for stage in STAGE_INDEXES:
+        create_stage_indexes(con=con, stage=stage)
+    for name in REDUNDANT_INDEXES:
+        c.execute(f"DROP INDEX IF EXISTS {name};")
+    if isinstance(con, sqlite.Connection):
+        c.execute("PRAGMA optimize;")
+    elif isinstance(con, psycopg.Connection):
+        c.execute("ANALYZE;")
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    con.commit()
+
+
+def table_report(con: Union[sqlite.Connection, psycopg.Connection]) -> pd.DataFrame:
+    """returns the row count and on disk size of each table. SQLite sizes come from the dbstat virtual table and are
+    left empty if SQLite was compiled without it."""
+    if isinstance(con, sqlite.Connection):
+        tables = read_frame(con, "SELECT name AS table_name FROM sqlite_schema WHERE type = 'table' "
+                                 "AND name NOT LIKE 'sqlite_%' ORDER BY name;")
+        tables['n_rows'] = [read_frame(con, f'SELECT count(*) AS n FROM "{x}";').iloc[0, 0]
+                            for x in tables['table_name']]
+        try:
+            sizes = read_frame(con, "SELECT name AS table_name, sum(pgsize) AS size_bytes FROM dbstat GROUP BY name;")
+        except sqlite.OperationalError:
+            sizes = pd.DataFrame(columns=['table_name', 'size_bytes'])
+        return tables.merge(sizes, how='left', on='table_name')
+    elif isinstance(con, psycopg.Connection):
+        return read_frame(con, '\n'.join((
+            "SELECT relname AS table_name, n_live_tup AS n_rows,",
+            "       pg_table_size(relid) AS size_bytes, pg_indexes_size(relid) AS index_bytes,",
+            "       seq_scan, idx_scan, last_analyze, last_autoanalyze",
+            "  FROM pg_stat_user_tables",
+            " ORDER BY relname;"
+        )))
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+
+
+def index_report(con: Union[sqlite.Connection, psycopg.Connection]) -> pd.DataFrame:
+    """returns each index with its size and usage. PostgreSQL reports the number of scans since statistics were last
+    reset; SQLite keeps no usage counters, so its ANALYZE statistics (sqlite_stat1) are given instead."""
+    if isinstance(con, sqlite.Connection):
+        idx = read_frame(con, "SELECT name AS index_name, tbl_name AS table_name FROM sqlite_schema "
+                              "WHERE type = 'index' ORDER BY tbl_name, name;")
+        try:
+            sizes = read_frame(con, "SELECT name AS index_name, sum(pgsize) AS size_bytes FROM dbstat GROUP BY name;")
+        except sqlite.OperationalError:
+            sizes = pd.DataFrame(columns=['index_name', 'size_bytes'])
+        try:
+            stats = read_frame(con, "SELECT idx AS index_name, stat FROM sqlite_stat1;")
+        except sqlite.OperationalError:
+            stats = pd.DataFrame(columns=['index_name', 'stat'])
+        return idx.merge(sizes, how='left', on='index_name').merge(stats, how='left', on='index_name')
+    elif isinstance(con, psycopg.Connection):
+        return read_frame(con, '\n'.join((
+            "SELECT indexrelname AS index_name, relname AS table_name,",
+            "       pg_relation_size(indexrelid) AS size_bytes, idx_scan, idx_tup_read, idx_tup_fetch",
+            "  FROM pg_stat_user_indexes",
+            " ORDER BY relname, indexrelname;"
+        )))
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+
+
+def print_report(con: Union[sqlite.Connection, psycopg.Connection]):
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print("Tables:")
+        print(table_report(con=con).to_string(index=False))
+        print("\nIndexes:")
+        print(index_report(con=con).to_string(index=False))
+
+
+if __name__ == "__main__":
+    # parses script arguments
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='This script will report table sizes and index usage for a camera trap database.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--dbpath', help='the path of the spatialite database to report on.')
+    group.add_argument('--db', help='the PostgreSQL database to which to connect.')
+    args_pg = parser.add_argument_group('PostgreSQL')
+    args_pg.add_argument('--host', default='localhost')
+    args_pg.add_argument('--user', default='postgres')
+    args_pg.add_argument('--port', default=5432, type=int)
+    args_pg.add_argument('--passwd', help="Password for user.")
+    args_pg.add_argument('--noask', action='store_true',
+                         help="User will not be prompted for password if none given.")
+    parser.add_argument('--analyze', action='store_true',
+                        help='refresh planner statistics (ANALYZE) before reporting.')
+    args = parser.parse_args()
+
+    if args.dbpath:
+        conn = cdb.get_sqlite_con(dbpath=args.dbpath, geo=True)
+    else:
+        if args.passwd is None and not args.noask:
+            args.passwd = getpass()
+        conn = pg_con(user=args.user, database=args.db, password=args.passwd, host=args.host, port=args.port)
+    if args.analyze:
+        conn.cursor().execute("ANALYZE;")
+        conn.commit()
+    print_report(con=conn)
+    conn.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-16
+@author: Wade Lieurance
+
+A stage ledger for the create_db pipeline. Each stage is recorded in the stage_ledger table with a fingerprint of its
+inputs (csv content hashes, break parameters, photo/animal row counts and the fingerprint of the stage before it) and
+its completion status. A rerun skips stages whose fingerprint matches a completed entry, so an interrupted or failed
+build resumes at the first stage that is dirty or did not finish, and every stage after it runs again.
+"""
+
+import hashlib
+import json
+import time
+import sqlite3 as sqlite
+import psycopg
+from datetime import datetime
+from bulk import read_frame
+from typing import Union, Callable
+
+
+def file_hash(path: str, blocksize: int = 1 << 20) -> str:
+    """returns the md5 hex digest of a file's contents"""
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def table_state(con: Union[sqlite.Connection, psycopg.Connection], table: str) -> int:
+    """returns the row count of a table, used as a cheap summary of a stage's database input"""
+    return int(read_frame(con, f"SELECT count(*) AS n FROM {table};").iloc[0, 0])
+
+
+class StageLedger:
+    """runs create_db stages, skipping those whose inputs are unchanged since they last completed"""
+    def __init__(self, con: Union[sqlite.Connection, psycopg.Connection], rerun: bool = False):
+        if isinstance(con, sqlite.Connection):
+            self.ph = '?'
+        elif isinstance(con, psycopg.Connection):
+            self.ph = '%s'
+        else:
+            raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+        self.con = con
+        self.rerun = rerun
+        self.prev_fp = ''
+        self.dirty = False
+        c = con.cursor()
+        c.execute('\n'.join((
+            "CREATE TABLE IF NOT EXISTS stage_ledger (",
+            "    stage VARCHAR,",
+            "    fingerprint VARCHAR,",
+            "    status VARCHAR,",
+            "    inputs VARCHAR,",
+            "    started VARCHAR,",
+            "    finished VARCHAR,",
+            "    seconds FLOAT,",
+            "    PRIMARY KEY(stage));"
+        )))
+        con.commit()
+        self.entries = {r['stage']: r for r in read_frame(con, "SELECT * FROM stage_ledger;").to_dict('records')}
+
+    def fingerprint(self, inputs: dict) -> str:
+        """hashes a stage's inputs together with the fingerprint of the stage before it"""
+        return hashlib.md5(json.dumps([self.prev_fp, inputs], sort_keys=True, default=str).encode()).hexdigest()
+
+    def _record(self, stage: str, fp: str, status: str, inputs: dict, started: str, secs: float = None):
+        c = self.con.cursor()
+        c.execute(f"DELETE FROM stage_ledger WHERE stage = {self.ph};", (stage,))
+        finished = datetime.now().isoformat(sep=' ', timespec='seconds') if status != 'running' else None
+        c.execute("INSERT INTO stage_ledger (stage, fingerprint, status, inputs, started, finished, seconds) "
+                  f"VALUES ({', '.join([self.ph] * 7)});",
+                  (stage, fp, status, json.dumps(inputs, sort_keys=True, default=str), started, finished, secs))
+        self.con.commit()
+        self.entries[stage] = {'stage': stage, 'fingerprint': fp, 'status': status}
+
+    def skip(self, stage: str):
+        """carries a stage that was not requested this run into the fingerprint chain unchanged"""
+        entry = self.entries.get(stage)
+        if entry is not None:
+            self.prev_fp = entry['fingerprint']
+
+    def record(self, stage: str, inputs: dict, secs: float = None):
+        """records a stage completed outside of run (e.g. by a parallel shard build) so that a rerun can skip it"""
+        fp = self.fingerprint(inputs)
+        self.prev_fp = fp
+        self.dirty = True
+        now = datetime.now().isoformat(sep=' ', timespec='seconds')
+        self._record(stage=stage, fp=fp, status='done', inputs=inputs, started=now, secs=secs)
+
+    def run(self, stage: str, inputs: dict, func: Callable, kwargs: dict = None, force: bool = False):
+        """runs func(**kwargs) unless the stage already completed with the same fingerprint and no earlier stage ran
+        again. force runs the stage regardless. Returns True if the stage ran."""
+        kwargs = kwargs or {}
+        fp = self.fingerprint(inputs)
+        self.prev_fp = fp
+        entry = self.entries.get(stage)
+        if (not (self.rerun or force or self.dirty) and entry is not None and entry['fingerprint'] == fp
+                and entry['status'] == 'done'):
+            print(f"\tinputs unchanged since {stage} last completed. skipping...")
+            return False
+        self.dirty = True
+        started = datetime.now().isoformat(sep=' ', timespec='seconds')
+        self._record(stage=stage, fp=fp, status='running', inputs=inputs, started=started)
+        start = time.perf_counter()
+        try:
+            func(**kwargs)
+        except BaseException:
+            self.con.rollback()
+            self._record(stage=stage, fp=fp, status='failed', inputs=inputs, started=started,
+                         secs=time.perf_counter() - start)
+            raise
+        self._record(stage=stage, fp=fp, status='done', inputs=inputs, started=started,
+                     secs=time.perf_counter() - start)
+        return True
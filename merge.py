@@ -7,16 +7,15 @@
 This script will generate a sample of animal sequences given script filtering parameters and store them in a csv file.
 """
 
-import sqlite3 as sqlite
 import argparse
+from profiler import start_profile, profile_stage
+from connection import sqlite_con
 
 
 def merge_db(source, dest):
-    con = sqlite.connect(dest)
-    con.enable_load_extension(True)
+    con = sqlite_con(dest, spatial=True)
     c = con.cursor()
     c.execute("PRAGMA foreign_keys = on;")
-    c.execute("SELECT load_extension('mod_spatialite');")
     c.execute("ATTACH DATABASE '{source}' AS src;".format(source=source))
     print("Inserting into site... ", end="", flush=True)
     c.execute("INSERT OR IGNORE INTO main.site (site_name, state_code) "
@@ -87,7 +86,8 @@ def merge_db(source, dest):
     print(c.rowcount, "rows affected.")
     con.commit()
     c.execute("DETACH DATABASE src;")
-    con.close()
+    # restores the default for the next user of the shared connection
+    c.execute("PRAGMA foreign_keys = off;")
 
 
 if __name__ == "__main__":
@@ -98,7 +98,16 @@ if __name__ == "__main__":
     # positional arguments
     parser.add_argument('source', help='A camera trap db from which to source records.')
     parser.add_argument('destination', help='A camera trap db in which to insert the source records.')
+    parser.add_argument('--profile', nargs='?', const='merge_profile.json',
+                        help='time each stage and SQL statement, capture query plans and peak memory, and write a json '
+                             'report to this path (default merge_profile.json).')
+    parser.add_argument('--profile_top', type=int, default=20,
+                        help='the number of slowest statements to print with --profile.')
     args = parser.parse_args()
 
-    merge_db(source=args.source, dest=args.destination)
+    if args.profile:
+        start_profile(script='merge', out_path=args.profile, top=args.profile_top)
+
+    with profile_stage('merge_db'):
+        merge_db(source=args.source, dest=args.destination)
     print("Script complete.")
\ No newline at end of file
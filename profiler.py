@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-17
+@author: Wade Lieurance
+
+Profiling for the --profile option of the camera trap scripts. start_profile replaces sqlite3.connect and
+psycopg.connect so that every connection opened afterwards times the statements it executes (including COPY on
+PostgreSQL) along with their rows affected, and captures the plan of each distinct statement the first time it runs
+(EXPLAIN QUERY PLAN on SQLite, EXPLAIN ANALYZE inside a rolled back savepoint on PostgreSQL). The plan of a
+CREATE ... AS statement is that of its query. Scripts mark their stages with profile_stage, which records each stage's
+wall time, rows affected and peak RSS. At exit a json report is written and the slowest statements are printed.
+"""
+
+import re
+import sys
+import json
+import time
+import atexit
+import contextlib
+import sqlite3 as sqlite
+import psycopg
+import psycopg.rows
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PROFILER = None
+# statements whose plan is captured, by their first keyword
+EXPLAINED = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+LEADING_COMMENTS = re.compile(r'^(\s*--[^\n]*\n|\s*/\*.*?\*/)*\s*', re.S)
+# the query of a CREATE TABLE / MATERIALIZED VIEW ... AS <query> statement, which is explained in its place
+CREATE_AS = re.compile(r'^CREATE\s+(?:(?:TEMP|TEMPORARY|UNLOGGED)\s+)?(?:TABLE|MATERIALIZED\s+VIEW)\s+'
+                       r'(?:IF\s+NOT\s+EXISTS\s+)?[^\s(]+\s*(?:\([^)]*\)\s*)?(?<=[\s)])AS\s+'
+                       r'(.+?)(?:\s+WITH\s+(?:NO\s+)?DATA)?\s*;?\s*$', re.S | re.I)
+
+
+def peak_rss_mb():
+    """returns the peak resident memory of the process so far in MB, or None where it is not available"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def first_keyword(sql: str) -> str:
+    return LEADING_COMMENTS.sub('', sql, count=1)[:10].split(maxsplit=1)[0].upper() if sql.strip() else ''
+
+
+def explained_sql(sql: str):
+    """returns the statement whose plan is captured for sql: sql itself, the query of a CREATE ... AS statement, or
+    None if it has no plan"""
+    keyword = first_keyword(sql)
+    if keyword in EXPLAINED:
+        return sql
+    if keyword == 'CREATE':
+        m = CREATE_AS.match(LEADING_COMMENTS.sub('', sql, count=1))
+        if m is not None and first_keyword(m.group(1)) in EXPLAINED:
+            return m.group(1)
+    return None
+
+
+class ProfiledSqliteCursor(sqlite.Cursor):
+    def execute(self, sql, parameters=()):
+        return PROFILER.run(cur=self, call=lambda: super(ProfiledSqliteCursor, self).execute(sql, parameters),
+                            sql=sql, params=parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return PROFILER.run(cur=self,
+                            call=lambda: super(ProfiledSqliteCursor, self).executemany(sql, seq_of_parameters),
+                            sql=sql, params=None, many=True)
+
+
+class ProfiledSqliteConnection(sqlite.Connection):
+    """a sqlite3 connection whose cursors, and execute shortcuts, are profiled"""
+    def cursor(self, factory=ProfiledSqliteCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ProfiledPgCursor(psycopg.Cursor):
+    def execute(self, query, params=None, **kwargs):
+        return PROFILER.run(cur=self, call=lambda: super(ProfiledPgCursor, self).execute(query, params, **kwargs),
+                            sql=query, params=params)
+
+    def executemany(self, query, params_seq, **kwargs):
+        return PROFILER.run(cur=self,
+                            call=lambda: super(ProfiledPgCursor, self).executemany(query, params_seq, **kwargs),
+                            sql=query, params=None, many=True)
+
+    @contextlib.contextmanager
+    def copy(self, statement, params=None, **kwargs):
+        start = time.perf_counter()
+        with super().copy(statement, params, **kwargs) as cp:
+            yield cp
+        PROFILER.record(sql=statement if isinstance(statement, str) else statement.as_string(self),
+                        secs=time.perf_counter() - start, rows=self.rowcount)
+
+
+class Profiler:
+    """collects stage and statement timings for one script run"""
+    def __init__(self, script: str, out_path: str, top: int = 20):
+        self.script = script
+        self.out_path = out_path
+        self.top = top
+        self.started = datetime.now().isoformat(sep=' ', timespec='seconds')
+        self.start = time.perf_counter()
+        self.stack = []
+        self.stages = []
+        self.statements = {}
+        self.plans = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """times a stage of the script. Statements run while it is the innermost stage are counted toward it."""
+        entry = {'stage': name, 'seconds': None, 'rows': 0, 'statements': 0, 'sql_seconds': 0.0,
+                 'peak_rss_mb': None, 'status': 'running'}
+        self.stages.append(entry)
+        self.stack.append(entry)
+        start = time.perf_counter()
+        try:
+            yield entry
+            entry['status'] = 'done'
+        except BaseException:
+            entry['status'] = 'failed'
+            raise
+        finally:
+            self.stack.remove(entry)
+            entry['seconds'] = round(time.perf_counter() - start, 4)
+            entry['sql_seconds'] = round(entry['sql_seconds'], 4)
+            entry['peak_rss_mb'] = peak_rss_mb()
+            print(f"\t[profile] {name}: {entry['seconds']:.3f}s, {entry['rows']} rows, "
+                  f"peak RSS {entry['peak_rss_mb']} MB")
+
+    def explain(self, cur, sql: str, params) -> list:
+        """returns the plan of a statement as a list of lines, or a single line saying why it could not be explained"""
+        con = cur.connection
+        try:
+            if isinstance(con, sqlite.Connection):
+                rows = sqlite.Cursor(con).execute('EXPLAIN QUERY PLAN ' + sql, params or ()).fetchall()
+                depth = {0: -1}
+                lines = []
+                for r in rows:
+                    depth[r[0]] = depth.get(r[1], -1) + 1
+                    lines.append('  ' * depth[r[0]] + str(r[3]))
+                return lines
+            ex = psycopg.Cursor(con, row_factory=psycopg.rows.tuple_row)
+            if con.autocommit:
+                return [r[0] for r in ex.execute('EXPLAIN ' + sql, params).fetchall()]
+            # EXPLAIN ANALYZE runs the statement, so its changes are rolled back
+            ex.execute("SAVEPOINT profile_explain;")
+            try:
+                return [r[0] for r in ex.execute('EXPLAIN (ANALYZE, BUFFERS) ' + sql, params).fetchall()]
+            finally:
+                ex.execute("ROLLBACK TO SAVEPOINT profile_explain;")
+                ex.execute("RELEASE SAVEPOINT profile_explain;")
+        except (sqlite.Error, psycopg.Error) as e:
+            return [f"not explained ({type(e).__name__}: {e})"]
+
+    def run(self, cur, call, sql, params, many: bool = False):
+        """runs call (a cursor execute) and records its time. The plan of a statement is captured the first time it
+        runs, unless it runs with many parameter sets (executemany)."""
+        text = sql if isinstance(sql, str) else sql.as_string(cur)
+        key = ' '.join(text.split())
+        if not many and key not in self.plans:
+            query = explained_sql(text)
+            if query is not None:
+                self.plans[key] = self.explain(cur=cur, sql=query, params=params)
+        start = time.perf_counter()
+        try:
+            return call()
+        finally:
+            secs = time.perf_counter() - start
+            if isinstance(cur, psycopg.Cursor):
+                # rowcount is the number of rows returned for SELECT on PostgreSQL
+                status = (cur.statusmessage or '').split(' ')[0]
+                rows = cur.rowcount if status in ('INSERT', 'UPDATE', 'DELETE', 'MERGE', 'COPY') else -1
+            else:
+                rows = cur.rowcount
+            self.record(sql=text, secs=secs, rows=rows, key=key)
+
+    def record(self, sql: str, secs: float, rows: int, key: str = None):
+        key = key or ' '.join(sql.split())
+        stage = self.stack[-1] if self.stack else None
+        name = stage['stage'] if stage else None
+        entry = self.statements.setdefault((name, key), {'stage': name, 'sql': key, 'calls': 0, 'seconds': 0.0,
+                                                         'max_seconds': 0.0, 'rows': 0})
+        entry['calls'] += 1
+        entry['seconds'] += secs
+        entry['max_seconds'] = max(entry['max_seconds'], secs)
+        if rows is not None and rows > 0:
+            entry['rows'] += rows
+        if stage is not None:
+            stage['statements'] += 1
+            stage['sql_seconds'] += secs
+            if rows is not None and rows > 0:
+                stage['rows'] += rows
+
+    def report(self):
+        """writes the json report and prints the slowest statements"""
+        statements = sorted(self.statements.values(), key=lambda x: x['seconds'], reverse=True)
+        for s in statements:
+            s['seconds'] = round(s['seconds'], 4)
+            s['max_seconds'] = round(s['max_seconds'], 4)
+            s['plan'] = self.plans.get(s['sql'])
+        report = {'script': self.script, 'argv': sys.argv, 'started': self.started,
+                  'seconds': round(time.perf_counter() - self.start, 4), 'peak_rss_mb': peak_rss_mb(),
+                  'stages': self.stages, 'statements': statements}
+        with open(self.out_path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Slowest {min(self.top, len(statements))} of {len(statements)} statements "
+              f"({report['seconds']:.3f}s total run time):")
+        for i, s in enumerate(statements[:self.top], start=1):
+            sql = s['sql'] if len(s['sql']) <= 100 else s['sql'][:97] + '...'
+            print(f"{i:>4}. {s['seconds']:>9.3f}s {s['calls']:>7} calls {s['rows']:>9} rows  [{s['stage']}] {sql}")
+        print(f"Profile written to {self.out_path}.")
+
+
+def start_profile(script: str, out_path: str, top: int = 20) -> Profiler:
+    """starts profiling every sqlite3 and psycopg connection opened from now on, and reports at exit"""
+    global PROFILER
+    if PROFILER is not None:
+        return PROFILER
+    PROFILER = Profiler(script=script, out_path=out_path, top=top)
+    sqlite_connect = sqlite.connect
+    pg_connect = psycopg.connect
+
+    def connect_sqlite(*args, **kwargs):
+        kwargs.setdefault('factory', ProfiledSqliteConnection)
+        return sqlite_connect(*args, **kwargs)
+
+    def connect_pg(*args, **kwargs):
+        con = pg_connect(*args, **kwargs)
+        con.cursor_factory = ProfiledPgCursor
+        return con
+
+    sqlite.connect = connect_sqlite
+    psycopg.connect = connect_pg
+    atexit.register(PROFILER.report)
+    return PROFILER
+
+
+@contextlib.contextmanager
+def profile_stage(name: str):
+    """marks a stage of a script for the profile report. Does nothing unless start_profile was called."""
+    if PROFILER is None:
+        yield None
+    else:
+        with PROFILER.stage(name) as entry:
+            yield entry
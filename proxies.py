@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-17
+@author: Wade Lieurance
+
+Reduced resolution proxies of the photos for sample.py. A proxy is decoded from the original at 1/2, 1/4 or 1/8 of its
+size (JPEGs decode much faster at these scales) and written to a proxy directory under its md5hash the first time it
+is read, or by build_proxies ahead of a scoring session, so later sessions read the small file instead. A reduced
+photo is ceil(width / reduce) x ceil(height / reduce), so photo_size reads the original size from the photo's header
+for mapping coordinates on a proxy back to the original.
+"""
+
+import os
+import time
+import threading
+import cv2
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+# reduction factors at which OpenCV decodes a photo directly
+REDUCE_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+PROXY_QUALITY = 90
+# the EXIF orientation tag, and its values for which OpenCV swaps the width and height of a photo when decoding it
+ORIENTATION_TAG = 0x0112
+TRANSPOSED = (5, 6, 7, 8)
+
+
+def proxy_path(proxy_dir: str, key: str, reduce: int) -> str:
+    return os.path.join(proxy_dir, str(reduce), key[:2], key + '.jpg')
+
+
+def photo_size(path: str):
+    """returns the (width, height) of a photo as OpenCV decodes it (EXIF orientation applied), read from its header
+    without decoding it, or None if it can't be read"""
+    try:
+        with Image.open(path) as img:
+            w, h = img.size
+            return (h, w) if img.getexif().get(ORIENTATION_TAG) in TRANSPOSED else (w, h)
+    except (OSError, ValueError):
+        return None
+
+
+def read_proxy(path: str, key: str, proxy_dir: str, reduce: int = 1):
+    """returns the photo at path decoded at 1/reduce of its size (or None if it can't be read). With a proxy_dir the
+    reduced photo is read from its proxy there, which is written the first time the photo is read."""
+    if reduce == 1:
+        return cv2.imread(path)
+    if proxy_dir is None:
+        return cv2.imread(path, REDUCE_FLAGS[reduce])
+    proxy = proxy_path(proxy_dir=proxy_dir, key=key, reduce=reduce)
+    img = cv2.imread(proxy) if os.path.isfile(proxy) else None
+    if img is None:
+        img = cv2.imread(path, REDUCE_FLAGS[reduce])
+        if img is not None:
+            os.makedirs(os.path.dirname(proxy), exist_ok=True)
+            # written under a temporary name first so that a reader never sees a partial proxy
+            tmp = f"{proxy[:-4]}.{os.getpid()}.{threading.get_ident()}.jpg"
+            if cv2.imwrite(tmp, img, [cv2.IMWRITE_JPEG_QUALITY, PROXY_QUALITY]):
+                os.replace(tmp, proxy)
+    return img
+
+
+def build_proxies(photos, base_path: str, proxy_dir: str, reduce: int, workers: int = 4):
+    """writes the missing proxies of a photos data frame (path and md5hash columns) in a thread pool"""
+    todo = photos.drop_duplicates(subset='md5hash')
+    todo = [(os.path.join(base_path, p).replace('\\', '/'), h) for p, h in zip(todo['path'], todo['md5hash'])
+            if not os.path.isfile(proxy_path(proxy_dir=proxy_dir, key=h, reduce=reduce))]
+    print(f"Building {len(todo)} photo proxies at 1/{reduce} size in {proxy_dir}...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # only whether each photo was read is kept, not the decoded photos
+        read = pool.map(lambda x: read_proxy(path=x[0], key=x[1], proxy_dir=proxy_dir, reduce=reduce) is not None,
+                        todo)
+        failed = sum(not x for x in read)
+    secs = max(time.perf_counter() - start, 1e-6)
+    print(f"\t{len(todo) - failed} proxies built in {secs:.1f}s ({len(todo) / secs:,.0f} photos/s). {failed} photos "
+          f"could not be read.")
@@ -9,18 +9,44 @@ the photos in the database. Bounding boxes are drawn around an object to be rate
 boxes are saved in the database in the 'condition' and 'condition_seqs' tables.
 """
 
-import sqlite3 as sqlite
 import argparse
 import pandas
+import numpy as np
 import cv2
 import os
 import csv
 import copy
 import platform
+import re
+import time
+import functools
+import queue
+import atexit
+import threading
+import sqlite3 as sqlite
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from tzlocal import get_localzone
+from profiler import start_profile, profile_stage
+from connection import sqlite_con
+from image_cache import ImageCache, CACHE_MB
+from proxies import read_proxy, build_proxies, photo_size
 # from skimage import io  # use this version of imshow() to load remote file paths (http://)
 
+# threads reading and decoding photos ahead of the viewer
+PREFETCH_WORKERS = 4
+# upcoming sequences prefetched while the current one is scored, and how many of their first photos are decoded
+PREFETCH_SEQS = 2
+PREFETCH_FRAMES = 3
+# attempts to write a batch of scores while the database is locked, and the longest wait between them in seconds
+WRITE_RETRIES = 10
+WRITE_MAX_WAIT = 5
+CONDITION_SQL = '\n'.join((
+    "INSERT OR IGNORE INTO condition (md5hash, seq_id, rating, scorer_name, score_dt, bbox_x1, bbox_y1, bbox_x2, ",
+    "                                 bbox_y2) ",
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);"))
+CONDITION_SEQS_SQL = "INSERT OR IGNORE INTO condition_seqs (seq_id, scorer_name, scores) VALUES (?, ?, ?);"
+
 
 def decomment(csvfile):
     for row in csvfile:
@@ -37,24 +63,174 @@ def is_number(s):
         return False
 
 
-def get_sample(phtos, scored, base_path, do_random, start=0):
-    """returns the paths, md5hashes and seq_id for 1 randomly sampled row of the input database"""
-    unscored_photos = phtos[~phtos['seq_id'].isin(scored)]
-    if len(unscored_photos) == 0:
-        return None, None, None
-    if do_random:
-        sample = unscored_photos.sample(n=1)
-    else:
-        unscored_seqs = unscored_photos.groupby('seq_id', sort=False, as_index=False)['md5hash'].count()
-        n = start % len(unscored_seqs)  # allows us to cycle back to start even if start > length of df
-        sample = unscored_seqs.iloc[[n]]
-    sid = list(sample['seq_id'])[0]
-    samples = unscored_photos[(unscored_photos['seq_id'] == sample['seq_id'].iloc[0])]
-    samples = samples.sort_values(by=['site_name', 'camera_id', 'dt_orig'])
-    local_paths = list(samples['path'])
-    fp = [os.path.join(base_path, x).replace('\\', '/') for x in local_paths]
-    h = list(samples['md5hash'])
-    return fp, h, sid
+class SequenceIndex:
+    """the sequences of a photos data frame in the order they are sampled, with the rows of each sequence's photos in
+    viewing order. Sequences are taken in the order of the photos or, if do_random, in a random order drawn once with
+    each sequence weighted by its number of photos. Sequences are marked done once scored or skipped and a cursor
+    moves past them, so taking the next sequence is O(1) amortized."""
+    def __init__(self, photos, do_random=False, done=()):
+        photos = photos[photos['seq_id'].notna()]
+        codes, self.ids = pandas.factorize(photos['seq_id'])  # numbered by first appearance
+        rows = photos.assign(seq_no=codes).sort_values(by=['seq_no', 'site_name', 'camera_id', 'dt_orig'],
+                                                       kind='stable')
+        self.paths = rows['path'].to_numpy()
+        self.hashes = rows['md5hash'].to_numpy()
+        # photos of sequence i are rows starts[i] to starts[i + 1]
+        self.starts = np.searchsorted(rows['seq_no'].to_numpy(), np.arange(len(self.ids) + 1))
+        self.set_order(counts=np.diff(self.starts), do_random=do_random, done=done)
+
+    def set_order(self, counts, do_random, done):
+        """numbers the sequences in self.ids and sets the order they are taken in"""
+        self.number = {sid: i for i, sid in enumerate(self.ids)}
+        if do_random:
+            # a weighted random permutation (Efraimidis-Spirakis keys), as drawing one photo at a time would give
+            keys = np.random.default_rng().random(len(self.ids)) ** (1 / counts)
+            self.order = np.argsort(-keys)
+        else:
+            self.order = np.arange(len(self.ids))
+        self.done = {x for x in done if x in self.number}
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, sid):
+        return sid in self.number
+
+    def mark_done(self, sid):
+        self.done.add(sid)
+
+    def next(self):
+        """returns the first sequence at or after the cursor that is not done, or None if all are done"""
+        while self.cursor < len(self.order) and self.ids[self.order[self.cursor]] in self.done:
+            self.cursor += 1
+        return self.ids[self.order[self.cursor]] if self.cursor < len(self.order) else None
+
+    def upcoming(self, n=PREFETCH_SEQS):
+        """returns up to n sequences that are not done following the one next() returns"""
+        seqs = []
+        pos = self.cursor + 1
+        while len(seqs) < n and pos < len(self.order):
+            sid = self.ids[self.order[pos]]
+            if sid not in self.done:
+                seqs.append(sid)
+            pos += 1
+        return seqs
+
+    def photos(self, sid, base_path):
+        """returns the full paths and md5hashes of the photos of a sequence in viewing order"""
+        i = self.number[sid]
+        paths = self.paths[self.starts[i]:self.starts[i + 1]]
+        fp = [os.path.join(base_path, x).replace('\\', '/') for x in paths]
+        h = list(self.hashes[self.starts[i]:self.starts[i + 1]])
+        return fp, h
+
+
+class LazySequenceIndex(SequenceIndex):
+    """a SequenceIndex over the result of a get_photos query that holds only the sequence ids and their photo counts.
+    The photos of a sequence are queried (through the animal seq_id index) when they are needed, so startup time and
+    memory depend on the number of sequences rather than the number of photos."""
+    def __init__(self, dbpath, sql, params, do_random=False, done=()):
+        self.dbpath = dbpath
+        self.params = list(params)
+        self.valid_sql = ' \n '.join(("WITH valid AS (", re.sub(r"\s*ORDER BY .+", "", sql, flags=re.S), ")"))
+        seq_sql = '\n'.join((
+            self.valid_sql,
+            "SELECT seq_id, count(*) AS n",
+            "  FROM valid",
+            " WHERE seq_id IS NOT NULL",
+            " GROUP BY seq_id",
+            " ORDER BY min(site_name), min(camera_id), min(dt_orig);"))
+        self.photo_sql = '\n'.join((
+            self.valid_sql,
+            "SELECT path, md5hash",
+            "  FROM valid",
+            " WHERE seq_id = ?",
+            " ORDER BY site_name, camera_id, dt_orig;"))
+        print("Reading in sequences from database...")
+        rows = sqlite_con(dbpath).execute(seq_sql, self.params).fetchall()
+        self.ids = np.array([x['seq_id'] for x in rows], dtype=object)
+        self.set_order(counts=np.array([x['n'] for x in rows]), do_random=do_random, done=done)
+        # the current and upcoming sequences are asked for more than once
+        self.fetch = functools.lru_cache(maxsize=4 * PREFETCH_SEQS)(self.fetch_photos)
+
+    def fetch_photos(self, sid):
+        rows = sqlite_con(self.dbpath).execute(self.photo_sql, self.params + [sid]).fetchall()
+        return tuple(x['path'] for x in rows), tuple(x['md5hash'] for x in rows)
+
+    def all_photos(self):
+        """returns the distinct paths and md5hashes of every photo matching the query in a data frame"""
+        sql = '\n'.join((self.valid_sql, "SELECT DISTINCT path, md5hash FROM valid;"))
+        return pandas.read_sql_query(sql, sqlite_con(self.dbpath), params=self.params)
+
+    def photos(self, sid, base_path):
+        paths, hashes = self.fetch(sid)
+        fp = [os.path.join(base_path, x).replace('\\', '/') for x in paths]
+        return fp, list(hashes)
+
+
+class ImagePrefetcher:
+    """reads and decodes photos in a thread pool ahead of when they are shown, into an ImageCache keyed by md5hash
+    with a budget of cache_mb. With cache_mb 0 photos are read when requested and not kept. Photos are decoded at
+    1/reduce of their size, through proxies in proxy_dir if given."""
+    def __init__(self, workers=PREFETCH_WORKERS, cache_mb=CACHE_MB, reduce=1, proxy_dir=None):
+        self.cache = ImageCache(max_bytes=cache_mb * 1024 * 1024) if cache_mb > 0 else None
+        self.reduce = reduce
+        self.proxy_dir = proxy_dir
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self.pending = {}  # md5hash: future of the decoded photo
+        self.found = {}  # path: future of whether the file exists
+
+    def read(self, path, key):
+        return read_proxy(path=path, key=key, proxy_dir=self.proxy_dir, reduce=self.reduce)
+
+    def decode(self, path, key):
+        return self.cache.put(key, self.read(path, key))
+
+    def prefetch(self, paths, hashes):
+        """starts decoding photos that are not already cached or in progress"""
+        if self.cache is None:
+            return
+        self.pending = {k: f for k, f in self.pending.items() if not f.done()}
+        for path, key in zip(paths, hashes):
+            if key not in self.pending and key not in self.cache:
+                self.pending[key] = self.pool.submit(self.decode, path, key)
+
+    def check(self, paths):
+        """starts checking that photos exist without waiting for the result"""
+        for path in paths:
+            if path not in self.found:
+                self.found[path] = self.pool.submit(os.path.isfile, path)
+
+    def missing(self, paths):
+        """returns the photos that do not exist"""
+        self.check(paths)
+        return [x for x in paths if not self.found[x].result()]
+
+    def imread(self, path, key):
+        """returns a copy of a decoded photo, waiting for it if it is still being read, or None if it can't be read"""
+        if self.cache is None:
+            return self.read(path, key)
+        img = self.cache.get(key)
+        if img is None:
+            future = self.pending.pop(key, None)
+            img = future.result() if future is not None and not future.cancelled() else self.decode(path, key)
+        # the viewer draws on the photo it is given, so the cached one is kept clean
+        return None if img is None else img.copy()
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        if self.cache is not None:
+            print(self.cache.report())
+            self.cache.clear()
+
+
+def add_date_columns(dbpath):
+    """adds the date_orig and mmdd_orig columns (and the other numeric date columns) that the date filters of get_photos
+    use to a database built before create_db.py created them"""
+    # imported here as only the date filters need create_db
+    from create_db import upgrade_epoch_columns
+    upgrade_epoch_columns(con=sqlite_con(dbpath))
 
 
 def get_photos(dbpath, animal=None, animal_not=None, animal_like=None, animal_not_like=None, date_range=None,
@@ -84,6 +260,7 @@ def get_photos(dbpath, animal=None, animal_not=None, animal_like=None, animal_no
             where.append("a.id NOT LIKE ?")
             param_list.extend([n])
     if date_range is not None:
+        add_date_columns(dbpath)
         date_where = []
         assert len(date_range) % 2 == 0, "Date range is not a multiple of 2."
         for i in range(0, int(len(date_range)/2)):
@@ -91,13 +268,14 @@ def get_photos(dbpath, animal=None, animal_not=None, animal_like=None, animal_no
             assert len(dates[0].split('-')) == len(dates[1].split('-')), \
                 'Date ranges are of different format.'
             assert 2 <= len(dates[0].split('-')) <= 3, "Date ranges given in incorrect format."
-            if len(date_range[0].split('-')) == 3:
-                date_where.append("date(substr(b.dt_orig, 1, 19)) BETWEEN ? AND ?")
-            elif len(date_range[0].split('-')) == 2:
-                date_where.append("strftime('%m-%d', date(substr(b.dt_orig, 1, 19))) BETWEEN ? AND ?")
+            # compared against the indexed integer YYYYMMDD / MMDD columns rather than parsing dt_orig
+            if len(dates[0].split('-')) == 3:
+                date_where.append("b.date_orig BETWEEN ? AND ?")
+            elif len(dates[0].split('-')) == 2:
+                date_where.append("b.mmdd_orig BETWEEN ? AND ?")
+            param_list.extend([int(x.replace('-', '')) for x in dates])
         date_wstr = '(' + ' OR '.join(date_where) + ')'
         where.append(date_wstr)
-        param_list.extend(date_range)
     if site_name is not None:
         where.append("b.site_name IN ({})".format(', '.join('?' * len(site_name))))
         param_list.extend(site_name)
@@ -115,14 +293,13 @@ def get_photos(dbpath, animal=None, animal_not=None, animal_like=None, animal_no
     sql += "\n ORDER BY b.site_name, b.camera_id, b.dt_orig;"
 
     if df:
-        conn = sqlite.connect(dbpath)
+        conn = sqlite_con(dbpath)
         if verbose:
             print("parameter list:", param_list)
-            conn.set_trace_callback(print)
+        conn.set_trace_callback(print if verbose else None)
 
         print("Reading in photos from database...")
         photos = pandas.read_sql_query(sql, conn, params=param_list)
-        conn.close()
         return sql, param_list, photos
     else:
         return sql, param_list, None
@@ -130,7 +307,7 @@ def get_photos(dbpath, animal=None, animal_not=None, animal_like=None, animal_no
 
 def construct_tables(dbpath):
     """constructs tables in the given database if they do not exist"""
-    conn = sqlite.connect(dbpath)
+    conn = sqlite_con(dbpath)
     c = conn.cursor()
     c.execute("CREATE TABLE IF NOT EXISTS condition (md5hash TEXT, seq_id TEXT, rating NUMERIC, "
               "scorer_name TEXT, score_dt DATETIME, bbox_x1 INTEGER, bbox_y1 INTEGER, bbox_x2 INTEGER, "
@@ -139,7 +316,6 @@ def construct_tables(dbpath):
     c.execute("CREATE TABLE IF NOT EXISTS condition_seqs (seq_id TEXT, scorer_name TEXT scores BOOLEAN, "
               "PRIMARY KEY(seq_id, scorer_name), FOREIGN KEY(seq_id) REFERENCES sequence(seq_id) ON DELETE CASCADE);")
     conn.commit()
-    conn.close()
 
 
 def construct_seq_list(csv_file, seqs):
@@ -164,12 +340,86 @@ def construct_seq_list(csv_file, seqs):
     return seqs
 
 
+class ScoreWriter(threading.Thread):
+    """stores scored sequences in the database from a background thread, so that scoring never waits on the disk.
+    Each flush writes every sequence queued so far in one transaction, retrying while the database is locked."""
+    def __init__(self, dbpath):
+        super().__init__(name='score_writer', daemon=True)
+        self.dbpath = dbpath
+        self.queue = queue.Queue()
+        self.failed = []  # sequences that could not be stored
+        self.error = None
+        self.closed = False
+        self.start()
+
+    def put(self, conditions, condition_seq):
+        """queues a sequence's condition rows and its condition_seqs row"""
+        self.queue.put((conditions, condition_seq))
+
+    def run(self):
+        con = sqlite_con(self.dbpath)
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            items = [x for x in batch if x is not None]
+            try:
+                if items:
+                    self.write(con, items)
+            except sqlite.Error as e:
+                self.error = e
+                self.failed.extend(items)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def write(self, con, items):
+        conditions = [row for rows, seq in items for row in rows]
+        seqs = [seq for rows, seq in items if seq is not None]
+        for attempt in range(1, WRITE_RETRIES + 1):
+            try:
+                c = con.cursor()
+                c.executemany(CONDITION_SQL, conditions)
+                c.executemany(CONDITION_SEQS_SQL, seqs)
+                con.commit()
+                return
+            except sqlite.OperationalError as e:
+                con.rollback()
+                if ('locked' not in str(e) and 'busy' not in str(e)) or attempt == WRITE_RETRIES:
+                    raise
+                if attempt == 1:
+                    print(f"\ndatabase is locked. Retrying to store {len(items)} scored sequences...")
+                time.sleep(min(0.1 * 2 ** attempt, WRITE_MAX_WAIT))
+
+    def flush(self):
+        """waits until every queued sequence has been written"""
+        self.queue.join()
+
+    def close(self):
+        """writes what is queued and stops the thread, reporting any sequences that could not be stored"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.join()
+        if self.failed:
+            print(len(self.failed), "scored sequences could not be stored:", self.error)
+            for rows, seq in self.failed:
+                print('\t', seq, rows)
+
+
 class RatePhotos:
     """constructs a photo viewer and rating system with mouse event derived bounding boxes for photos and stores the
     rating in the database."""
-    def __init__(self, photos, dbpath, basepath, name, win_name, random=True, score=True):
+    def __init__(self, photos, dbpath, basepath, name, win_name, random=True, score=True, cache_mb=CACHE_MB,
+                 reduce=1, proxy_dir=None):
         # passed parameters
-        self.photos = photos
+        self.photos = photos  # a data frame of get_photos, or a LazySequenceIndex of its query
         self.dbpath = dbpath
         self.basepath = basepath
         self.name = name
@@ -180,6 +430,12 @@ class RatePhotos:
         # image constructor
         self.img = None
         self.clone = None
+        self.prefetcher = ImagePrefetcher(cache_mb=cache_mb, reduce=reduce, proxy_dir=proxy_dir)
+        self.writer = ScoreWriter(dbpath=dbpath)
+        # stores what has been scored even if the session ends with an exception
+        atexit.register(self.close)
+        # photos are shown at about 1/scale of their size, so drawn boxes are scaled back up to the original when stored
+        self.scale = reduce
 
         # bounding box constructor
         self.refPt = []
@@ -201,15 +457,13 @@ class RatePhotos:
         # misc
         self.i = 0  # keeps track of image number in a set being currently viewed
         self.quit_script = False
-        self.set_start = 0  # keeps track of stored sets without ratings
         self.vis = None  # keeps track of main window visibility
         self.sys = platform.system()
 
         # sequences constructor
-        self.scored_seqs = None
-        self.photo_seqs = None
+        self.seqs = photos if isinstance(photos, SequenceIndex) else SequenceIndex(photos, do_random=random)
+        self.scored_seqs = None  # read from the database once, then kept up to date as sequences are stored
         self.skipped_seqs = []
-        self.scored_filt = None
         self.full_paths = None
         self.hashes = None
         self.seq_id = None
@@ -228,21 +482,20 @@ class RatePhotos:
         self.i = 0
 
     def get_scored(self):
-        """returns a list of scored sequences for a particular scorer"""
-        cnx = sqlite.connect(self.dbpath)
+        """returns a list of scored sequences for a particular scorer, including those still queued to be stored"""
+        self.writer.flush()
+        cnx = sqlite_con(self.dbpath)
         seq_sql = "SELECT * FROM condition_seqs WHERE scorer_name = ?;"
         scored = pandas.read_sql_query(seq_sql, cnx, params=[self.name])
         scr_seqs = list(scored['seq_id'])
-        cnx.close()
         return scr_seqs
 
     def get_animalid(self):
         """gets the animal id associated with a particular sequence"""
-        cnx = sqlite.connect(self.dbpath)
+        cnx = sqlite_con(self.dbpath)
         seq_sql = "SELECT * FROM sequence WHERE seq_id = ?;"
         animals_df = pandas.read_sql_query(seq_sql, cnx, params=[self.seq_id])
         animals = list(animals_df['id'])
-        cnx.close()
         return animals[0]
 
     def click_and_crop(self, event, x, y, flags, param):
@@ -284,11 +537,13 @@ class RatePhotos:
         """stores a bounding box in the list of bounding boxes"""
         path = self.full_paths[self.i]
         hash = self.hashes[self.i]
+        # the (width, height) the photo is shown at, which the box coordinates are in
+        size = (self.clone.shape[1], self.clone.shape[0])
         my_paths = [x.get('path') for x in self.iboxes]
         if path not in my_paths:
-            self.iboxes.append({'path': path, 'hash': hash, 'bbox': self.bbox})
+            self.iboxes.append({'path': path, 'hash': hash, 'bbox': self.bbox, 'size': size})
         else:
-            self.iboxes[:] = [{'path': path, 'hash': hash, 'bbox': self.bbox}
+            self.iboxes[:] = [{'path': path, 'hash': hash, 'bbox': self.bbox, 'size': size}
                               if x.get('path') == path else x for x in self.iboxes]
 
     def get_bbox(self):
@@ -308,18 +563,25 @@ class RatePhotos:
                 if b['col'] == self.col['value'] and b.get('score') is None:
                     b['score'] = scr
 
+    def original_box(self, coords, shown, path):
+        """returns the (x1, y1, x2, y2) of a box drawn between two corners on a photo shown at (width, height) in
+        the pixels of the original photo, clamped to its size"""
+        orig = photo_size(path) if self.scale > 1 else None
+        orig = orig or (shown[0] * self.scale, shown[1] * self.scale)
+        sx = orig[0] / shown[0]
+        sy = orig[1] / shown[1]
+        xs = [min(max(round(p[0] * sx), 0), orig[0] - 1) for p in coords]
+        ys = [min(max(round(p[1] * sy), 0), orig[1] - 1) for p in coords]
+        return min(xs), min(ys), max(xs), max(ys)
+
     def store_sequence(self, na=False):
-        """stores bounding boxes and scores from a scored sequence into the database"""
+        """queues bounding boxes and scores from a scored sequence to be stored in the database"""
         dt_now = datetime.now(get_localzone())
         cnt = 0
-        cnx = sqlite.connect(self.dbpath)
-        r = cnx.cursor()
-        isql = "INSERT OR IGNORE INTO condition (md5hash, seq_id, rating, scorer_name, score_dt, bbox_x1, bbox_y1, " \
-               "bbox_x2, bbox_y2) " \
-               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);"
-        ssql = "INSERT OR IGNORE INTO condition_seqs (seq_id, scorer_name, scores) VALUES (?, ?, ?);"
+        conditions = []
+        seq = None
         if na:
-            r.execute(ssql, (self.seq_id, self.name, False))
+            seq = (self.seq_id, self.name, False)
         else:
             for ibox in self.iboxes:
                 if ibox['bbox']:
@@ -327,60 +589,81 @@ class RatePhotos:
                         if b.get('score') is not None or not self.score:
                             # str_coords = ', '.join((str(b['coords'][0][0]), str(b['coords'][0][1]),
                             #                         str(b['coords'][1][0]), str(b['coords'][1][1])))
-                            x1 = min(b['coords'][0][0], b['coords'][1][0])
-                            y1 = min(b['coords'][0][1], b['coords'][1][1])
-                            x2 = max(b['coords'][0][0], b['coords'][1][0])
-                            y2 = max(b['coords'][0][1], b['coords'][1][1])
+                            x1, y1, x2, y2 = self.original_box(coords=b['coords'], shown=ibox['size'],
+                                                               path=ibox['path'])
                             params = (ibox.get('hash'), self.seq_id, b.get('score'), self.name, dt_now, x1, y1, x2, y2)
                             # print(params)
                             if x2 > x1 and y2 > y1:
-                                r.execute(isql, params)
+                                conditions.append(params)
                                 cnt += 1
             if cnt > 0:
-                r.execute(ssql, (self.seq_id, self.name, True))
-        cnx.commit()
-        cnx.close()
+                seq = (self.seq_id, self.name, True)
+        if conditions or seq is not None:
+            self.writer.put(conditions, seq)
+        if na or cnt > 0:
+            self.scored_seqs.add(self.seq_id)
+            self.seqs.mark_done(self.seq_id)
         return cnt
 
+    def close(self):
+        """stores the scores still queued and stops the background threads"""
+        if self.writer.closed:
+            return
+        self.writer.close()
+        self.prefetcher.close()
+
+    def skip_sequence(self):
+        """passes over the current sequence for the rest of the session"""
+        self.skipped_seqs.append(self.seq_id)
+        self.seqs.mark_done(self.seq_id)
+
     def get_next(self):
         """moves the images sequence onto the next available set"""
-        self.scored_seqs = self.get_scored()
-        self.photo_seqs = list(set(self.photos['seq_id']))
-        self.scored_filt = [x for x in self.photo_seqs if x in self.scored_seqs]
+        if self.scored_seqs is None:
+            self.scored_seqs = {x for x in self.get_scored() if x in self.seqs}
+            for sid in self.scored_seqs:
+                self.seqs.mark_done(sid)
         self.reset_vars()
         print('\n')
-        print(len(self.scored_filt), 'scored and', len(self.skipped_seqs), 'skipped out of',  len(self.photo_seqs),
+        print(len(self.scored_seqs), 'scored and', len(self.skipped_seqs), 'skipped out of',  len(self.seqs),
               'sequences within provided parameters')
-        seqs_to_skip = self.scored_seqs + self.skipped_seqs
-        self.full_paths, self.hashes, self.seq_id = get_sample(self.photos, seqs_to_skip, self.basepath,
-                                                               self.random, self.set_start)
-        if self.full_paths is None:
+        self.seq_id = self.seqs.next()
+        if self.seq_id is None:
             print("\nNo more unscored or unskipped images with given parameters. "
                   "Restart script to score any skipped sequences. Quitting...")
             self.quit_script = True
             return
         else:
+            self.full_paths, self.hashes = self.seqs.photos(self.seq_id, self.basepath)
             skip = False
             if self.basepath[0:4] != 'http':
-                for path in self.full_paths:
-                    if not os.path.isfile(path):
-                        print('Could not find', path)
-                        skip = True
+                for path in self.prefetcher.missing(self.full_paths):
+                    print('Could not find', path)
+                    skip = True
             if skip:
                 print('\nSkipping sequence', self.seq_id, '\n')
-                self.skipped_seqs.append(self.seq_id)
+                self.skip_sequence()
                 self.img = None
                 return
+        self.prefetcher.prefetch(self.full_paths, self.hashes)
+        self.prefetch_next()
 
         self.animal_id = self.get_animalid()
         print("'", self.animal_id, "' is current scoring target for ", len(self.full_paths), " photos (seq_id: ",
               self.seq_id, ")", sep='')
-        if self.full_paths[self.i][0:4] != 'http':
-            self.img = cv2.imread(self.full_paths[self.i])  # replace with sklearn imread() for http
-        else:
-            self.img = cv2.imread(self.full_paths[self.i])
+        # replace with sklearn imread() for http
+        self.img = self.prefetcher.imread(self.full_paths[self.i], self.hashes[self.i])
         self.clone = self.img.copy()
 
+    def prefetch_next(self):
+        """starts reading the first photos of the sequences that follow the current one, and checking that all of
+        their photos exist"""
+        for sid in self.seqs.upcoming():
+            paths, hashes = self.seqs.photos(sid, self.basepath)
+            self.prefetcher.prefetch(paths[:PREFETCH_FRAMES], hashes[:PREFETCH_FRAMES])
+            if self.basepath[0:4] != 'http':
+                self.prefetcher.check(paths)
+
     def start(self):
         """starts the image display and scoring window process"""
         while self.img is None and not self.quit_script:
@@ -418,7 +701,7 @@ class RatePhotos:
                     self.i = max(0, self.i-1)
                 elif self.key == ord(".") or self.raw_key == 2555904:
                     self.i = min(len(self.full_paths) - 1, self.i + 1)
-                self.img = cv2.imread(self.full_paths[self.i])
+                self.img = self.prefetcher.imread(self.full_paths[self.i], self.hashes[self.i])
                 self.clone = self.img.copy()
                 self.get_bbox()
                 for box in self.bbox:
@@ -474,8 +757,7 @@ class RatePhotos:
                     if recs > 0:
                         print(recs, "ratings stored.")
                     else:
-                        self.skipped_seqs.append(self.seq_id)
-                        self.set_start += 1
+                        self.skip_sequence()
                 if self.key == ord("q") or (self.vis < 1 and self.sys != 'Darwin'):
                     print('Quitting...')
                     self.quit_script = True
@@ -486,8 +768,9 @@ class RatePhotos:
                     self.get_next()
                 if self.quit_script:
                     break
-                self.img = cv2.imread(self.full_paths[self.i])
+                self.img = self.prefetcher.imread(self.full_paths[self.i], self.hashes[self.i])
                 self.clone = self.img.copy()
+        self.close()
         # cv2.destroyWindow(self.win_name)
         for i in range(1, 5):  # macos peculiarities with opencv may require this after the destroy call
             cv2.waitKey(1)
@@ -540,9 +823,34 @@ if __name__ == "__main__":
                         help='Add this flag to suppress scoring requirement for bounding boxes.')
     parser.add_argument('-r', '--random', action='store_true',
                         help='Add this flag to randomly sample from the sequences that match input criteria.')
-
+    parser.add_argument('-M', '--cache_mb', type=int, default=CACHE_MB,
+                        help='The memory in MB for decoded photos read ahead and kept for revisiting while scoring. 0 '
+                             'reads each photo when it is shown.')
+    parser.add_argument('-R', '--reduce', type=int, choices=[1, 2, 4, 8], default=1,
+                        help='Show photos at 1/reduce of their resolution, which decodes large photos much faster. '
+                             'Bounding boxes are still stored in original photo pixels.')
+    parser.add_argument('--proxy_dir',
+                        help='A folder in which to keep the reduced photos (by md5hash) so they are decoded from the '
+                             'original only once. Defaults to a "proxies" folder next to the database when --reduce is '
+                             'more than 1.')
+    parser.add_argument('--lazy', action='store_true',
+                        help='Read only the list of matching sequences at startup and query the photos of each '
+                             'sequence when it is shown, rather than reading every matching photo up front. Startup '
+                             'time and memory then do not grow with the number of photos matched.')
+    parser.add_argument('--build_proxies', action='store_true',
+                        help='Build the missing reduced photos of all sequences matching the criteria in parallel '
+                             'before scoring starts, rather than as each is first shown.')
+
+    parser.add_argument('--profile', nargs='?', const='sample_profile.json',
+                        help='time each stage and SQL statement, capture query plans and peak memory, and write a json '
+                             'report to this path (default sample_profile.json).')
+    parser.add_argument('--profile_top', type=int, default=20,
+                        help='the number of slowest statements to print with --profile.')
     args = parser.parse_args()
 
+    if args.profile:
+        start_profile(script='sample', out_path=args.profile, top=args.profile_top)
+
     if args.date_range:
         if len(args.date_range) % 2 != 0:
             print("date_range argument must by a multiple of two. Quitting...")
@@ -560,16 +868,32 @@ if __name__ == "__main__":
 
     # dbpath, animal = None, date_range = None, site_name = None, camera = None, seq_id = None, classifier = None,
     # verbose = False, df = True
-    my_sql, my_params, my_photos = get_photos(dbpath=args.dbpath, animal=args.animal, animal_not=args.animal_not,
-                                              animal_like=args.animal_like, animal_not_like=args.animal_not_like,
-                                              date_range=args.date_range, site_name=args.site_name, camera=args.camera,
-                                              seq_id=args.seq_id, classifier=args.classifier)
+    with profile_stage('get_photos'):
+        my_sql, my_params, my_photos = get_photos(dbpath=args.dbpath, animal=args.animal, animal_not=args.animal_not,
+                                                  animal_like=args.animal_like, animal_not_like=args.animal_not_like,
+                                                  date_range=args.date_range, site_name=args.site_name,
+                                                  camera=args.camera, seq_id=args.seq_id, classifier=args.classifier,
+                                                  df=not args.lazy)
+        if args.lazy:
+            my_photos = LazySequenceIndex(dbpath=args.dbpath, sql=my_sql, params=my_params, do_random=rnd)
     if len(my_photos) == 0:
         print("No photos match script criteria. Quitting...")
         quit()
+    if args.reduce > 1 and args.proxy_dir is None:
+        args.proxy_dir = os.path.join(os.path.dirname(os.path.abspath(args.dbpath)), 'proxies')
+    if args.build_proxies:
+        if args.reduce == 1:
+            print("--build_proxies needs a --reduce of more than 1 and will be ignored.")
+        else:
+            with profile_stage('build_proxies'):
+                build_proxies(photos=my_photos.all_photos() if args.lazy else my_photos,
+                              base_path=args.base_path, proxy_dir=args.proxy_dir,
+                              reduce=args.reduce, workers=max(PREFETCH_WORKERS, os.cpu_count() or 1))
     scenes = RatePhotos(photos=my_photos, dbpath=args.dbpath, basepath=args.base_path, name=args.scorer_name,
-                        win_name='image', random=rnd, score=(not args.no_score))
-    scenes.start()
+                        win_name='image', random=rnd, score=(not args.no_score), cache_mb=args.cache_mb,
+                        reduce=args.reduce, proxy_dir=args.proxy_dir)
+    with profile_stage('rate'):
+        scenes.start()
     cv2.destroyAllWindows()  # just in case
     for i in range(1, 5):  # macos peculiarities with opencv may require this after the destroy call
         cv2.waitKey(1)
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-17
+@author: Wade Lieurance
+
+This script will write a snapshot of a camera trap database to a directory of Parquet datasets, one per table plus a
+joined detection dataset (animal records with their photo, site, camera and sequence), or rebuild a database from such
+a snapshot. Rows are streamed in batches in both directions. Strings are dictionary encoded, so they read back as
+categoricals in pandas, and photo, detection and sequence datasets are partitioned by site_name (and year_orig) so
+analysts can read only the sites and years they need.
+"""
+
+import os
+import json
+import shutil
+import time
+import argparse
+import sqlite3 as sqlite
+import psycopg
+import psycopg.rows
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from urllib.parse import quote
+from datetime import datetime
+from photo_mgmt import create_db as cdb
+import create_db
+from export_animal import create_export_table
+from ledger import StageLedger, table_state
+from bulk import read_frame, load_rows, report_rate
+from connection import pg_con
+from typing import Union
+from getpass import getpass
+
+
+# tables in foreign key order, so that they can be loaded in this order
+SNAPSHOT_TABLES = ['import', 'hash', 'area', 'site', 'camera', 'photo', 'tag', 'season', 'season_watermark',
+                   'generation', 'sequence', 'sequence_gen', 'animal', 'animal_loc', 'condition_seqs', 'condition',
+                   'stage_ledger']
+PARTITIONS = {
+    'photo': ['site_name', 'year_orig'],
+    'detection': ['site_name', 'year_orig'],
+    'sequence': ['site_name'],
+}
+# columns of the detection dataset and the table each is taken from
+DETECTION_COLS = {
+    'p': ('photo', ['site_name', 'camera_id', 'year_orig', 'path', 'md5hash', 'dt_orig', 'dt_epoch']),
+    'a': ('animal', ['id', 'cnt', 'classifier', 'seq_id']),
+    's': ('sequence', ['seq', 'seq_part']),
+}
+STRING = pa.dictionary(pa.int32(), pa.string())
+HIVE_NULL = '__HIVE_DEFAULT_PARTITION__'
+
+
+def arrow_type(db_type: str) -> pa.DataType:
+    """maps a SQLite declared column type or a PostgreSQL information_schema data type to an arrow type. Strings (and
+    anything unrecognized) are dictionary encoded."""
+    t = (db_type or '').lower()
+    if t.startswith('timestamp'):
+        return pa.timestamp('us', tz='UTC') if 'with time zone' in t else pa.timestamp('us')
+    if 'int' in t:
+        return pa.int64()
+    if any(x in t for x in ['float', 'real', 'double', 'numeric', 'decimal']):
+        return pa.float64()
+    if 'bool' in t:
+        return pa.bool_()
+    if t == 'date':
+        return pa.date32()
+    if t in ('blob', 'bytea') or t.startswith(('point', 'multipolygon', 'geometry')):
+        return pa.binary()
+    return STRING
+
+
+def table_columns(con: Union[sqlite.Connection, psycopg.Connection], table: str) -> dict:
+    """returns {column: declared type} for a table, empty if the table does not exist"""
+    if isinstance(con, sqlite.Connection):
+        info = read_frame(con, f'PRAGMA table_info("{table}");')
+        if len(info) == 0:
+            return {}
+        return dict(zip(info['name'], info['type']))
+    elif isinstance(con, psycopg.Connection):
+        info = read_frame(con, "SELECT column_name, data_type FROM information_schema.columns "
+                               "WHERE table_schema = current_schema() AND table_name = %s ORDER BY ordinal_position;",
+                          (table,))
+        return dict(zip(info['column_name'], info['data_type']))
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+
+
+def to_array(values: list, typ: pa.DataType) -> pa.Array:
+    """converts a column of database values to an arrow array of typ. Values are only coerced one by one (e.g. SQLite
+    0/1 booleans, numbers stored in text columns or PostgreSQL decimals) if the column cannot be converted as is."""
+    try:
+        return pa.array(values, type=typ)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        if pa.types.is_string(typ):
+            convert = str
+        elif pa.types.is_boolean(typ):
+            convert = bool
+        elif pa.types.is_floating(typ):
+            convert = float
+        elif pa.types.is_integer(typ):
+            convert = int
+        elif pa.types.is_binary(typ):
+            convert = bytes
+        else:
+            raise
+        return pa.array([None if x is None else convert(x) for x in values], type=typ)
+
+
+def read_batches(con: Union[sqlite.Connection, psycopg.Connection], sql: str, schema: pa.Schema, batch: int):
+    """runs sql and yields its rows as arrow tables of up to batch rows, fetching (through a server side cursor on
+    PostgreSQL) one batch at a time. Dictionary columns of schema are read as plain strings (see encode)."""
+    if isinstance(con, sqlite.Connection):
+        c = con.cursor()
+    elif isinstance(con, psycopg.Connection):
+        c = con.cursor(name='snapshot', row_factory=psycopg.rows.tuple_row)
+    else:
+        raise ValueError("con must be either class psycopg.Connection or sqlite3.Connection.")
+    types = [pa.string() if pa.types.is_dictionary(f.type) else f.type for f in schema]
+    c.execute(sql)
+    while True:
+        rows = c.fetchmany(batch)
+        if not rows:
+            break
+        cols = list(zip(*rows))
+        yield pa.table([to_array(list(cols[i]), t) for i, t in enumerate(types)], names=schema.names)
+    c.close()
+
+
+def encode(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """dictionary encodes the string columns of table that are dictionary columns in schema. Done per file written so
+    that each file only holds the dictionary of its own rows."""
+    return pa.table([table.column(f.name).dictionary_encode() if pa.types.is_dictionary(f.type)
+                     else table.column(f.name) for f in schema if f.name in table.column_names],
+                    names=[x for x in schema.names if x in table.column_names])
+
+
+def write_dataset(con: Union[sqlite.Connection, psycopg.Connection], sql: str, schema: pa.Schema, out_dir: str,
+                  partitions: list = None, batch: int = 100000) -> int:
+    """streams the rows of sql into a Parquet dataset in out_dir (replacing any existing one), hive partitioned by the
+    partitions columns. sql must be ordered by the partition columns: each batch is written as it is fetched, one
+    file per run of rows sharing partition values. Returns the number of rows written."""
+    partitions = [x for x in (partitions or []) if x in schema.names]
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    n = 0
+    for i, t in enumerate(read_batches(con=con, sql=sql, schema=schema, batch=batch)):
+        keys = list(zip(*[t.column(x).to_pylist() for x in partitions])) if partitions else [()] * t.num_rows
+        start = 0
+        for j in range(1, t.num_rows + 1):
+            if j < t.num_rows and keys[j] == keys[start]:
+                continue
+            part_dir = os.path.join(out_dir, *[f"{k}={HIVE_NULL if v is None else quote(str(v), safe='')}"
+                                               for k, v in zip(partitions, keys[start])])
+            os.makedirs(part_dir, exist_ok=True)
+            part = encode(t.slice(start, j - start).drop_columns(partitions), schema)
+            pq.write_table(part, os.path.join(part_dir, f'part-{i}.parquet'), compression='zstd')
+            start = j
+        n += t.num_rows
+    return n
+
+
+def export_snapshot(con: Union[sqlite.Connection, psycopg.Connection], out_dir: str, tables: list = None,
+                    batch: int = 100000) -> dict:
+    """writes each existing table of tables (default SNAPSHOT_TABLES) and the detection dataset to out_dir, along
+    with a snapshot.json describing them. Returns the description."""
+    os.makedirs(out_dir, exist_ok=True)
+    meta = {'created': datetime.now().isoformat(sep=' ', timespec='seconds'),
+            'backend': 'sqlite' if isinstance(con, sqlite.Connection) else 'postgresql', 'datasets': {}}
+    for table in tables or SNAPSHOT_TABLES:
+        cols = table_columns(con=con, table=table)
+        if not cols:
+            continue
+        start = time.perf_counter()
+        schema = pa.schema([pa.field(k, arrow_type(v)) for k, v in cols.items()])
+        col_str = ', '.join([f'"{x}"' for x in cols])
+        parts = [x for x in PARTITIONS.get(table, []) if x in cols]
+        order = f" ORDER BY {', '.join(parts)}" if parts else ''
+        n = write_dataset(con=con, sql=f'SELECT {col_str} FROM "{table}"{order};', schema=schema,
+                          out_dir=os.path.join(out_dir, table), partitions=PARTITIONS.get(table), batch=batch)
+        meta['datasets'][table] = {'rows': n, 'partitions': parts,
+                                   'schema': {f.name: str(f.type) for f in schema}}
+        report_rate(table, n, start)
+
+    start = time.perf_counter()
+    fields = []
+    sel = []
+    for alias, (table, cols) in DETECTION_COLS.items():
+        types = table_columns(con=con, table=table)
+        fields += [pa.field(x, arrow_type(types.get(x))) for x in cols if x in types]
+        sel += [f'{alias}."{x}"' for x in cols if x in types]
+    sql = '\n'.join((
+        f"SELECT {', '.join(sel)}",
+        "  FROM animal AS a",
+        " INNER JOIN photo AS p ON a.md5hash = p.md5hash",
+        '  LEFT JOIN "sequence" AS s ON a.seq_id = s.seq_id',
+        f" ORDER BY {', '.join(['p.' + x for x in PARTITIONS['detection']])};"
+    ))
+    schema = pa.schema(fields)
+    n = write_dataset(con=con, sql=sql, schema=schema, out_dir=os.path.join(out_dir, 'detection'),
+                      partitions=PARTITIONS['detection'], batch=batch)
+    meta['datasets']['detection'] = {'rows': n, 'partitions': PARTITIONS['detection'],
+                                     'schema': {f.name: str(f.type) for f in schema}}
+    report_rate('detection', n, start)
+    with open(os.path.join(out_dir, 'snapshot.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def column_values(arr: pa.Array) -> list:
+    """returns the values of an arrow array as a list, decoding dictionary arrays first (which converts them to
+    python objects several times faster)"""
+    if pa.types.is_dictionary(arr.type):
+        arr = arr.dictionary_decode()
+    return arr.to_pylist()
+
+
+def open_dataset(snap_dir: str, name: str, meta: dict) -> ds.Dataset:
+    """opens a snapshot dataset, reading its hive partition columns back with their original types"""
+    info = meta['datasets'][name]
+    partitioning = None
+    if info['partitions']:
+        schema = pa.schema([pa.field(x, pa.int64() if info['schema'][x] == 'int64' else pa.string())
+                            for x in info['partitions']])
+        partitioning = ds.partitioning(schema, flavor='hive')
+    return ds.dataset(os.path.join(snap_dir, name), format='parquet', partitioning=partitioning)
+
+
+def import_snapshot(con: Union[sqlite.Connection, psycopg.Connection], snap_dir: str, batch: int = 100000):
+    """rebuilds an empty camera trap database from a snapshot written by export_snapshot. The tables are created as
+    create_db.py creates them and filled straight from the Parquet datasets in foreign key order; secondary indexes,
+    the export_animal_mat table and (on SQLite) the date triggers are only created once the rows are loaded."""
+    with open(os.path.join(snap_dir, 'snapshot.json')) as f:
+        meta = json.load(f)
+    backend = 'sqlite' if isinstance(con, sqlite.Connection) else 'postgresql'
+    if meta['backend'] != backend:
+        print(f"\tsnapshot was taken from {meta['backend']} and is being loaded into {backend}. Date columns may "
+              f"need converting.")
+    create_db.create_animal_tables(con=con)
+    create_db.create_animal_views(con=con)
+    StageLedger(con=con)  # creates stage_ledger
+    if table_state(con, 'photo') > 0:
+        raise ValueError("snapshots can only be imported into an empty database.")
+    c = con.cursor()
+    if isinstance(con, sqlite.Connection):
+        # loaded rows already have their date columns, so the triggers deriving them are recreated afterwards
+        for trigger in ['photo_epoch_insert', 'condition_epoch_insert']:
+            c.execute(f"DROP TRIGGER IF EXISTS {trigger};")
+        create_db.start_fast_load(con=con)
+    for table in [x for x in SNAPSHOT_TABLES if x in meta['datasets']]:
+        start = time.perf_counter()
+        target = table_columns(con=con, table=table)
+        dataset = open_dataset(snap_dir=snap_dir, name=table, meta=meta)
+        cols = tuple([x for x in dataset.schema.names if x in target])
+        n = 0
+        for b in dataset.to_batches(columns=list(cols), batch_size=batch):
+            n += load_rows(con=con, table=f'"{table}"', cols=tuple([f'"{x}"' for x in cols]),
+                           rows=zip(*[column_values(b.column(x)) for x in cols]))
+        con.commit()
+        report_rate(table, n, start)
+    if isinstance(con, sqlite.Connection):
+        create_db.create_epoch_columns(con=con)
+        if not create_db.finish_fast_load(con=con):
+            print("\tthe imported database failed its foreign key check.")
+    create_export_table(con=con)
+    create_db.create_indices(con=con)
+
+
+if __name__ == "__main__":
+    # parses script arguments
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='This script will write a camera trap database to a Parquet snapshot or rebuild one from it.')
+    # positional arguments
+    parser.add_argument('mode', choices=['export', 'import'],
+                        help='export a database to a snapshot or import a snapshot into a new database.')
+    parser.add_argument('snap_dir', help='the snapshot directory to write to or read from.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--dbpath', help='the path of the spatialite database to export or create.')
+    group.add_argument('--db', help='the PostgreSQL database to which to connect.')
+    args_pg = parser.add_argument_group('PostgreSQL')
+    args_pg.add_argument('--host', default='localhost')
+    args_pg.add_argument('--user', default='postgres')
+    args_pg.add_argument('--port', default=5432, type=int)
+    args_pg.add_argument('--passwd', help="Password for user.")
+    args_pg.add_argument('--noask', action='store_true',
+                         help="User will not be prompted for password if none given.")
+    parser.add_argument('-o', '--overwrite', action='store_true',
+                        help='overwrite an existing database given with --dbpath when importing.')
+    parser.add_argument('-b', '--batch', type=int, default=100000,
+                        help='the number of rows to read and write at a time.')
+    parser.add_argument('-t', '--tables', nargs='+', help='export only these tables (default: all).')
+    args = parser.parse_args()
+
+    if args.dbpath:
+        if args.mode == 'import':
+            cdb.init_db_sqlite(dbpath=args.dbpath, overwrite=args.overwrite)
+        elif not os.path.isfile(args.dbpath):
+            print(args.dbpath, 'does not exist. quitting...')
+            quit()
+        conn = cdb.get_sqlite_con(dbpath=args.dbpath, geo=True)
+    else:
+        if args.passwd is None and not args.noask:
+            args.passwd = getpass()
+        if args.mode == 'import':
+            cdb.init_db_pg(user=args.user, database=args.db, password=args.passwd, host=args.host, port=args.port,
+                           geo=True)
+        conn = pg_con(user=args.user, database=args.db, password=args.passwd, host=args.host, port=args.port)
+    if args.mode == 'export':
+        print("Writing snapshot...")
+        export_snapshot(con=conn, out_dir=args.snap_dir, tables=args.tables, batch=args.batch)
+    else:
+        print("Importing snapshot...")
+        import_snapshot(con=conn, snap_dir=args.snap_dir, batch=args.batch)
+    conn.close()
+    print("Script complete.")
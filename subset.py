@@ -12,12 +12,13 @@ import argparse
 import os
 import copy
 import shutil
-import sqlite3 as sqlite
 import pandas
 import re
 from sample import get_photos, construct_seq_list
 from create_db import create_db, create_indices
 from generate_seqs import enclose_with_sql
+from profiler import start_profile, profile_stage
+from connection import sqlite_con
 
 
 def delete_photos(dbpath, sel_sql, params, verbose=False):
@@ -60,10 +61,9 @@ def delete_photos(dbpath, sel_sql, params, verbose=False):
         FROM camera
        WHERE camera.site_name = site.site_name
     );"""
-    conn = sqlite.connect(dbpath)
+    conn = sqlite_con(dbpath)
     c = conn.cursor()
-    if verbose:
-        conn.set_trace_callback(print)
+    conn.set_trace_callback(print if verbose else None)
     conn.execute('PRAGMA foreign_keys = ON;')
     print("deleting unselected photo records...")
     c.execute(delphoto_sql, params)
@@ -76,7 +76,9 @@ def delete_photos(dbpath, sel_sql, params, verbose=False):
     conn.commit()
     print('vacuuming database...')
     conn.execute("VACUUM;")
-    conn.close()
+    # restores the default for the next user of the shared connection
+    conn.execute('PRAGMA foreign_keys = OFF;')
+    conn.set_trace_callback(None)
 
 
 def copy_single(base_old, base_new, photo_path):
@@ -89,33 +91,27 @@ def copy_single(base_old, base_new, photo_path):
 
 def copy_photos(dbpath, base_old, base_new):
     sql = "SELECT * FROM photo;"
-    conn = sqlite.connect(dbpath)
+    conn = sqlite_con(dbpath)
     photos = pandas.read_sql_query(sql, conn)
     photos.apply(lambda row: copy_single(base_old, base_new, row['path']), axis=1)
-    conn.close()
 
 
 def get_srid(dbpath):
-    con = sqlite.connect(dbpath)
-    con.row_factory = sqlite.Row
-    con.enable_load_extension(True)
-    con.execute("SELECT load_extension('mod_spatialite')")
+    con = sqlite_con(dbpath, spatial=True)
     c = con.cursor()
     rows = c.execute("SELECT srid FROM geometry_columns WHERE f_table_name = 'camera'").fetchone()
     srid = list(rows)[0]
-    con.close()
     return srid
 
 
 def get_field_names(db, tbls):
-    con = sqlite.connect(db)
+    con = sqlite_con(db)
     c = con.cursor()
     d = {}
     for t in tbls:
         rows = c.execute(f"SELECT name FROM PRAGMA_TABLE_INFO('{t}');")
         fields = [list(x)[0] for x in rows.fetchall()]
         d[t] = fields
-    con.close()
     return d
 
 
@@ -125,10 +121,7 @@ def copy_data(orig_db, new_db, sql, params, tags=False):
             'sequence_gen', 'site', 'tag']
     valid_sql = re.sub(r"ORDER BY .+", "", sql)
     fields = get_field_names(db=orig_db, tbls=tbls)
-    con = sqlite.connect(orig_db)
-    con.row_factory = sqlite.Row
-    con.enable_load_extension(True)
-    con.execute("SELECT load_extension('mod_spatialite')")
+    con = sqlite_con(orig_db, spatial=True)
     c = con.cursor()
     c.execute("ATTACH DATABASE ? AS new;", (new_db,))
 
@@ -225,7 +218,7 @@ def copy_data(orig_db, new_db, sql, params, tags=False):
         " INNER JOIN new.sequence h ON a.seq_id = h.seq_id;"))
     c.execute(insert_sql)
     con.commit()
-    con.close()
+    c.execute("DETACH DATABASE new;")
 
 
 if __name__ == "__main__":
@@ -260,23 +253,37 @@ if __name__ == "__main__":
     parser.add_argument('-Q', '--seq_file',
                         help='The local path to a delimited file containing seq_ids to sample (1 per row, no header).')
     parser.add_argument('-t', '--tags', action='store_true', help='Copy photo EXIF tags from source database.')
+    parser.add_argument('--profile', nargs='?', const='subset_profile.json',
+                        help='time each stage and SQL statement, capture query plans and peak memory, and write a json '
+                             'report to this path (default subset_profile.json).')
+    parser.add_argument('--profile_top', type=int, default=20,
+                        help='the number of slowest statements to print with --profile.')
     args = parser.parse_args()
 
+    if args.profile:
+        start_profile(script='subset', out_path=args.profile, top=args.profile_top)
+
     if args.date_range:
         if len(args.date_range) % 2 != 0:
             print("date_range argument must by a multiple of two. Quitting...")
             quit()
     my_seqs = copy.deepcopy(args.seq_id)
     args.seq_id = construct_seq_list(args.seq_file, my_seqs)
-    my_sql, my_params, my_photos = get_photos(dbpath=args.dbpath, animal=args.animal, animal_not=args.animal_not,
-                                              animal_like=args.animal_like, animal_not_like=args.animal_not_like,
-                                              date_range=args.date_range, site_name=args.site_name, camera=args.camera,
-                                              seq_id=args.seq_id, classifier=args.classifier, verbose=False, df=False)
+    with profile_stage('get_photos'):
+        my_sql, my_params, my_photos = get_photos(dbpath=args.dbpath, animal=args.animal, animal_not=args.animal_not,
+                                                  animal_like=args.animal_like, animal_not_like=args.animal_not_like,
+                                                  date_range=args.date_range, site_name=args.site_name,
+                                                  camera=args.camera, seq_id=args.seq_id, classifier=args.classifier,
+                                                  verbose=False, df=False)
 
     with_sql = enclose_with_sql(sql=my_sql)
     srid = get_srid(dbpath=args.dbpath)
-    create_db(dbpath=args.new_dbpath, srid=srid, verbose=args.verbose)
-    copy_data(orig_db=args.dbpath, new_db=args.new_dbpath, sql=with_sql, params=my_params, tags=args.tags)
-    create_indices(dbpath=args.new_dbpath)
+    with profile_stage('create_db'):
+        create_db(dbpath=args.new_dbpath, srid=srid, verbose=args.verbose)
+    with profile_stage('copy_data'):
+        copy_data(orig_db=args.dbpath, new_db=args.new_dbpath, sql=with_sql, params=my_params, tags=args.tags)
+    with profile_stage('create_indices'):
+        create_indices(dbpath=args.new_dbpath)
     if args.new_base:
-        copy_photos(args.new_dbpath, args.base_path, args.new_base)
+        with profile_stage('copy_photos'):
+            copy_photos(args.new_dbpath, args.base_path, args.new_base)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-17
+@author: Wade Lieurance
+
+This script benchmarks the camera trap pipeline end to end on synthetic datasets (see synth_data.py) of several sizes.
+For each size it times generating the dataset, create_db.py (run as a user would, with the time of each of its stages
+taken from the stage_ledger table), rating a share of the sequences, sample.get_photos, generate_seqs.get_seqs,
+subset.copy_data and merge.merge_db on SQLite, and optionally the dataset and create_db.py stages on PostgreSQL. A
+stage that fails is recorded with its error and the benchmark moves on. Results are written to a json file, one
+record per backend, size and stage, along with the commit and versions they were measured on, so runs of different
+versions can be compared.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+import sqlite3 as sqlite
+from datetime import datetime
+from getpass import getpass
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import pandas as pd
+from photo_mgmt import create_db as cdb
+from bulk import read_frame
+from synth_data import generate, write_photo_db, add_ratings
+
+
+def timed(results: list, base: dict, stage: str, func, **kwargs):
+    """runs func(**kwargs) and appends a record of its time (and of the rows it returns, if a count) to results.
+    Errors are recorded rather than raised. Returns func's result, or None if it failed."""
+    start = time.perf_counter()
+    try:
+        out = func(**kwargs)
+    except Exception as e:
+        secs = time.perf_counter() - start
+        results.append({**base, 'stage': stage, 'seconds': round(secs, 4), 'rows': None, 'status': 'error',
+                        'error': f"{type(e).__name__}: {e}"})
+        print(f"\t{stage}: failed after {secs:.3f}s ({type(e).__name__}: {e})")
+        return None
+    secs = time.perf_counter() - start
+    rows = out if isinstance(out, int) and not isinstance(out, bool) else None
+    results.append({**base, 'stage': stage, 'seconds': round(secs, 4), 'rows': rows, 'status': 'ok', 'error': None})
+    print(f"\t{stage}: {secs:.3f}s" + (f" ({rows} rows)" if rows is not None else ''))
+    return out
+
+
+def run_create_db(db_args: list, data_dir: str, jobs: int = 1):
+    """runs create_db.py on a synthetic dataset, raising an error with the last line it printed to stderr if it
+    fails. Returns True."""
+    cmd = [sys.executable, os.path.join(REPO, 'create_db.py')] + db_args + [
+        '-s', os.path.join(data_dir, 'site.csv'), '-c', os.path.join(data_dir, 'camera.csv'),
+        '-a', os.path.join(data_dir, 'animal.csv'), '-j', str(jobs)]
+    proc = subprocess.run(cmd, cwd=REPO, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}")
+    return True
+
+
+def ledger_records(con, base: dict) -> list:
+    """returns a record per create_db stage from the stage_ledger table. Stages built by a parallel (--jobs) build
+    have no time of their own."""
+    ledger = read_frame(con, "SELECT stage, status, seconds FROM stage_ledger ORDER BY started, stage;")
+    return [{**base, 'stage': f"create_db.{r['stage']}",
+             'seconds': None if r['seconds'] != r['seconds'] or r['seconds'] is None else round(r['seconds'], 4),
+             'rows': None, 'status': 'ok' if r['status'] == 'done' else r['status'], 'error': None}
+            for r in ledger.to_dict('records')]
+
+
+def photo_count(con) -> int:
+    return int(read_frame(con, "SELECT count(*) AS n FROM photo;").iloc[0, 0])
+
+
+def bench_get_photos(dbpath: str) -> int:
+    from sample import get_photos
+    sql, params, photos = get_photos(dbpath=dbpath)
+    return len(photos)
+
+
+def bench_get_seqs(dbpath: str, seq_no: int) -> int:
+    """samples seq_no unrated sequences per site and camera, as generate_seqs.py -n seq_no --by_site --by_camera -f
+    would"""
+    from sample import get_photos
+    from generate_seqs import enclose_with_sql, limit_by_condition, limit_by_generated, get_seqs
+    sql, params, photos = get_photos(dbpath=dbpath, df=False)
+    sql = limit_by_generated(sql=limit_by_condition(sql=enclose_with_sql(sql=sql), filter_condition=True),
+                             filter_generated=False)
+    final_sql, final_params, seqs = get_seqs(dbpath=dbpath, sql=sql, params=params, seq_no=seq_no, by_site=True,
+                                             by_camera=True)
+    return len(seqs)
+
+
+def empty_db(dbpath: str):
+    """creates a new SQLite camera trap database with no rows"""
+    from create_db import create_animal_tables, create_animal_views
+    cdb.init_db_sqlite(dbpath=dbpath, overwrite=True)
+    con = cdb.get_sqlite_con(dbpath=dbpath, geo=True)
+    create_animal_tables(con=con)
+    create_animal_views(con=con)
+    con.close()
+
+
+def bench_copy_data(dbpath: str, new_dbpath: str, sites: list) -> int:
+    """copies the photos of sites to a new database, as subset.py -s <sites> would"""
+    from sample import get_photos
+    from generate_seqs import enclose_with_sql
+    from subset import copy_data
+    empty_db(dbpath=new_dbpath)
+    sql, params, photos = get_photos(dbpath=dbpath, site_name=sites, df=False)
+    copy_data(orig_db=dbpath, new_db=new_dbpath, sql=enclose_with_sql(sql=sql), params=params)
+    con = sqlite.connect(new_dbpath)
+    n = photo_count(con)
+    con.close()
+    return n
+
+
+def bench_merge_db(dbpath: str, dest: str) -> int:
+    """merges a database into a new empty one"""
+    from merge import merge_db
+    empty_db(dbpath=dest)
+    merge_db(source=dbpath, dest=dest)
+    con = sqlite.connect(dest)
+    n = photo_count(con)
+    con.close()
+    return n
+
+
+def bench_sqlite(out_dir: str, size: int, opts: dict, results: list):
+    """benchmarks every stage on a new SQLite dataset with size photos per camera"""
+    data_dir = os.path.join(out_dir, f'sqlite_{size}')
+    shutil.rmtree(data_dir, ignore_errors=True)
+    dbpath = os.path.join(data_dir, 'db.sqlite')
+    base = {'backend': 'sqlite', 'size': size, 'n_photo': opts['sites'] * opts['cameras'] * size}
+    print(f"SQLite, {size} photos per camera ({base['n_photo']} photos)...")
+
+    def make():
+        os.makedirs(data_dir)
+        cdb.init_db_sqlite(dbpath=dbpath, overwrite=True)
+        con = cdb.get_sqlite_con(dbpath=dbpath, geo=True)
+        n = write_photo_db(con=con, base_path=os.path.abspath(os.path.join(data_dir, 'photos')),
+                           rows=generate(out_dir=data_dir, sites=opts['sites'], cameras=opts['cameras'], photos=size,
+                                         images=opts['images'], seed=opts['seed']))
+        con.close()
+        return n
+
+    if timed(results, base, 'generate', make) is None:
+        return
+    if timed(results, base, 'create_db', run_create_db, db_args=['--dbpath', dbpath], data_dir=data_dir,
+             jobs=opts['jobs']) is None:
+        return
+    con = cdb.get_sqlite_con(dbpath=dbpath, geo=True)
+    results.extend(ledger_records(con=con, base=base))
+    timed(results, base, 'ratings', add_ratings, con=con, fraction=opts['ratings'], seed=opts['seed'])
+    con.close()
+    timed(results, base, 'get_photos', bench_get_photos, dbpath=dbpath)
+    timed(results, base, 'get_seqs', bench_get_seqs, dbpath=dbpath, seq_no=opts['seq_no'])
+    timed(results, base, 'copy_data', bench_copy_data, dbpath=dbpath,
+          new_dbpath=os.path.join(data_dir, 'subset.sqlite'),
+          sites=[f'site{s}' for s in range(0, opts['sites'], 2)])
+    timed(results, base, 'merge_db', bench_merge_db, dbpath=dbpath, dest=os.path.join(data_dir, 'merged.sqlite'))
+
+
+def bench_pg(out_dir: str, size: int, opts: dict, pg: dict, results: list):
+    """benchmarks generating a dataset and create_db.py in the PostgreSQL database <db>_<size>, which must not hold
+    any photos yet"""
+    data_dir = os.path.join(out_dir, f'pg_{size}')
+    shutil.rmtree(data_dir, ignore_errors=True)
+    database = f"{pg['database']}_{size}"
+    base = {'backend': 'postgresql', 'size': size, 'n_photo': opts['sites'] * opts['cameras'] * size}
+    print(f"PostgreSQL ({database}), {size} photos per camera ({base['n_photo']} photos)...")
+
+    def make():
+        cdb.init_db_pg(**{**pg, 'database': database}, geo=True)
+        con = cdb.get_pg_con(**{**pg, 'database': database})
+        n = write_photo_db(con=con, base_path=os.path.abspath(os.path.join(data_dir, 'photos')),
+                           rows=generate(out_dir=data_dir, sites=opts['sites'], cameras=opts['cameras'], photos=size,
+                                         images=opts['images'], seed=opts['seed']))
+        con.close()
+        return n
+
+    if timed(results, base, 'generate', make) is None:
+        return
+    db_args = ['--db', database, '--host', pg['host'], '--user', pg['user'], '--port', str(pg['port'])]
+    db_args += ['--passwd', pg['password']] if pg['password'] is not None else ['--noask']
+    if timed(results, base, 'create_db', run_create_db, db_args=db_args, data_dir=data_dir) is None:
+        return
+    con = cdb.get_pg_con(**{**pg, 'database': database})
+    results.extend(ledger_records(con=con, base=base))
+    timed(results, base, 'ratings', add_ratings, con=con, fraction=opts['ratings'], seed=opts['seed'])
+    con.close()
+
+
+def run_info() -> dict:
+    """returns the commit and versions a benchmark ran with"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {'created': datetime.now().isoformat(sep=' ', timespec='seconds'), 'commit': commit or None,
+            'python': platform.python_version(), 'sqlite': sqlite.sqlite_version, 'pandas': pd.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmarks the camera trap pipeline on synthetic datasets of several sizes.')
+    parser.add_argument('out_dir', help='the working directory to generate the datasets in.')
+    parser.add_argument('-o', '--out', default='bench_results.json', help='the json file to write the results to.')
+    parser.add_argument('-n', '--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='the dataset sizes to benchmark, in photos per camera.')
+    parser.add_argument('-s', '--sites', type=int, default=10, help='the number of sites in each dataset.')
+    parser.add_argument('-c', '--cameras', type=int, default=2, help='the number of cameras per site.')
+    parser.add_argument('-r', '--ratings', type=float, default=0.1, help='the share of sequences to rate.')
+    parser.add_argument('-q', '--seq_no', type=int, default=5,
+                        help='the number of sequences per site and camera for get_seqs to sample.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='the --jobs to run create_db.py with on SQLite.')
+    parser.add_argument('--no_images', action='store_true', help='do not write photo files.')
+    parser.add_argument('--keep', action='store_true', help='keep the generated datasets.')
+    parser.add_argument('--seed', type=int, default=1, help='the random seed.')
+    args_pg = parser.add_argument_group('PostgreSQL')
+    args_pg.add_argument('--db', help='also benchmark PostgreSQL, in databases named <db>_<size>.')
+    args_pg.add_argument('--host', default='localhost')
+    args_pg.add_argument('--user', default='postgres')
+    args_pg.add_argument('--port', default=5432, type=int)
+    args_pg.add_argument('--passwd', help="Password for user.")
+    args_pg.add_argument('--noask', action='store_true',
+                         help="User will not be prompted for password if none given.")
+    args = parser.parse_args()
+
+    if args.db and args.passwd is None and not args.noask:
+        args.passwd = getpass()
+    options = {'sites': args.sites, 'cameras': args.cameras, 'ratings': args.ratings, 'seq_no': args.seq_no,
+               'jobs': args.jobs, 'images': not args.no_images, 'seed': args.seed}
+    records = []
+    for n in sorted(args.sizes):
+        bench_sqlite(out_dir=args.out_dir, size=n, opts=options, results=records)
+        if args.db:
+            bench_pg(out_dir=args.out_dir, size=n, opts=options, results=records,
+                     pg={'user': args.user, 'database': args.db, 'password': args.passwd, 'host': args.host,
+                         'port': args.port})
+        if not args.keep:
+            for d in ('sqlite', 'pg'):
+                shutil.rmtree(os.path.join(args.out_dir, f'{d}_{n}'), ignore_errors=True)
+    with open(args.out, 'w') as f:
+        json.dump({**run_info(), 'options': options, 'results': records}, f, indent=2)
+    summary = pd.DataFrame(records)
+    print(summary.pivot_table(index=['backend', 'stage'], columns='size', values='seconds', sort=False).round(3)
+          .to_string())
+    print(f"Results written to {args.out}.")
+    print("Script complete.")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-16
+@author: Wade Lieurance
+
+This script benchmarks the SQL and numpy sequence numbering engines used by create_db.populate_sequences against an
+existing SQLite camera trap database and checks that they number every animal record identically. Only temporary
+tables are written and the transaction is rolled back, so the database is left as it was.
+"""
+import os
+import sys
+import time
+import argparse
+import sqlite3 as sqlite
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from create_db import mark_dirty_partitions, compute_sequence_rows, compute_sequence_rows_numpy
+from bulk import read_frame
+
+
+def run_engine(con, engine, sequence_break, max_photo):
+    """numbers the sequences of every partition with one engine, returning the elapsed seconds and the numbered rows"""
+    c = con.cursor()
+    c.execute("DROP TABLE IF EXISTS seq_rows_temp;")
+    start = time.perf_counter()
+    if engine == 'numpy':
+        compute_sequence_rows_numpy(con=con, sequence_break=sequence_break, max_photo=max_photo)
+    else:
+        compute_sequence_rows(con=con, sequence_break=sequence_break, max_photo=max_photo)
+    secs = time.perf_counter() - start
+    rows = read_frame(con, "SELECT md5hash, id, site_name, camera_id, seq, seq_part FROM seq_rows_temp;")
+    rows = rows.astype({'seq': int, 'seq_part': int}).sort_values(['md5hash', 'id']).reset_index(drop=True)
+    return secs, rows
+
+
+def bench(dbpath, sequence_break=60, max_photo=30, repeat=3):
+    con = sqlite.connect(dbpath)
+    n_dirty = mark_dirty_partitions(con=con, overwrite=True)
+    print(f"{n_dirty} site/camera/animal partitions.")
+    results = {}
+    for engine in ['sql', 'numpy']:
+        times = []
+        for i in range(repeat):
+            secs, rows = run_engine(con=con, engine=engine, sequence_break=sequence_break, max_photo=max_photo)
+            times.append(secs)
+        results[engine] = rows
+        print(f"{engine}: {len(rows)} rows, best of {repeat}: {min(times):.3f}s")
+    con.rollback()
+    con.close()
+    identical = results['sql'].equals(results['numpy'])
+    print("outputs identical." if identical else "outputs DIFFER.")
+    return identical
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmarks the SQL and numpy sequence engines on a SQLite camera trap database.')
+    parser.add_argument('dbpath', help='the path of the SQLite camera trap database to benchmark against.')
+    parser.add_argument('-B', '--sequence', type=int, default=60,
+                        help='the number of minutes without an animal id to use as a defining break point for a '
+                             'sequence.')
+    parser.add_argument('-m', '--max_photo', type=int, default=30,
+                        help='the maximum number of photos in a sequence before it is split into parts.')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='the number of timed runs per engine.')
+    args = parser.parse_args()
+
+    same = bench(dbpath=args.dbpath, sequence_break=args.sequence, max_photo=args.max_photo, repeat=args.repeat)
+    sys.exit(0 if same else 1)
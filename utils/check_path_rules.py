@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-17
+@author: Wade Lieurance
+
+This script checks that classify.PathRules assigns every path the same rules as searching it with each regex in turn
+(re.search), the way site and camera rules were originally applied. It runs a set of known cases (e.g. literals
+spanning a '/' that start at the beginning of a path) followed by random rule sets of literals and patterns on random
+paths, and prints the first paths assigned differently. It also checks that classify_sites and classify_cameras assign
+the sites and cameras of csvs read with pandas whose site names are numeric.
+"""
+import os
+import io
+import re
+import sys
+import random
+import argparse
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from classify import PathRules, classify_sites, classify_cameras
+
+# (rules, paths) pairs known to have been assigned wrongly at some point
+CASES = [
+    (('site1/cam', 'xx'), ['site1/cam2/a.jpg', 'site2/cam1/a.jpg', 'x/site1/cam1/b.jpg']),
+    (('ab/cd',), ['ab/cd.jpg', 'ab/cd/e.jpg', 'xab/cde/f.jpg', 'ab/c/d.jpg']),
+    (('Site A \\(2018\\)/Cam1', 'Site A', 'Cam1'), ['Site A (2018)/Cam1/IMG_0001.JPG', 'Site A/Cam1/IMG_0001.JPG']),
+    (('a', 'ab', 'b/c', 'ab/cd/ef'), ['ab/cd/ef/g.jpg', 'a/b/c.jpg', 'b/c', 'c.jpg']),
+]
+ALPHABET = 'abc/'
+
+
+def expected(regexes: tuple, path: str) -> tuple:
+    """returns the last and second to last rules matching path with re.search (-1 if none)"""
+    hits = [i for i in range(len(regexes) - 1, -1, -1) if regexes[i] is not None and re.search(regexes[i], path)]
+    return (hits + [-1, -1])[0], (hits + [-1, -1])[1]
+
+
+def random_rule(rng: random.Random) -> str:
+    lit = ''.join(rng.choice(ALPHABET) for i in range(rng.randint(1, 6)))
+    roll = rng.random()
+    if roll < 0.6:
+        return re.escape(lit)
+    if roll < 0.8:
+        return '^' + re.escape(lit)
+    return re.escape(lit) + '[ab]+'
+
+
+def random_path(rng: random.Random) -> str:
+    dirs = [''.join(rng.choice('abc') for j in range(rng.randint(1, 3))) for i in range(rng.randint(0, 3))]
+    return '/'.join(dirs + [''.join(rng.choice('abc') for j in range(rng.randint(1, 4))) + '.jpg'])
+
+
+def check(regexes: tuple, paths: list, limit: int = 10) -> int:
+    """returns the number of paths PathRules assigns differently from re.search, printing up to limit of them"""
+    rules = PathRules(regexes=regexes)
+    wrong = 0
+    for p in paths:
+        got = rules.match(p)
+        want = expected(regexes=regexes, path=p)
+        if got != want:
+            wrong += 1
+            if wrong <= limit:
+                print(f"rules {regexes} path {p!r}: got {got}, expected {want}")
+    return wrong
+
+
+def check_numeric_sites() -> int:
+    """returns the number of photos not assigned their site and camera when the site and camera csvs (read as
+    create_db.py reads them) have numeric site names"""
+    sites = pd.read_csv(io.StringIO("site_name,regex\n100,^100/\n101,^101/\n"), sep=',')
+    cameras = pd.read_csv(io.StringIO("site_name,camera_id,regex\n100,1,/c1/\n101,1,/c1/\n101,2,/c2/\n"), sep=',')
+    photo = pd.DataFrame({'path': ['100/c1/a.jpg', '101/c1/b.jpg', '101/c2/c.jpg']})
+    assigned = classify_sites(photo=photo, sites=sites)
+    assigned['camera_id'] = classify_cameras(photo=assigned[['path', 'site_name']], cameras=cameras)['camera_id']
+    wrong = 0
+    for row, want in zip(assigned.to_dict('records'), [('100', '1'), ('101', '1'), ('101', '2')]):
+        if (row['site_name'], row['camera_id']) != want:
+            wrong += 1
+            print(f"numeric sites, path {row['path']!r}: got {(row['site_name'], row['camera_id'])}, expected {want}")
+    return wrong
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Checks classify.PathRules against re.search on known and random rule sets, and site and camera '
+                    'assignment with numeric site names.')
+    parser.add_argument('-n', '--sets', type=int, default=500, help='the number of random rule sets to check.')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='the seed of the random rule sets.')
+    args = parser.parse_args()
+
+    r = random.Random(args.seed)
+    n_wrong = sum(check(regexes=rs, paths=ps) for rs, ps in CASES)
+    print(f"{len(CASES)} known cases: {n_wrong} paths assigned differently.")
+    n_numeric = check_numeric_sites()
+    print(f"numeric site names: {n_numeric} photos assigned the wrong site or camera.")
+    n_wrong += n_numeric
+    n_random = 0
+    for k in range(args.sets):
+        rule_set = tuple(random_rule(r) for i in range(r.randint(1, 8)))
+        n_random += check(regexes=rule_set, paths=[random_path(r) for i in range(50)])
+    print(f"{args.sets} random rule sets: {n_random} paths assigned differently.")
+    sys.exit(0 if n_wrong + n_random == 0 else 1)
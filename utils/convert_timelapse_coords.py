@@ -8,12 +8,17 @@ This is a script to convert count and animal coordinate data in timelapse format
 camera_trap database.  It is still in testing and will probably break in edge cases. It utilizes the
 (also in testing ) 'extract_timelapse.R' script in the utils folder for pre-processing.
 """
+import os
+import sys
 import pandas as pd
 import json
 import numpy as np
 from uuid import UUID
 from photo_mgmt.create_db import get_pg_con
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bulk import bulk_upsert
+
 # get animal data generated from the 'extract_coords_timelapse.R' utils script stored as json.
 animals = pd.read_json("my_path.json") \
     .assign(md5hash=lambda x: x.md5hash.map(UUID))
@@ -78,23 +83,20 @@ missing = cnt \
     .query('pghash.isna()')
 cnt_notmissing = cnt \
     .query('pghash.notna()')
-cnt_dict = cnt_notmissing.to_dict('records')
-isql = '\n'.join((
-    "INSERT INTO animal (md5hash, id, cnt, classifier) VALUES (%(md5hash)s, %(id)s, %(count)s, %(class_name)s)",
-    "ON CONFLICT ON CONSTRAINT animal_pkey DO UPDATE SET cnt=EXCLUDED.cnt, classifier=EXCLUDED.classifier;"
-))
-c.executemany(isql, cnt_dict)
-inserted = c.rowcount
+animal_rows = cnt_notmissing \
+    .rename(columns={'count': 'cnt', 'class_name': 'classifier'}) \
+    .loc[:, ['md5hash', 'id', 'cnt', 'classifier']]
+# COPY's into a staging table and upserts with ON CONFLICT ON CONSTRAINT animal_pkey DO UPDATE SET cnt, classifier
+inserted = bulk_upsert(con=con, table='animal', rows=animal_rows, keys=('md5hash', 'id'), constraint='animal_pkey')
 con.commit()
 
 # insert data into animal_loc table
-isql_loc = '\n'.join((
-    "INSERT INTO animal_loc (md5hash, id, classifier, x1, y1) VALUES ",
-    "(%(md5hash)s, %(id)s, %(class_name)s, %(x1)s, %(y1)s)",
-    "ON CONFLICT DO NOTHING;"
-))
-c.executemany(isql_loc, locs_dict)
-inserted_locs = c.rowcount
+loc_rows = locs2 \
+    .rename(columns={'class_name': 'classifier'}) \
+    .loc[:, ['md5hash', 'id', 'classifier', 'x1', 'y1']]
+# ON CONFLICT DO NOTHING
+inserted_locs = bulk_upsert(con=con, table='animal_loc', rows=loc_rows,
+                            keys=('md5hash', 'id', 'classifier', 'x1', 'y1'), update_cols=())
 con.commit()
 
 con.close()
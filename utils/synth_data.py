@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@created: 2026-10-17
+@author: Wade Lieurance
+
+This script generates a synthetic camera trap dataset for testing and benchmarking: a directory tree of tiny JPEG
+files (one per photo, 'Site <n> (<year>)/cam<n>/IMG_<n>.JPG'), the photo database an import of that tree would
+produce (import, hash and photo tables) and site, camera and animal csv files ready for create_db.py. Photos are taken
+in bursts separated by random gaps and a share of the bursts hold an animal drawn from a weighted species mix, with a
+bounding box on each photo. A share of the photos have no EXIF date (dt_orig is NULL), as create_db.py then falls
+back to the file date (dt_mod). The same seed always gives the same dataset.
+"""
+import os
+import sys
+import csv
+import time
+import random
+import hashlib
+import argparse
+import sqlite3 as sqlite
+import psycopg
+from datetime import datetime, timedelta
+from typing import Union
+from getpass import getpass
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from photo_mgmt import create_db as cdb
+from bulk import load_rows, read_frame, report_rate
+
+# a 64x48 baseline JPEG of a single color. Each photo gets its own comment segment so every file has its own md5hash.
+JPEG_TEMPLATE = bytes.fromhex(''.join((
+    'ffd8ffe000104a46494600010100000100010000ffdb004300100b0c0e0c0a100e0d0e1211101318281a181616183123251d283a333d3c',
+    '3933383740485c4e404457453738506d51575f626768673e4d71797064785c656763ffdb0043011112121815182f1a1a2f634238426363',
+    '636363636363636363636363636363636363636363636363636363636363636363636363636363636363636363636363ffc00011080030',
+    '004003012200021101031101ffc4001500010100000000000000000000000000000004ffc40014100100000000000000000000000000',
+    '000000ffc400160101010100000000000000000000000000000203ffc40014110100000000000000000000000000000000ffda000c0301',
+    '0002110311003f008c06290000000000000000000000000000000007ffd9')))
+IMG_WIDTH = 64
+IMG_HEIGHT = 48
+SPECIES = {'Odocoileus hemionus': 40, 'Cervus canadensis': 20, 'Canis latrans': 10, 'Lepus californicus': 15,
+           'Homo sapiens': 5, 'Equus ferus caballus': 10}
+IMPORT_DATE = '2026-01-01 00:00:00'
+
+
+def jpeg_bytes(comment: str) -> bytes:
+    """returns the template JPEG with a comment segment holding comment"""
+    text = comment.encode('utf-8')[:65000]
+    return JPEG_TEMPLATE[:2] + b'\xff\xfe' + (len(text) + 2).to_bytes(2, 'big') + text + JPEG_TEMPLATE[2:]
+
+
+def parse_species(text: str) -> dict:
+    """parses a species mix given as 'name=weight,name=weight'"""
+    mix = {}
+    for item in text.split(','):
+        name, weight = item.rsplit('=', 1)
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def burst_times(rng: random.Random, start: datetime, n: int, burst: int, burst_secs: int, gap: float) -> list:
+    """returns the times of n photos taken in bursts of 1 to burst photos burst_secs apart, the bursts starting an
+    exponentially distributed number of minutes (mean gap) after the last. Each item is (time, burst number)."""
+    times = []
+    t = start
+    b = 0
+    while len(times) < n:
+        t += timedelta(minutes=rng.expovariate(1 / gap))
+        for j in range(min(rng.randint(1, burst), n - len(times))):
+            times.append((t + timedelta(seconds=j * burst_secs), b))
+        t = times[-1][0]
+        b += 1
+    return times
+
+
+def random_box(rng: random.Random) -> str:
+    """returns an 'x1,y1,x2,y2' bounding box within the template image"""
+    x1 = rng.randrange(IMG_WIDTH - 8)
+    y1 = rng.randrange(IMG_HEIGHT - 8)
+    return f"{x1},{y1},{rng.randrange(x1 + 4, IMG_WIDTH)},{rng.randrange(y1 + 4, IMG_HEIGHT)}"
+
+
+def generate(out_dir: str, sites: int = 10, cameras: int = 2, photos: int = 500, burst: int = 3,
+             burst_secs: int = 2, gap: float = 240, detect: float = 0.6, species: dict = None, year: int = 2020,
+             no_exif: float = 0.05, images: bool = True, seed: int = 1):
+    """writes site.csv, camera.csv and animal.csv to out_dir and, if images is True, the photo files under
+    out_dir/photos. Yields one (path, fname, ftype, md5hash, dt_orig, dt_mod, dt_import) row per photo, paths being
+    relative to out_dir/photos. A share no_exif of the photos have no dt_orig."""
+    rng = random.Random(seed)
+    species = species or SPECIES
+    names = list(species.keys())
+    weights = list(species.values())
+    base = os.path.join(out_dir, 'photos')
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'site.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['site_name', 'state_code', 'regex'])
+        for s in range(sites):
+            writer.writerow([f'site{s}', 'NV', f'Site {s} \\({year}\\)'])
+    with open(os.path.join(out_dir, 'camera.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['site_name', 'camera_id', 'regex', 'lat', 'long', 'elev_m'])
+        for s in range(sites):
+            for k in range(1, cameras + 1):
+                writer.writerow([f'site{s}', str(k), f'/cam{k}/', round(rng.uniform(38, 42), 5),
+                                 round(rng.uniform(-118, -114), 5), round(rng.uniform(1200, 3000))])
+    with open(os.path.join(out_dir, 'animal.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['path', 'id', 'cnt', 'classifier', 'coords'])
+        for s in range(sites):
+            for k in range(1, cameras + 1):
+                folder = f"Site {s} ({year})/cam{k}"
+                if images:
+                    os.makedirs(os.path.join(base, folder), exist_ok=True)
+                start = datetime(year, 1, 1) + timedelta(days=rng.randrange(60))
+                detections = {}
+                for i, (t, b) in enumerate(burst_times(rng=rng, start=start, n=photos, burst=burst,
+                                                       burst_secs=burst_secs, gap=gap)):
+                    fname = f"IMG_{i:05d}.JPG"
+                    path = f"{folder}/{fname}"
+                    data = jpeg_bytes(comment=path)
+                    if images:
+                        with open(os.path.join(base, path), 'wb') as img:
+                            img.write(data)
+                    if b not in detections:
+                        detections[b] = (rng.choices(names, weights)[0], rng.randint(1, 3)) \
+                            if rng.random() < detect else None
+                    if detections[b] is not None:
+                        sp, cnt = detections[b]
+                        writer.writerow([path, sp, cnt, 'synth', '|'.join([random_box(rng) for j in range(cnt)])])
+                    dt = t.strftime('%Y-%m-%d %H:%M:%S')
+                    dt_orig = None if rng.random() < no_exif else dt
+                    yield path, fname, 'JPG', hashlib.md5(data).hexdigest(), dt_orig, dt, IMPORT_DATE
+
+
+def write_photo_db(con: Union[sqlite.Connection, psycopg.Connection], base_path: str, rows) -> int:
+    """creates the photo_mgmt tables and loads one import of base_path and its photo rows (see generate). The photo
+    table must be empty. Returns the number of photos loaded."""
+    cdb.create_tables(con=con, wipe=False, geo=True, verbose=False)
+    if int(read_frame(con, "SELECT count(*) AS n FROM photo;").iloc[0, 0]) > 0:
+        raise ValueError("the photo table already has rows. Use a new database.")
+    start = time.perf_counter()
+    load_rows(con=con, table='import', cols=('import_date', 'base_path', 'local'),
+              rows=[(IMPORT_DATE, base_path, True)])
+    rows = list(rows)
+    load_rows(con=con, table='hash', cols=('md5hash', 'import_date'), rows=[(x[3], IMPORT_DATE) for x in rows])
+    n = load_rows(con=con, table='photo', cols=('path', 'fname', 'ftype', 'md5hash', 'dt_orig', 'dt_mod', 'dt_import'),
+                  rows=rows)
+    con.commit()
+    report_rate('photo', n, start)
+    return n
+
+
+def add_ratings(con: Union[sqlite.Connection, psycopg.Connection], fraction: float, scorer: str = 'synth',
+                seed: int = 1) -> int:
+    """rates a random fraction of the sequences of a built database as a scorer would with sample.py, storing a
+    condition row (rating 1 to 5, with the animal's bounding box) for each photo of the sequence and the sequence in
+    condition_seqs. Returns the number of sequences rated."""
+    rng = random.Random(seed)
+    photos = read_frame(con, '\n'.join((
+        "SELECT a.seq_id, a.md5hash, min(l.x1) AS x1, min(l.y1) AS y1, max(l.x2) AS x2, max(l.y2) AS y2",
+        "  FROM animal a",
+        "  LEFT JOIN animal_loc l ON a.md5hash = l.md5hash AND a.id = l.id",
+        " WHERE a.seq_id IS NOT NULL",
+        " GROUP BY a.seq_id, a.md5hash",
+        " ORDER BY a.seq_id, a.md5hash;")))
+    seqs = sorted(photos['seq_id'].unique())
+    rated = set(rng.sample(seqs, k=round(len(seqs) * fraction)))
+    photos = photos[photos['seq_id'].isin(rated)]
+    scores = {x: rng.randint(1, 5) for x in sorted(rated)}
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    load_rows(con=con, table='condition_seqs', cols=('seq_id', 'scorer_name', 'scores'),
+              rows=[(x, scorer, True) for x in sorted(rated)])
+    load_rows(con=con, table='condition',
+              cols=('md5hash', 'seq_id', 'rating', 'scorer_name', 'score_dt', 'bbox_x1', 'bbox_y1', 'bbox_x2',
+                    'bbox_y2'),
+              rows=[(r['md5hash'], r['seq_id'], scores[r['seq_id']], scorer, now) +
+                    tuple([None if r[x] != r[x] else int(r[x]) for x in ('x1', 'y1', 'x2', 'y2')])
+                    for r in photos.to_dict('records')])
+    con.commit()
+    return len(rated)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Generates a synthetic camera trap dataset: photo files, a photo database and the site, camera '
+                    'and animal csv files used by create_db.py.')
+    parser.add_argument('out_dir', help='the directory to write the photos and csv files to.')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--dbpath', help='the path of the SQLite photo database to create (out_dir/db.sqlite if '
+                                        'neither it nor --db is given).')
+    group.add_argument('--db', help='the PostgreSQL database to load the photos into.')
+    args_pg = parser.add_argument_group('PostgreSQL')
+    args_pg.add_argument('--host', default='localhost')
+    args_pg.add_argument('--user', default='postgres')
+    args_pg.add_argument('--port', default=5432, type=int)
+    args_pg.add_argument('--passwd', help="Password for user.")
+    args_pg.add_argument('--noask', action='store_true',
+                         help="User will not be prompted for password if none given.")
+    parser.add_argument('-s', '--sites', type=int, default=10, help='the number of sites.')
+    parser.add_argument('-c', '--cameras', type=int, default=2, help='the number of cameras per site.')
+    parser.add_argument('-p', '--photos', type=int, default=500, help='the number of photos per camera.')
+    parser.add_argument('--burst', type=int, default=3, help='the largest number of photos taken per trigger.')
+    parser.add_argument('--burst_secs', type=int, default=2, help='the number of seconds between photos of a burst.')
+    parser.add_argument('--gap', type=float, default=240, help='the mean number of minutes between bursts.')
+    parser.add_argument('--detect', type=float, default=0.6, help='the share of bursts with an animal in them.')
+    parser.add_argument('--species', help="the species mix as 'name=weight,name=weight' (a mix of six western US "
+                                          "species by default).")
+    parser.add_argument('--no_exif', type=float, default=0.05,
+                        help='the share of photos without an EXIF date, dated by their file date only.')
+    parser.add_argument('--year', type=int, default=2020, help='the year the photos are taken in.')
+    parser.add_argument('--no_images', action='store_true', help='do not write the photo files.')
+    parser.add_argument('--seed', type=int, default=1, help='the random seed.')
+    args = parser.parse_args()
+
+    photo_rows = generate(out_dir=args.out_dir, sites=args.sites, cameras=args.cameras, photos=args.photos,
+                          burst=args.burst, burst_secs=args.burst_secs, gap=args.gap, detect=args.detect,
+                          species=parse_species(args.species) if args.species else None, year=args.year,
+                          no_exif=args.no_exif, images=not args.no_images, seed=args.seed)
+    os.makedirs(args.out_dir, exist_ok=True)
+    if args.db:
+        if args.passwd is None and not args.noask:
+            args.passwd = getpass()
+        cdb.init_db_pg(user=args.user, database=args.db, password=args.passwd, host=args.host, port=args.port, geo=True)
+        conn = cdb.get_pg_con(user=args.user, database=args.db, password=args.passwd, host=args.host, port=args.port)
+    else:
+        dbpath = args.dbpath or os.path.join(args.out_dir, 'db.sqlite')
+        cdb.init_db_sqlite(dbpath=dbpath, overwrite=True)
+        conn = cdb.get_sqlite_con(dbpath=dbpath, geo=True)
+    print("Generating photos...")
+    write_photo_db(con=conn, base_path=os.path.abspath(os.path.join(args.out_dir, 'photos')), rows=photo_rows)
+    conn.close()
+    print("Script complete.")
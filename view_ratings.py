@@ -1,6 +1,5 @@
 import tkinter as tk
 import tkinter.filedialog
-import sqlite3 as sqlite
 import pandas as pd
 import os
 import re
@@ -9,6 +8,9 @@ from PIL import ImageTk, Image
 from tkinter.font import Font
 from dateutil.parser import parse
 from matplotlib import colors
+from connection import sqlite_con
+from create_db import upgrade_epoch_columns
+from image_cache import ImageCache, CACHE_MB
 
 COLORS = [
     {'score': 1, 'label': 'red4', 'hex': '#8B0000'},
@@ -24,15 +26,17 @@ COLORS = [
 
 
 class PhotoViewer(tk.Tk):
-    def __init__(self, dbpath, photo_dir, title="Photo Viewer"):
+    def __init__(self, dbpath, photo_dir, title="Photo Viewer", cache_mb=CACHE_MB):
         super().__init__()
         self.title(title)
 
         # connect to db
         self.dbpath = dbpath
         self.photo_dir = photo_dir
-        self.con = sqlite.connect(self.dbpath)
-        self.con.row_factory = sqlite.Row
+        self.con = sqlite_con(self.dbpath)
+        # dates are read from the numeric date columns, which databases built before them lack
+        upgrade_epoch_columns(con=self.con)
+        self.cache = ImageCache(max_bytes=cache_mb * 1024 * 1024)
 
         # other vars
         self.rated_seqs = pd.DataFrame()
@@ -377,9 +381,8 @@ class PhotoViewer(tk.Tk):
 
     def get_seqs(self):
         print("getting rated sequences from db...")
-        # will also work:
-        # pd.read_sql_query(..., dtype="string")\
-        #   .assign(max_dt=lambda y: y.max_dt.map(lambda x: datetime.fromisoformat(x)))
+        # sequences are ordered by epoch (maintained by create_db.py). min_dt and max_dt are read as local wall clock
+        # times, without their UTC offset, for the date filter.
         self.rated_seqs = pd.read_sql_query(sql="""
         WITH rated_seqs AS (
         SELECT seq_id, group_concat(scorer_name, ', ') scorers 
@@ -387,11 +390,13 @@ class PhotoViewer(tk.Tk):
          GROUP BY seq_id
         )
          
-        SELECT a.*, b.site_name, b.camera_id, b.id, b.seq, b.min_dt, b.max_dt
+        SELECT a.*, b.site_name, b.camera_id, b.id, b.seq, b.min_dt, b.max_dt, b.min_epoch, b.max_epoch
           FROM rated_seqs a
           LEFT JOIN sequence b ON a.seq_id = b.seq_id
-         ORDER BY site_name, camera_id, min_dt;
-        """, con=self.con, parse_dates=['min_dt', 'max_dt'])
+         ORDER BY site_name, camera_id, min_epoch;
+        """, con=self.con)\
+            .assign(min_dt=lambda x: pd.to_datetime(x.min_dt.astype('string').str[:19]),
+                    max_dt=lambda x: pd.to_datetime(x.max_dt.astype('string').str[:19]))
 
         self.filtered_seqs = self.rated_seqs.copy()
         self.current_seq = self.filtered_seqs.seq_id[self.seq_no]
@@ -406,13 +411,14 @@ class PhotoViewer(tk.Tk):
          GROUP BY seq_id
         )
          
-        SELECT a.*, b.md5hash, b.id, b.cnt, b.classifier, b.coords,
-               c.path, c.site_name, c.camera_id, c.dt_orig 
+        SELECT a.*, b.md5hash, b.id, b.cnt, b.classifier,
+               c.path, c.site_name, c.camera_id, c.dt_epoch
           FROM rated_seqs a
           LEFT JOIN animal b ON a.seq_id = b.seq_id
           LEFT JOIN photo c ON b.md5hash = c.md5hash
-         ORDER BY c.site_name, c.camera_id, c.dt_orig;
-        """, con=self.con, parse_dates=['dt_orig'])
+         ORDER BY c.site_name, c.camera_id, c.dt_epoch;
+        """, con=self.con)\
+            .assign(dt_orig=lambda x: pd.to_datetime(x.dt_epoch, unit='s', utc=True))
         self.filtered_photos = self.photos.copy()
         self.get_sites()
 
@@ -420,19 +426,20 @@ class PhotoViewer(tk.Tk):
         print("getting ratings from db...")
         self.ratings = pd.read_sql_query(sql="""
         SELECT a.seq_id, a.scorer_name, a.scores,
-               b.md5hash, b.rating, b.score_dt, b.bbox_x1,
+               b.md5hash, b.rating, b.score_epoch, b.bbox_x1,
                b.bbox_y1, b.bbox_x2, b.bbox_y2
           FROM condition_seqs a
           LEFT JOIN condition b ON a.seq_id = b.seq_id AND a.scorer_name = b.scorer_name
          ORDER BY a.seq_id, b.md5hash, a.scorer_name;
-        """, con=self.con, parse_dates=['score_dt'])
+        """, con=self.con)\
+            .assign(score_dt=lambda x: pd.to_datetime(x.score_epoch, unit='s', utc=True))
         self.filtered_ratings = self.ratings.copy()
         self.get_scorers()
 
     def get_current_photos(self):
         print("getting current photos...")
         if self.filtered_seqs.shape[0] > 0:
-            self.current_photos = self.filtered_photos.query('seq_id in @self.current_seq').sort_values(by=['dt_orig'])
+            self.current_photos = self.filtered_photos.query('seq_id in @self.current_seq').sort_values(by=['dt_epoch'])
             print("current seq:", self.current_seq)
             print("current photo no", self.current_photos.shape[0])
             if self.current_photos.shape[0] > 0:
@@ -452,7 +459,7 @@ class PhotoViewer(tk.Tk):
         print("getting current ratings")
         self.current_ratings = self.filtered_ratings.\
             query('md5hash == @self.displayed_photo.md5hash').\
-            sort_values(by=['score_dt'])
+            sort_values(by=['score_epoch'])
         print(self.current_ratings)
 
     def get_sites(self):
@@ -502,7 +509,8 @@ class PhotoViewer(tk.Tk):
     def _refresh_img(self):
         self.canvas.delete("all")
         if self.displayed_photo.path:
-            self.img = Image.open(os.path.join(self.photo_dir, self.displayed_photo.path))
+            self.img = self.cache.load(self.displayed_photo.md5hash, self._open_img,
+                                       os.path.join(self.photo_dir, self.displayed_photo.path))
             self.orig_w, self.orig_h = self.img.size
             if self.w is None and self.h is None:
                 self.w, self.h = self.orig_w, self.orig_h
@@ -515,6 +523,12 @@ class PhotoViewer(tk.Tk):
         self._draw_ratings()
         self._reset_info()
 
+    @staticmethod
+    def _open_img(path):
+        img = Image.open(path)
+        img.load()  # decoded now so that the cached image no longer needs the file
+        return img
+
     def _reset_info(self):
         self.seq_str.set(f"{self.current_seq}")
         self.seq_entry['width'] = len(self.seq_str.get())
@@ -701,20 +715,17 @@ class PhotoViewer(tk.Tk):
         print(new_seq_filter, self.last_seq_filter)
         if new_seq_filter != self.last_seq_filter or force:
             print("seq_filter difference")
+            # filter dates are compared against each sequence's local wall clock time (min_dt and max_dt without
+            # their UTC offset), so a sequence falls on the same dates wherever its camera was
             if min_dt_allowed:
-                # creates a pandas Series where each date string filter has had the timezone of the values its being
-                # compared against replaced, thus we can compare the datetime in the df to a tz aware representation of
-                # the filter condition.
-                filter_dates_min = self.rated_seqs.min_dt.apply(lambda x: min_dt_allowed.replace(tzinfo=x.tzinfo))
-                query_list.append("min_dt >= @filter_dates_min")
+                query_list.append("min_dt >= @min_dt_allowed")
             if max_dt_allowed:
-                filter_dates_max = self.rated_seqs.max_dt.apply(lambda x: max_dt_allowed.replace(tzinfo=x.tzinfo))
-                query_list.append("max_dt <= @filter_dates_max")
+                query_list.append("max_dt <= @max_dt_allowed")
             if selected_sites:
                 query_list.append("site_name in @selected_sites")
             if query_list:
                 query_str = ' and '.join(query_list)
-                self.filtered_seqs = self.rated_seqs.query(query_str).sort_values(by=['min_dt']).reset_index()
+                self.filtered_seqs = self.rated_seqs.query(query_str).sort_values(by=['min_epoch']).reset_index()
             else:
                 self.filtered_seqs = self.rated_seqs.copy()
                 self.filtered_photos = self.photos.copy()